@@ -1,12 +1,21 @@
 #!/bin/bash
+# fix-repeats.py lists the files it changed here (relative to archives-text)
+MODIFIED_LIST="$(pwd)/fix-repeats-modified.txt"
 cd ../archives-text/
 echo "Currently in:"
 pwd
 echo "Checkout new branch"
 git checkout -b fix-repeats
-echo "Branch checked out, adding all files"
-git add -A
-echo "Added all files. Now committing"
+if [ -f "$MODIFIED_LIST" ]; then
+    echo "Branch checked out, adding the $(wc -l < "$MODIFIED_LIST") files fix-repeats.py changed"
+    git add --pathspec-from-file="$MODIFIED_LIST"
+else
+    echo "Branch checked out, adding all files"
+    # temp files fix-repeats.py (cloudsearch/atomic_writer.py) left behind if it was killed
+    find . -path ./.git -prune -o -type f -name '.*.tmp' -print -delete
+    git add -A
+fi
+echo "Added files. Now committing"
 git commit -m "archives-text-git.sh: fixed"
 echo "Checkedout new branch, pushing now"
 git push origin fix-repeats
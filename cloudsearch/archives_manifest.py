@@ -0,0 +1,148 @@
+"""
+builds and reads a manifest (index) of every article in archives-text, so that the
+tools don't have to os.listdir every YYYY/MM/DD/ directory on each run. On our NFS
+mount listing millions of files takes longer than the actual processing.
+
+build the manifest once (and again whenever files are added/removed in archives-text):
+    python archives_manifest.py ./archives-text/
+
+by default it's written next to the archives-text directory (e.g. ./archives-text.manifest.gz),
+not inside it, so it never ends up committed to the archives-text repo.
+
+format is gzipped, tab separated, one line per article, sorted by path:
+    YYYY/MM/DD    filename    article_type    size_in_bytes    mtime
+
+note: size and mtime are what they were when the manifest was built. Tools which rewrite
+articles (e.g. fix-repeats.py) don't update it, so rebuild if you need those to be exact.
+"""
+
+import os
+import gzip
+import argparse
+from collections import namedtuple
+
+
+MANIFEST_SUFFIX = '.manifest.gz'
+MANIFEST_HEADER = '# date\tfilename\tarticle_type\tsize\tmtime\n'
+
+ArticleEntry = namedtuple('ArticleEntry', ['year', 'month', 'day', 'filename', 'article_type', 'size', 'mtime'])
+
+def get_manifest_path(base_path):
+    return os.path.normpath(base_path) + MANIFEST_SUFFIX
+
+def get_entry_relpath(entry):
+    return '%s/%s/%s/%s' % (str(entry.year).zfill(4), str(entry.month).zfill(2), str(entry.day).zfill(2), entry.filename)
+
+def get_entry_path(base_path, entry):
+    return os.path.join(base_path, get_entry_relpath(entry))
+
+def get_article_type(filename):
+    filename_parts = filename.split('.')
+    if(len(filename_parts) < 3):
+        return ''
+    return filename_parts[1]
+
+# lists the numeric subdirectories (years, months or days) of path, same filtering the tools used to do
+def _list_numeric_dirs(path):
+    found = []
+    with os.scandir(path) as it:
+        for dir_entry in it:
+            if(not dir_entry.is_dir()):
+                continue
+            try:
+                found.append((int(dir_entry.name), dir_entry.path))
+            except ValueError:
+                continue
+    found.sort()
+    return found
+
+# walks archives-text exactly once, returns a sorted list of ArticleEntry
+def walk_archives_text(base_path):
+    entries = []
+    for year, year_path in _list_numeric_dirs(base_path):
+        for month, month_path in _list_numeric_dirs(year_path):
+            for day, day_path in _list_numeric_dirs(month_path):
+                with os.scandir(day_path) as it:
+                    for dir_entry in it:
+                        # hidden files aren't articles (.DS_Store, atomic_writer.py's temp files)
+                        if(not dir_entry.is_file() or dir_entry.name.startswith('.')):
+                            continue
+                        stat = dir_entry.stat()
+                        entries.append(ArticleEntry(year, month, day, dir_entry.name, get_article_type(dir_entry.name),
+                                                    stat.st_size, int(stat.st_mtime)))
+    entries.sort()
+    return entries
+
+def write_manifest(entries, manifest_path):
+    tmp_path = manifest_path + '.tmp'
+    with gzip.open(tmp_path, 'wt', encoding='utf-8') as f:
+        f.write(MANIFEST_HEADER)
+        for entry in entries:
+            f.write('%s/%s/%s\t%s\t%s\t%d\t%d\n' % (str(entry.year).zfill(4), str(entry.month).zfill(2), str(entry.day).zfill(2),
+                                                   entry.filename, entry.article_type, entry.size, entry.mtime))
+    os.replace(tmp_path, manifest_path) # so a killed build never leaves a truncated manifest behind
+
+def read_manifest(manifest_path):
+    entries = []
+    with gzip.open(manifest_path, 'rt', encoding='utf-8') as f:
+        for line in f:
+            if(line.startswith('#')):
+                continue
+            date, filename, article_type, size, mtime = line.rstrip('\n').split('\t')
+            year, month, day = date.split('/')
+            entries.append(ArticleEntry(int(year), int(month), int(day), filename, article_type, int(size), int(mtime)))
+    return entries
+
+def build_manifest(base_path, manifest_path=None):
+    if(manifest_path is None):
+        manifest_path = get_manifest_path(base_path)
+    entries = walk_archives_text(base_path)
+    write_manifest(entries, manifest_path)
+    return manifest_path, entries
+
+class Manifest:
+    """
+    year -> month -> day -> sorted article filenames, built from a list of ArticleEntry.
+    Lookups for years/months/days that aren't in the manifest return empty lists.
+    """
+    def __init__(self, entries):
+        self.entries = entries
+        self.tree = {}
+        for entry in entries:
+            self.tree.setdefault(entry.year, {}).setdefault(entry.month, {}).setdefault(entry.day, []).append(entry.filename)
+
+    def years(self):
+        return sorted(self.tree.keys())
+
+    def months(self, year):
+        return sorted(self.tree.get(year, {}).keys())
+
+    def days(self, year, month):
+        return sorted(self.tree.get(year, {}).get(month, {}).keys())
+
+    def articles(self, year, month, day):
+        return sorted(self.tree.get(year, {}).get(month, {}).get(day, []))
+
+    def __len__(self):
+        return len(self.entries)
+
+# loads the manifest for base_path. If it hasn't been built yet, walks the tree once in memory
+# (and doesn't write anything) so the tools still work, just slower.
+def load_manifest(base_path, manifest_path=None):
+    if(manifest_path is None):
+        manifest_path = get_manifest_path(base_path)
+    if(os.path.exists(manifest_path)):
+        return Manifest(read_manifest(manifest_path))
+    print('no manifest found at %s, walking %s instead. run `python archives_manifest.py %s` to build one.' % (manifest_path, base_path, base_path))
+    return Manifest(walk_archives_text(base_path))
+
+def main():
+    parser = argparse.ArgumentParser(description='build a manifest of every article in archives-text')
+    parser.add_argument('archives_text_path', nargs='?', default='./archives-text/')
+    parser.add_argument('manifest_path', nargs='?', default=None, help='defaults to ARCHIVES_TEXT_PATH%s' % MANIFEST_SUFFIX)
+    args = parser.parse_args()
+    manifest_path, entries = build_manifest(args.archives_text_path, args.manifest_path)
+    print('wrote %d articles (%d bytes of text) to %s' % (len(entries), sum(entry.size for entry in entries), manifest_path))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,210 @@
+"""
+packs all of archives-text into one file, and reads archives-text from either a directory or a pack.
+
+archives-text is millions of small files, and a full pass over it (uploading, fix-repeats, looking
+for author titles) spends most of its time opening, reading and closing them, which on FarmShare's
+shared filesystem is slow. A pack is a snapshot of the whole tree in one file:
+
+    PACK_MAGIC
+    every article's bytes, one after the other, in manifest order (sorted by path)
+    the index: one line per article, tab separated, same as the manifest plus where the article is
+        YYYY/MM/DD    filename    article_type    size_in_bytes    mtime    offset
+    the trailer: where the index starts and how long it is, then PACK_END
+
+build one (and again whenever archives-text changes, a pack doesn't follow the directory):
+    python article_pack.py ./archives-text/
+by default it's written next to the directory, as ./archives-text.pack.
+
+ArticlePack memory maps the pack, so reading articles one after the other is one long sequential
+read, and looking one up by (date, article number, article type) is a dict lookup and a slice.
+Nothing is read until it's used.
+
+open_archives_text(path) gives an ArticlePack if path is a pack and an ArchivesTextDirectory
+otherwise. Both have load_manifest(), open(relpath), read(relpath) and iter_articles(), so the
+tools take either one as their ARCHIVES_TEXT_PATH. Packs are read only: fix-repeats.py and
+corrections.py rewrite files, so they need the directory (pack it again afterwards).
+"""
+
+import os
+import mmap
+import struct
+import argparse
+from archives_manifest import ArticleEntry, Manifest, load_manifest, get_entry_relpath, get_entry_path
+
+
+PACK_SUFFIX = '.pack'
+PACK_MAGIC = b'archives-text pack 1\n'
+PACK_END = b'\npackend'
+TRAILER = struct.Struct('<QQ') # index offset, index length
+TRAILER_SIZE = TRAILER.size + len(PACK_END)
+
+def get_pack_path(base_path):
+    return os.path.normpath(base_path) + PACK_SUFFIX
+
+def is_pack(path):
+    if(not os.path.isfile(path)):
+        return False
+    with open(path, 'rb') as f:
+        return f.read(len(PACK_MAGIC)) == PACK_MAGIC
+
+# what an article is looked up by: its date, its number and its type (MODSMD_ARTICLE4.article.txt -> 'MODSMD_ARTICLE4', 'article')
+def get_article_key(year, month, day, article_number, article_type):
+    return (int(year), int(month), int(day), article_number, article_type)
+
+def get_entry_key(entry):
+    return get_article_key(entry.year, entry.month, entry.day, entry.filename.split('.')[0], entry.article_type)
+
+# writes every article in the manifest for base_path into one pack. returns (pack_path, entries)
+def build_pack(base_path, pack_path=None):
+    if(pack_path is None):
+        pack_path = get_pack_path(base_path)
+    manifest = load_manifest(base_path)
+    tmp_path = pack_path + '.tmp'
+    index_lines = []
+    entries = []
+    with open(tmp_path, 'wb') as f:
+        f.write(PACK_MAGIC)
+        for entry in manifest.entries:
+            with open(get_entry_path(base_path, entry), 'rb') as article:
+                data = article.read()
+            offset = f.tell()
+            f.write(data)
+            entry = entry._replace(size=len(data)) # the manifest's size may be older than the file
+            entries.append(entry)
+            index_lines.append('%s/%s/%s\t%s\t%s\t%d\t%d\t%d\n' % (str(entry.year).zfill(4), str(entry.month).zfill(2), str(entry.day).zfill(2),
+                                                                   entry.filename, entry.article_type, entry.size, entry.mtime, offset))
+        index = ''.join(index_lines).encode('utf-8')
+        index_offset = f.tell()
+        f.write(index)
+        f.write(TRAILER.pack(index_offset, len(index)))
+        f.write(PACK_END)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, pack_path) # so a killed build never leaves a truncated pack behind
+    return pack_path, entries
+
+class PackedArticleFile:
+    """
+    a read only binary file over one article in a pack, for Article (see article_reader.py).
+    reads come straight out of the memory map, so only the part that's read gets paged in.
+    """
+    def __init__(self, pack_map, start, size):
+        self.pack_map = pack_map
+        self.start = start
+        self.size = size
+        self.pos = 0
+
+    def read(self, size=-1):
+        end = self.size if size < 0 else min(self.size, self.pos + size)
+        data = self.pack_map[self.start + self.pos:self.start + end] if end > self.pos else b''
+        self.pos = max(self.pos, end)
+        return data
+
+    def seek(self, pos):
+        self.pos = pos
+        return pos
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class ArticlePack:
+    def __init__(self, pack_path):
+        self.path = pack_path
+        self.file = open(pack_path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        if(self.map[:len(PACK_MAGIC)] != PACK_MAGIC or self.map[-len(PACK_END):] != PACK_END):
+            raise ValueError('%s is not an archives-text pack (or it was cut short)' % pack_path)
+        index_offset, index_length = TRAILER.unpack(self.map[-TRAILER_SIZE:-len(PACK_END)])
+        self.entries = []
+        self.offsets = []
+        for line in self.map[index_offset:index_offset + index_length].decode('utf-8').splitlines():
+            date, filename, article_type, size, mtime, offset = line.split('\t')
+            year, month, day = date.split('/')
+            self.entries.append(ArticleEntry(int(year), int(month), int(day), filename, article_type, int(size), int(mtime)))
+            self.offsets.append(int(offset))
+        self.by_relpath = {get_entry_relpath(entry): i for i, entry in enumerate(self.entries)}
+        self.by_key = {get_entry_key(entry): i for i, entry in enumerate(self.entries)}
+
+    def load_manifest(self):
+        return Manifest(self.entries)
+
+    def _read_entry(self, i):
+        return self.map[self.offsets[i]:self.offsets[i] + self.entries[i].size]
+
+    # relpath: YYYY/MM/DD/filename, like in the directory. raises KeyError if it isn't in the pack
+    def read(self, relpath):
+        return self._read_entry(self.by_relpath[relpath])
+
+    def open(self, relpath):
+        i = self.by_relpath[relpath]
+        return PackedArticleFile(self.map, self.offsets[i], self.entries[i].size)
+
+    # the article's bytes, or None if there's no such article
+    def lookup(self, year, month, day, article_number, article_type):
+        i = self.by_key.get(get_article_key(year, month, day, article_number, article_type))
+        return None if i is None else self._read_entry(i)
+
+    # yields (entry, bytes) for every article, in the order they're in the pack
+    def iter_articles(self):
+        for i, entry in enumerate(self.entries):
+            yield entry, self._read_entry(i)
+
+    def get_path(self, relpath):
+        return os.path.join(self.path, relpath)
+
+    def close(self):
+        self.map.close()
+        self.file.close()
+
+class ArchivesTextDirectory:
+    """
+    the same interface as ArticlePack, for an archives-text directory (YYYY/MM/DD/*.txt)
+    """
+    def __init__(self, base_path):
+        self.path = base_path
+
+    def load_manifest(self):
+        return load_manifest(self.path)
+
+    def read(self, relpath):
+        with open(self.get_path(relpath), 'rb') as f:
+            return f.read()
+
+    def open(self, relpath):
+        return open(self.get_path(relpath), 'rb')
+
+    def iter_articles(self):
+        for entry in self.load_manifest().entries:
+            yield entry, self.read(get_entry_relpath(entry))
+
+    def get_path(self, relpath):
+        return os.path.join(self.path, relpath)
+
+    def close(self):
+        pass
+
+# path -> what open_archives_text returned for it. A pack's index is read once per process (before a Pool
+# forks, workers share the map), however many processors are made for it
+_OPEN_ARCHIVES = {}
+
+def open_archives_text(path):
+    if(path not in _OPEN_ARCHIVES):
+        _OPEN_ARCHIVES[path] = ArticlePack(path) if is_pack(path) else ArchivesTextDirectory(path)
+    return _OPEN_ARCHIVES[path]
+
+def main():
+    parser = argparse.ArgumentParser(description='pack every article in archives-text into one file')
+    parser.add_argument('archives_text_path', nargs='?', default='./archives-text/')
+    parser.add_argument('pack_path', nargs='?', default=None, help='defaults to ARCHIVES_TEXT_PATH%s' % PACK_SUFFIX)
+    args = parser.parse_args()
+    pack_path, entries = build_pack(args.archives_text_path, args.pack_path)
+    print('packed %d articles (%d bytes of text) into %s' % (len(entries), sum(entry.size for entry in entries), pack_path))
+
+if __name__ == '__main__':
+    main()
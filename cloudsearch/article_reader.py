@@ -0,0 +1,172 @@
+"""
+reads archives-text article files:
+
+    # title
+    ## subtitle
+    ### author
+    body...
+
+Article(path) doesn't read anything until it's asked for something. The header fields come from
+the first few hundred bytes of the file, and the body is only read (from where the header ends)
+and decoded when .body is used, so scanning titles or authors over the whole corpus doesn't read
+every article in full. Anything that needs both should call read_all() first, which reads the
+file once.
+
+with an archive (see article_pack.py) path is relative to it (YYYY/MM/DD/filename) and the file is
+read through it, so the same code reads articles out of a directory or a pack.
+
+lines are split the same way str.splitlines does (see text_normalizer.py).
+
+get_header_fields, get_body_text and get_file_fields pull out the fields an article is uploaded to
+cloudsearch with, so the uploader and the local search and suggest indexes all agree on them.
+get_article_fields does all of it for one article.
+"""
+
+import re
+import codecs
+from text_normalizer import split_header_lines, HEADER_LINES
+from author_titles import split_author_title
+from repeats import remove_repeats
+
+
+HEADER_READ_SIZE = 512
+HEADER_MARKERS = ['#', '##', '###']
+
+class Article:
+    # archive: an ArticlePack or ArchivesTextDirectory to read path from, or None if path is a file
+    def __init__(self, path, archive=None):
+        self.path = path
+        self.archive = archive
+        self._header_lines = None
+        self._body_offset = None # in bytes
+        self._body = None
+
+    def _open(self):
+        if(self.archive is None):
+            return open(self.path, 'rb')
+        return self.archive.open(self.path)
+
+    # reads from the start of the file until it has the three header lines and knows where the body starts
+    def _read_header(self):
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        text = ''
+        read_size = HEADER_READ_SIZE
+        with self._open() as f:
+            while(True):
+                chunk = f.read(read_size)
+                text += decoder.decode(chunk, final=(len(chunk) == 0))
+                lines, pos = split_header_lines(text)
+                # pos < len(text) so a '\r' at the end of what we've read can't be the first half of a '\r\n'
+                if(len(chunk) == 0 or (len(lines) == HEADER_LINES and pos < len(text))):
+                    break
+                read_size *= 2
+        self._header_lines = lines
+        self._body_offset = len(text[:pos].encode('utf-8'))
+
+    # reads the whole file in one go, for when the body is needed too
+    def read_all(self):
+        with self._open() as f:
+            text = f.read().decode('utf-8')
+        lines, pos = split_header_lines(text)
+        self._header_lines = lines
+        self._body_offset = len(text[:pos].encode('utf-8'))
+        self._body = text[pos:]
+        return self
+
+    # the header lines as they are in the file, without line breaks. fewer than three if the file is that short
+    @property
+    def header_lines(self):
+        if(self._header_lines is None):
+            self._read_header()
+        return self._header_lines
+
+    def has_full_header(self):
+        return len(self.header_lines) == HEADER_LINES
+
+    # indexes of the header lines that don't start with their # marker
+    def header_errors(self):
+        return [i for i, line in enumerate(self.header_lines) if not line.startswith(HEADER_MARKERS[i])]
+
+    # each field is its header line without the marker and the space after it (not stripped), or '' if the line is missing
+    def _header_field(self, i):
+        if(i >= len(self.header_lines)):
+            return ''
+        return self.header_lines[i][len(HEADER_MARKERS[i]) + 1:]
+
+    @property
+    def title(self):
+        return self._header_field(0)
+
+    @property
+    def subtitle(self):
+        return self._header_field(1)
+
+    @property
+    def author(self):
+        return self._header_field(2)
+
+    # everything after the header, as it is in the file
+    @property
+    def body(self):
+        if(self._body is None):
+            if(self._body_offset is None):
+                self._read_header()
+            with self._open() as f:
+                f.seek(self._body_offset)
+                self._body = f.read().decode('utf-8')
+        return self._body
+
+
+"""
+the fields an article is uploaded with
+"""
+# title, subtitle, author and author_title, with the whitespace collapsed. all '' if the header isn't all there.
+# only reads the header
+def get_header_fields(article):
+    if(article.has_full_header()):
+        title = re.sub(r'\s+', ' ', article.title.strip()) # get rid of extra whitespace
+        subtitle = re.sub(r'\s+', ' ', article.subtitle.strip())
+        author_raw = re.sub(r'\s+', ' ', article.author.strip())
+    else:
+        title = ''
+        subtitle = ''
+        author_raw = ''
+    author, authorTitle = split_author_title(author_raw)
+    return {'title': title, 'subtitle': subtitle, 'author': author, 'author_title': authorTitle}
+
+# the body with every line ending made '\n', before the repeats are taken out
+def get_body_text(article):
+    return ''.join(line + '\n' for line in article.body.splitlines())
+
+# article_type, article_number and publish_date, from where the file is in archives-text (YYYY/MM/DD/number.type.txt)
+def get_file_fields(year, month, day, filename):
+    filename_parts = filename.split('.')
+    return {
+        'article_type': filename_parts[1],
+        'article_number': filename_parts[0],
+        'publish_date': '%s-%s-%sT12:00:00Z' % (str(year).zfill(4), str(month).zfill(2), str(day).zfill(2)), # default set time to 12:00, since we don't care about that.
+    }
+
+# the cloudsearch document id, from get_file_fields' fields
+def get_document_id(fields):
+    return fields['publish_date'] + fields['article_type'] + str(fields['article_number'])
+
+# every field the uploader sends for an article, with the repeats removed. returns (fields, the Repeat removed or None)
+def get_article_fields(article, year, month, day, filename):
+    article.read_all()
+    articleText, repeat = remove_repeats(get_body_text(article))
+    return build_fields(articleText, get_header_fields(article), get_file_fields(year, month, day, filename)), repeat
+
+# puts the fields together in the order they've always been uploaded in, so the add requests (and their hashes
+# in sync_state.py) come out byte for byte the same
+def build_fields(articleText, header_fields, file_fields):
+    return {
+        'article_text': articleText,
+        'article_type': file_fields['article_type'],
+        'article_number': file_fields['article_number'],
+        'title': header_fields['title'],
+        'subtitle': header_fields['subtitle'],
+        'author': header_fields['author'],
+        'author_title': header_fields['author_title'],
+        'publish_date': file_fields['publish_date'],
+    }
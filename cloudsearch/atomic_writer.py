@@ -0,0 +1,110 @@
+"""
+rewrites files only when their contents actually change, and never leaves a half written file behind.
+
+fix-repeats.py used to open(path, 'w') every article it looked at. Most of them don't change
+(on a second run, none do), so that was millions of pointless writes, and a worker killed in
+the middle of one left a truncated article. Then archives-text-git.sh had to `git add -A` the
+whole tree to find the few files that did change.
+
+AtomicBatchWriter.write_if_changed compares the new bytes with what the file had and does nothing
+if they're the same. Otherwise the new bytes go to a hidden temp file next to the original
+(.FILENAME.tmp, skipped by archives_manifest.py), which gets the original's permissions. Every
+fsync_batch_size files we fsync the temp files, rename them over the originals and fsync each
+directory once, so the expensive part is done in batches. A crash before the rename leaves the
+original untouched, and maybe a temp file: the next write to that file reuses the name and replaces
+it, and archives-text-git.sh deletes any that are left before it adds the whole tree. After the
+rename, the new file is complete. Only one writer should be rewriting a given file at a time.
+
+the paths of the files that were replaced are appended to a list (one relative path per line),
+which is what archives-text-git.sh `git add`s instead of the whole tree. When several processes
+rewrite files, each keeps its own list in a directory and merge_modified_lists puts them together.
+"""
+
+import os
+import stat
+import shutil
+
+
+FSYNC_BATCH_SIZE = 256
+TEMP_SUFFIX = '.tmp'
+
+def get_temp_path(path):
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, '.%s%s' % (filename, TEMP_SUFFIX))
+
+# an empty directory for the workers' lists of modified files
+def reset_modified_list_dir(list_dir):
+    shutil.rmtree(list_dir, ignore_errors=True)
+    os.makedirs(list_dir)
+
+# merges every list in list_dir into one sorted list at list_path and removes list_dir. returns the number of paths
+def merge_modified_lists(list_dir, list_path):
+    relpaths = []
+    for name in sorted(os.listdir(list_dir)):
+        with open(os.path.join(list_dir, name), 'r') as f:
+            relpaths.extend(line.rstrip('\n') for line in f)
+    shutil.rmtree(list_dir)
+    relpaths.sort()
+    with open(list_path, 'w') as f:
+        for relpath in relpaths:
+            f.write(relpath + '\n')
+    return len(relpaths)
+
+class AtomicBatchWriter:
+    # modified_list_path: file the relative paths of replaced files get appended to, or None to not keep a list
+    def __init__(self, modified_list_path=None, fsync_batch_size=FSYNC_BATCH_SIZE):
+        self.modified_list_path = modified_list_path
+        self.fsync_batch_size = fsync_batch_size
+        self.pending = [] # (temp path, path, relpath)
+        self.stats = {'written': 0, 'unchanged': 0}
+
+    # returns True if the file is (going to be) replaced, False if it already has these bytes
+    def write_if_changed(self, path, data, original_data, relpath=None):
+        if(data == original_data):
+            self.stats['unchanged'] += 1
+            return False
+        temp_path = get_temp_path(path)
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        # os.replace keeps the temp file's permissions, not the original's
+        try:
+            os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode))
+        except FileNotFoundError:
+            pass # a new file
+        self.pending.append((temp_path, path, relpath if relpath is not None else path))
+        self.stats['written'] += 1
+        if(len(self.pending) >= self.fsync_batch_size):
+            self.flush()
+        return True
+
+    def flush(self):
+        if(len(self.pending) == 0):
+            return
+        # the files were closed after writing, so only their paths are kept; fsync works on a read only descriptor too
+        for temp_path, path, relpath in self.pending:
+            fd = os.open(temp_path, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        directories = set()
+        for temp_path, path, relpath in self.pending:
+            os.replace(temp_path, path)
+            directories.add(os.path.dirname(path) or '.')
+        # the renames aren't durable until their directories are synced
+        for directory in directories:
+            fd = os.open(directory, os.O_RDONLY)
+            try:
+                os.fsync(fd)
+            finally:
+                os.close(fd)
+        if(self.modified_list_path is not None):
+            with open(self.modified_list_path, 'a') as f:
+                for temp_path, path, relpath in self.pending:
+                    f.write(relpath + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+        self.pending = []
+
+    def close(self):
+        self.flush()
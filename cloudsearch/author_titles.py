@@ -0,0 +1,75 @@
+"""
+splits the author line of an article (### JOHN DOE SENIOR STAFF WRITER) into the author and their title.
+
+all the titles are compiled into one regex (shaped like a trie, see _build_trie_pattern) that
+runs once over the uppercased line and finds the leftmost title and, of the titles that start
+there, the longest one. 'SENIOR STAFF WRITER' beats 'STAFF WRITER' beats 'STAFF' no matter what
+order they're listed in.
+
+a title only counts if something comes before it (a line that is just 'STAFF WRITER' has no
+author to split off), same as the old `find(title) > 0` loops.
+"""
+
+import re
+
+
+# see find-author-titles-archives-text.py for looking for more of these
+AUTHOR_TITLES = ['SENIOR STAFF WRITER', 'STAFF WRITER', 'DESK EDITOR', 'CONTRIBUTING WRITER',
+'MANAGING EDITOR', 'EDITOR IN CHIEF', 'DEPUTY EDITOR', 'EXECUTIVE EDITOR', 'STAFF',
+'ASSU President', 'ASSU Parlimentarian', 'STAFF FOOTBALL WRITERS', 'FASHION COLUMNIST',
+'FOOTBALL EDITOR', 'ARTS EDITOR', 'FOOD EDITOR', 'FOOD DINING EDITOR', 'OPINIONS DESK',
+'FOOD DRUNK EDITOR', 'FELLOW', 'DAILY INTERN', 'CONTRIBUTING EDITOR', 'MANAGING WRITER',
+'GUEST COLUMNIST', 'SEX GODDESS', 'GUEST COLUMNISTS', 'EDITORIAL STAKE', 'CONTRIBUTING YANKEE',
+'SPECIAL CONTRIBUTOR', 'EDITORIAL BOARD', 'EDITORIAL STAFF', 'FILM CRITIC',
+'HEALTH EDITOR', 'ASSHOLE', 'INTERMISSION', 'NEWS EDITOR', 'CLASS PRESIDENT', 'ASSOCIATED PRESS',
+'AP SPORTS WRITER', 'AP BASEBALL WRITER', 'WEEKLY COLUMNIST', 'HEALTH COLUMNIST', 'ASSOCIATED EDITOR',
+'ASSOCIATE EDITOR', 'SPORTS EDITOR', 'EDITOR THE DAILY', ]
+
+# '' is what articles without a title get
+VALID_AUTHOR_TITLES = [''] + AUTHOR_TITLES
+
+# builds a regex out of a trie of the words, e.g. STAFF, STAFF WRITER, SPORTS EDITOR ->
+# S(?:PORTS EDITOR|TAFF(?: WRITER)?). At each position the regex engine only follows the branch
+# for the next character instead of trying every title, and the greedy ? tries the longer title first.
+def _build_trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = True # end of a word
+    return _trie_node_pattern(trie)
+
+def _trie_node_pattern(node):
+    branches = [re.escape(c) + _trie_node_pattern(node[c]) for c in sorted(node) if c != '']
+    if(len(branches) == 0):
+        return ''
+    pattern = branches[0] if len(branches) == 1 else '(?:%s)' % '|'.join(branches)
+    if('' in node):
+        pattern = '(?:%s)?' % pattern
+    return pattern
+
+# uppercased title -> the title as it's written in AUTHOR_TITLES
+_CANONICAL_TITLES = {title.upper(): title for title in AUTHOR_TITLES}
+_TITLE_PATTERN = re.compile(_build_trie_pattern(_CANONICAL_TITLES))
+# for the few lines where uppercasing changes the length ('ß' -> 'SS'), which would throw the index off
+_TITLE_PATTERN_IGNORECASE = re.compile(_TITLE_PATTERN.pattern, re.IGNORECASE)
+
+# returns (start index, canonical title) of the first title in author_raw after its first character, or None
+def find_author_title(author_raw):
+    author_upper = author_raw.upper()
+    if(len(author_upper) != len(author_raw)):
+        match = _TITLE_PATTERN_IGNORECASE.search(author_raw, 1)
+        return None if match is None else (match.start(), _CANONICAL_TITLES[match.group().upper()])
+    match = _TITLE_PATTERN.search(author_upper, 1)
+    if(match is None):
+        return None
+    return match.start(), _CANONICAL_TITLES[match.group()]
+
+# returns (author, author title). author is everything before the title (not stripped), title is '' if there isn't one
+def split_author_title(author_raw):
+    found = find_author_title(author_raw)
+    if(found is None):
+        return author_raw, ''
+    title_index, title = found
+    return author_raw[:title_index], title
@@ -0,0 +1,60 @@
+"""
+picks which documents go into each upload batch, so batches come out as close to the 5 mb limit
+as we can get them.
+
+closing a batch as soon as the next document doesn't fit leaves the rest of it empty, which around
+big advertisements and long articles can be hundreds of kb. Instead the uploader reads ahead into a
+window of encoded documents (about BATCH_WINDOW_FACTOR batches worth) and fills each batch from the
+whole window, first fit decreasing: biggest documents first, then whatever smaller ones still fit
+in the gaps. The oldest document in the window always goes in first, so none waits in the window
+for more than a couple of batches.
+
+documents that aren't uploaded (unchanged since the last upload, or too big) are candidates too,
+with no bytes, and go out with the next batch, so they're checkpointed with it (see
+upload_journal.py). Since they don't fill the window, it also stops at BATCH_WINDOW_FACTOR *
+MAX_BATCH_CANDIDATES candidates: under --incremental almost everything is unchanged, and without a
+limit the window would take in a whole chunk before the first batch was checkpointed. A batch covers articles from anywhere in the window, so its journal ranges are
+the runs of consecutive window positions it took, not one [first, last] range.
+"""
+
+from collections import namedtuple
+
+
+BATCH_WINDOW_FACTOR = 2 # batches worth of documents to read ahead
+MAX_BATCH_CANDIDATES = 10000 # several times the articles in a full 5 mb batch (about 2400), so in practice only a window of mostly skipped articles stops there
+
+# seq: position in the order the processor walked the articles. encoded: the document's add request
+# bytes, None if it isn't uploaded (skipped says why: 'unchanged' or 'too_big')
+BatchCandidate = namedtuple('BatchCandidate', ['seq', 'relpath', 'doc_id', 'doc_hash', 'encoded', 'skipped'])
+
+# returns (indexes into window of the candidates for this batch in window order, size of the batch in bytes).
+# batch_size counts the json array's brackets and commas, like the batch that gets sent
+def pack_batch(window, batch_size):
+    documents = [i for i, candidate in enumerate(window) if candidate.encoded is not None]
+    order = documents[:1] + sorted(documents[1:], key=lambda i: len(window[i].encoded), reverse=True)
+    chosen = set(i for i, candidate in enumerate(window) if candidate.encoded is None)
+    size = 2 # []
+    if(len(order) > 0):
+        chosen.add(order[0]) # even if it's bigger than a batch on its own, or we'd never get past it
+        size += len(window[order[0]].encoded)
+    smallest = min((len(window[i].encoded) for i in documents), default=0)
+    for i in order[1:]:
+        if(batch_size - size < smallest + 1):
+            break # nothing else can fit
+        needed = len(window[i].encoded) + 1 # and the comma before it
+        if(size + needed <= batch_size):
+            chosen.add(i)
+            size += needed
+    return sorted(chosen), size
+
+# [first relpath, last relpath] of every run of candidates that were next to each other in the walk
+def get_consumed_ranges(candidates):
+    ranges = []
+    last_seq = None
+    for candidate in sorted(candidates, key=lambda candidate: candidate.seq):
+        if(last_seq is not None and candidate.seq == last_seq + 1):
+            ranges[-1][1] = candidate.relpath
+        else:
+            ranges.append([candidate.relpath, candidate.relpath])
+        last_seq = candidate.seq
+    return ranges
@@ -0,0 +1,230 @@
+"""
+end to end benchmark of the processing pipeline, stage by stage, so we can tell whether a change
+to ArchivesTextProcessor, removeRepeats or the batching made a full run faster or slower.
+
+runs the real code (cloudsearch-process-and-upload.py and fix-repeats.py) over a corpus and times:
+    walk        listing the tree (archives_manifest.walk_archives_text), or reading a pack's index
+    read        reading every file once, cold-ish (first pass over the files)
+    read_parse  ArchivesTextProcessor.get_current_article_data, minus dedupe (files are warm by now)
+    dedupe      removeRepeats
+    serialize   building and json encoding the add requests
+    batch       the rest of batch assembly and walking the manifest
+    upload      upload_documents against an in process local_cloudsearch_server.py
+    fix_repeats fix-repeats.py's get_current_article_data (normalize + dedupe, nothing is written)
+each stage is timed exclusive of the stages it calls. The upload runs sequentially here so the
+stage times add up; the pipelined uploader overlaps parse and upload in real runs.
+
+results (seconds, articles/sec and MB/sec per stage) are appended to benchmark-results.jsonl and
+compared against the last run on the same corpus.
+
+    python benchmark.py ./synthetic-archives-text/ --generate --seed 1 --label "baseline"
+    python benchmark.py ./synthetic-archives-text/ --label "after removeRepeats change"
+
+the corpus can also be a pack of it (see article_pack.py), to compare the two:
+    python article_pack.py ./synthetic-archives-text/
+    python benchmark.py ./synthetic-archives-text.pack
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import tempfile
+import argparse
+import subprocess
+import importlib.util
+from archives_manifest import walk_archives_text, Manifest
+from article_pack import is_pack, open_archives_text
+from synthetic_corpus import SyntheticCorpusGenerator, load_words
+
+
+CLOUDSEARCH_DIR = os.path.dirname(os.path.abspath(__file__))
+RESULTS_PATH = './benchmark-results.jsonl'
+STAGES = ['walk', 'read', 'read_parse', 'dedupe', 'serialize', 'batch', 'upload', 'fix_repeats']
+
+# the scripts have dashes in their names, so they can't be imported the normal way
+def load_script(path, name):
+    spec = importlib.util.spec_from_file_location(name, path)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+class StageTimer:
+    """
+    wraps functions so their time is added to a stage. Time spent in a wrapped function called from
+    another wrapped function only counts towards the inner stage.
+    """
+    def __init__(self):
+        self.seconds = {}
+        self.stack = []
+
+    def add(self, stage, seconds):
+        self.seconds[stage] = self.seconds.get(stage, 0) + seconds
+
+    def wrap(self, fn, stage):
+        def timed(*args, **kwargs):
+            self.stack.append(0)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                child_seconds = self.stack.pop()
+                self.add(stage, elapsed - child_seconds)
+                if(len(self.stack) > 0):
+                    self.stack[-1] += elapsed
+        return timed
+
+class TimedClient:
+    def __init__(self, docClient, timer):
+        self.upload_documents = timer.wrap(docClient.upload_documents, 'upload')
+
+def run_upload_stages(uploader, base_path, entries, timer, docClient):
+    years = [entry.year for entry in entries]
+    processor = uploader.ArchivesTextProcessor(base_path, min(years), max(years) + 1, uploader.MAX_BATCH_SIZE,
+                                               TimedClient(docClient, timer), Manifest(entries))
+    processor.removeRepeats = timer.wrap(processor.removeRepeats, 'dedupe')
+    processor.get_current_article_data = timer.wrap(processor.get_current_article_data, 'read_parse')
+    processor.get_current_add_request_bytes = timer.wrap(processor.get_current_add_request_bytes, 'serialize')
+    upload_batch = timer.wrap(processor.upload_article_batch_to_cloudsearch, 'batch')
+    while(not processor.are_we_done()):
+        upload_batch()
+    processor.close()
+
+def run_fix_repeats_stage(fixRepeats, base_path, entries, timer):
+    years = [entry.year for entry in entries]
+    processor = fixRepeats.ArchivesTextProcessor(base_path, min(years), max(years) + 1, Manifest(entries))
+    get_data = timer.wrap(processor.get_current_article_data, 'fix_repeats')
+    while(not processor.are_we_done()):
+        get_data()
+        processor.move_to_next_article()
+
+def get_git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=CLOUDSEARCH_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def run_benchmark(base_path, upload_latency=0, skip_fix_repeats=False):
+    # the stub doesn't check signatures, but boto3 won't send unsigned requests
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    from cloudsearch_client import ClientFactory
+    from local_cloudsearch_server import start_server
+    uploader = load_script(os.path.join(CLOUDSEARCH_DIR, 'cloudsearch-process-and-upload.py'), 'cloudsearch_process_and_upload')
+    fixRepeats = load_script(os.path.join(CLOUDSEARCH_DIR, '..', 'fix-repeats.py'), 'fix_repeats')
+    log_path = tempfile.mkdtemp(prefix='benchmark-logs-')
+    uploader.LOG_PATH = log_path + '/'
+    server = start_server(latency=upload_latency)
+    docClient = ClientFactory(server.url).get_client()
+
+    timer = StageTimer()
+    run_start = time.perf_counter()
+    start = time.perf_counter()
+    archive = open_archives_text(base_path)
+    entries = archive.entries if is_pack(base_path) else walk_archives_text(base_path)
+    timer.add('walk', time.perf_counter() - start)
+    if(len(entries) == 0):
+        raise SystemExit('no articles found in %s' % base_path)
+
+    start = time.perf_counter()
+    for entry, data in archive.iter_articles():
+        pass
+    timer.add('read', time.perf_counter() - start)
+
+    run_upload_stages(uploader, base_path, entries, timer, docClient)
+    if(not skip_fix_repeats):
+        run_fix_repeats_stage(fixRepeats, base_path, entries, timer)
+    total_seconds = time.perf_counter() - run_start
+
+    server.shutdown()
+    shutil.rmtree(log_path, ignore_errors=True)
+    uploaded = server.cloudsearch.get_stats()
+    return build_report(entries, timer.seconds, total_seconds, uploaded)
+
+def build_report(entries, stage_seconds, total_seconds, uploaded):
+    articles = len(entries)
+    megabytes = sum(entry.size for entry in entries) / 1048576
+    stages = {}
+    for stage in STAGES:
+        if(stage not in stage_seconds):
+            continue
+        seconds = stage_seconds[stage]
+        stages[stage] = {
+            'seconds': round(seconds, 4),
+            'articles_per_second': round(articles / seconds, 1) if seconds > 0 else None,
+            'mb_per_second': round(megabytes / seconds, 2) if seconds > 0 else None,
+        }
+    return {
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'commit': get_git_commit(),
+        'corpus': {'articles': articles, 'megabytes': round(megabytes, 3)},
+        'total_seconds': round(total_seconds, 4),
+        'articles_per_second': round(articles / total_seconds, 1),
+        'mb_per_second': round(megabytes / total_seconds, 2),
+        'uploaded_documents': uploaded['adds'],
+        'upload_requests': uploaded['upload_requests'],
+        'stages': stages,
+    }
+
+def load_previous_report(results_path, corpus):
+    if(not os.path.exists(results_path)):
+        return None
+    previous = None
+    with open(results_path) as f:
+        for line in f:
+            report = json.loads(line)
+            if(report['corpus'] == corpus):
+                previous = report
+    return previous
+
+def format_change(current, previous):
+    if(previous is None or previous == 0):
+        return ''
+    return '%+.1f%%' % ((current - previous) / previous * 100)
+
+def print_report(report, previous):
+    print('corpus: %d articles, %.1f MB' % (report['corpus']['articles'], report['corpus']['megabytes']))
+    if(previous is not None):
+        print('comparing with %s run at %s (%s)' % (previous.get('label') or 'unlabelled', previous['time'], previous['commit']))
+    print('%-12s %10s %10s %14s %10s' % ('stage', 'seconds', 'change', 'articles/sec', 'MB/sec'))
+    for stage, result in report['stages'].items():
+        previous_seconds = previous['stages'].get(stage, {}).get('seconds') if previous is not None else None
+        print('%-12s %10.3f %10s %14s %10s' % (stage, result['seconds'], format_change(result['seconds'], previous_seconds),
+                                               result['articles_per_second'], result['mb_per_second']))
+    print('%-12s %10.3f %10s %14s %10s' % ('total', report['total_seconds'],
+                                           format_change(report['total_seconds'], previous['total_seconds'] if previous is not None else None),
+                                           report['articles_per_second'], report['mb_per_second']))
+    print('uploaded %d documents in %d requests' % (report['uploaded_documents'], report['upload_requests']))
+
+def main():
+    parser = argparse.ArgumentParser(description='benchmark the archives-text processing pipeline')
+    parser.add_argument('corpus_path', help='an archives-text tree, e.g. one made by synthetic_corpus.py')
+    parser.add_argument('--generate', action='store_true', help='(re)generate a synthetic corpus at corpus_path first')
+    parser.add_argument('--start-year', type=int, default=1900, help='with --generate')
+    parser.add_argument('--end-year', type=int, default=1901, help='with --generate')
+    parser.add_argument('--seed', type=int, default=1, help='with --generate; keep it fixed so runs are comparable')
+    parser.add_argument('--upload-latency', type=float, default=0, help='seconds the upload stub waits per request')
+    parser.add_argument('--skip-fix-repeats', action='store_true')
+    parser.add_argument('--label', default=None, help='stored with the results, e.g. what changed')
+    parser.add_argument('--results', default=RESULTS_PATH)
+    args = parser.parse_args()
+
+    if(args.generate):
+        shutil.rmtree(args.corpus_path, ignore_errors=True)
+        stats = SyntheticCorpusGenerator(load_words(), args.seed).generate(args.corpus_path, args.start_year, args.end_year)
+        print('generated %(articles)d articles and %(advertisements)d advertisements, %(bytes)d bytes' % stats)
+
+    report = run_benchmark(args.corpus_path, args.upload_latency, args.skip_fix_repeats)
+    report['label'] = args.label
+    previous = load_previous_report(args.results, report['corpus'])
+    print_report(report, previous)
+    with open(args.results, 'a') as f:
+        f.write(json.dumps(report) + '\n')
+    print('results appended to %s' % args.results)
+
+if __name__ == '__main__':
+    main()
@@ -4,71 +4,83 @@ data in 5 mb batches
 
 designed to be run in the cloudsearch/ directory
 
-you should check logs for jumps in years once done. If there are any, then it's likely the last year prior to the jump
-didn't successfully upload, and you'll have to reupload those years.
+failed or throttled batches are retried with backoff (see upload_retry.py), and every batch's
+article range and outcome is written to a checkpoint journal per year (see upload_journal.py).
+If a run crashes or gets killed, run again with --resume to skip every batch that already made it.
 '''
 
-import boto3
 import os
-import re
 import json
 from multiprocessing import Pool
 import time
+import argparse
+from functools import partial
+from article_pack import open_archives_text
+from sync_state import SyncState, SYNC_STATE_PATH, hash_document
+from upload_journal import UploadJournal, CHECKPOINT_PATH, clear_journals
+from upload_retry import upload_with_retry
+from upload_pipeline import UploadPipeline, MAX_UPLOAD_CONCURRENCY
+from work_scheduler import plan_chunks, filter_entries_by_year, get_chunk_manifest, describe_plan
+from repeats import remove_repeats
+from article_reader import Article, get_header_fields, get_body_text, get_file_fields, get_document_id, build_fields
+from cloudsearch_client import ClientFactory
+from json_logger import JsonLogger
+from pipeline_metrics import PipelineMetrics
+from batch_packer import BatchCandidate, pack_batch, get_consumed_ranges, BATCH_WINDOW_FACTOR, MAX_BATCH_CANDIDATES
+import pool_profiler
 
 
 DOC_ENDPOINT = 'https://doc-archives-text-cloudsearch-rba7owuzh6kn24pic2yudkawpe.us-east-1.cloudsearch.amazonaws.com'
-DOC_CLIENT = boto3.client('cloudsearchdomain', endpoint_url=DOC_ENDPOINT)
+DOC_CLIENTS = ClientFactory(DOC_ENDPOINT) # each process makes its client when it first uploads, see cloudsearch_client.py
 
 MAX_BATCH_SIZE = 5242880 # 5 MB
 MAX_FILE_SIZE = 1048576 # 1 MB
 
-ARCHIVES_TEXT_PATH = './archives-text/'
-LOG_PATH = './logs/'
+ARCHIVES_TEXT_PATH = './archives-text/' # or a pack of it, see article_pack.py
+LOG_PATH = './logs/' # one JSON lines log per year or chunk, see json_logger.py
+METRICS_PATH = './metrics/upload.prom' # per stage timings and counters of the last run, see pipeline_metrics.py
 
 VALID_ARTICLE_TYPES = ['article', 'advertisement',]
-VALID_AUTHOR_TITLES = ['', 'SENIOR STAFF WRITER', 'STAFF WRITER', 'DESK EDITOR', 'CONTRIBUTING WRITER', 
-'MANAGING EDITOR', 'EDITOR IN CHIEF', 'DEPUTY EDITOR', 'EXECUTIVE EDITOR', 'STAFF', 
-'ASSU President', 'ASSU Parlimentarian', 'STAFF FOOTBALL WRITERS', 'FASHION COLUMNIST', 
-'FOOTBALL EDITOR', 'ARTS EDITOR', 'FOOD EDITOR', 'FOOD DINING EDITOR', 'OPINIONS DESK',
-'FOOD DRUNK EDITOR', 'FELLOW', 'DAILY INTERN', 'CONTRIBUTING EDITOR', 'MANAGING WRITER',
-'GUEST COLUMNIST', 'SEX GODDESS', 'GUEST COLUMNISTS', 'EDITORIAL STAKE', 'CONTRIBUTING YANKEE',
-'SPECIAL CONTRIBUTOR', 'EDITORIAL BOARD', 'CONTRIBUTING WRITER', 'EDITORIAL STAFF', 'FILM CRITIC',
-'HEALTH EDITOR', 'ASSHOLE', 'INTERMISSION', 'NEWS EDITOR', 'CLASS PRESIDENT', 'ASSOCIATED PRESS',
-'AP SPORTS WRITER', 'AP BASEBALL WRITER', 'WEEKLY COLUMNIST', 'HEALTH COLUMNIST', 'ASSOCIATED EDITOR',
-'ASSOCIATE EDITOR', 'SPORTS EDITOR', 'EDITOR THE DAILY', ]
 
-# for multiprocessing; set this to a reasonable number.
-POOL_SIZE = 1 # note: large pools (>4 or 5) don't seem to mesh well w/ cloudsearch
-
-class Logger:
-    def __init__(self, path, basename):
-        self.fullpath = path + basename + '.log'
-        f = open(self.fullpath, 'w')
-        f.write("logger start\n")
-        f.close()
+# index of every article in ARCHIVES_TEXT_PATH, see archives_manifest.py. loaded once per run
+# (before the Pool forks, so workers share it instead of each listing directories)
+MANIFEST = None
 
-    def log(self, message):
-        f = open(self.fullpath, 'a') # open and close here for live updates
-        f.write(message + "\n")
-        f.close()
+def get_manifest():
+    global MANIFEST
+    if(MANIFEST is None):
+        MANIFEST = open_archives_text(ARCHIVES_TEXT_PATH).load_manifest()
+    return MANIFEST
 
-    def get_fullpath(self):
-        return self.fullpath
+# for multiprocessing; set this to a reasonable number.
+# note: large pools (>4 or 5) don't seem to mesh well w/ cloudsearch. Each process already overlaps parsing
+# with several concurrent uploads (see upload_pipeline.py), and that concurrency adjusts itself to throttling.
+POOL_SIZE = 1
 
-    def __del__(self):
-        f = open(self.fullpath, 'a') # open and close here for live updates
-        f.write("logger done\n")
-        f.close()
-        
 class ArchivesTextProcessor:
-    def __init__(self, base_path, startYear, endYear, batchSizeInBytes, docClient):
-        self.base_path = base_path
+    # syncState: optional SyncState. When given, documents that haven't changed since they were last uploaded are skipped
+    # journal: optional UploadJournal. Batches get recorded there, and articles it has as completed are skipped
+    # label: name for the log file, defaults to startYear
+    # metrics: PipelineMetrics the stages are timed into, by default one of its own
+    def __init__(self, base_path, startYear, endYear, batchSizeInBytes, docClient, manifest=None, syncState=None, journal=None, label=None, metrics=None):
+        self.archive = open_archives_text(base_path) # a directory or a pack, see article_pack.py
+        self.base_path = os.path.join(base_path, '') # paths are built by concatenation
+        self.manifest = manifest if manifest is not None else self.archive.load_manifest()
         self.startYear = startYear
         self.endYear = endYear
         self.batchSizeInBytes = batchSizeInBytes
         self.docClient = docClient
-        self.currentSizeInBytes = 0
-        self.logger = Logger(LOG_PATH, str(startYear))
+        self.syncState = syncState
+        self.journal = journal
+        self.currentArticleEncoded = None # cached add request bytes for the current article
+        self.currentArticleId = None
+        self.window = [] # BatchCandidates read ahead for the next batches, see batch_packer.py
+        self.windowBytes = 0 # encoded bytes in the window
+        self.windowSizeInBytes = BATCH_WINDOW_FACTOR * batchSizeInBytes
+        self.windowMaxCandidates = BATCH_WINDOW_FACTOR * MAX_BATCH_CANDIDATES # skipped articles don't add bytes
+        self.nextSeq = 0
+        self.logger = JsonLogger(LOG_PATH, label if label is not None else str(startYear))
+        self.metrics = metrics if metrics is not None else PipelineMetrics('upload')
         self.is_done = False
         print('logs outputted to %s' % self.logger.get_fullpath())
 
@@ -89,13 +101,18 @@ class ArchivesTextProcessor:
         self.currentArticle = None
         self.move_to_next_article()
 
+    # writes out what's left of the log
+    def close(self):
+        self.logger.close()
+
     def __del__(self):
-        del self.logger
+        self.close()
     '''
     the following are functions to help us iterate through the files in archives-text
     '''
+    # done once every article has been walked and everything read ahead has gone into a batch
     def are_we_done(self):
-        return self.is_done
+        return self.is_done and len(self.window) == 0
 
     def get_current_path(self, level):
         if(level == 'year'):
@@ -109,39 +126,20 @@ class ArchivesTextProcessor:
         else:
             self.logger.log('ERROR: is an invalid level' % level)
 
+    # path of the current article relative to base_path, e.g. 1969/03/02/MODSMD_ARTICLE4.article.txt
+    def get_current_relpath(self):
+        return str(self.currentYear).zfill(4) + '/' + str(self.currentMonth).zfill(2) + '/' + str(self.currentDay).zfill(2) + '/' + self.currentArticle
+
+    # the manifest hands back fresh sorted lists, which we pop from as we go
     def set_months_left_in_year(self):
-        months = os.listdir(self.get_current_path('year'))
-        filtered_months = []
-        for i in range(0, len(months)):
-            try:
-                filtered_months.append(int(months[i]))
-            except:
-                continue
-        filtered_months.sort()
-        self.months_left_in_year = filtered_months
+        self.months_left_in_year = self.manifest.months(self.currentYear)
 
     def set_days_left_in_month(self):
-        days = os.listdir(self.get_current_path('month'))
-        filtered_days = []
-        for i in range(0, len(days)):
-            try:
-                filtered_days.append(int(days[i]))
-            except:
-                continue
-        filtered_days.sort()
-        self.days_left_in_month = filtered_days
+        self.days_left_in_month = self.manifest.days(self.currentYear, self.currentMonth)
 
     def set_articles_left_in_day(self):
-        articles = os.listdir(self.get_current_path('day'))
-        filtered_articles = []
-        for i in range(0, len(articles)):
-            try:
-                filtered_articles.append(articles[i])
-            except:
-                continue
-        filtered_articles.sort()
-        self.articles_left_in_day = filtered_articles
-        
+        self.articles_left_in_day = self.manifest.articles(self.currentYear, self.currentMonth, self.currentDay)
+
     # returns -1 if we can't move anymore (i.e. we're done), 1 on success
     def move_to_next_year(self):
         if(len(self.years_left) == 0):
@@ -176,83 +174,48 @@ class ArchivesTextProcessor:
                 return -1
             self.set_articles_left_in_day()
         self.currentArticle = self.articles_left_in_day.pop()
+        self.currentArticleEncoded = None
+        self.currentArticleId = None
         return 1
     
     '''
     the following are functions to process data in the .txt files in archives-text
     '''
     def get_current_publish_date(self):
-        return '%s-%s-%sT12:00:00Z' %(str(self.currentYear).zfill(4), str(self.currentMonth).zfill(2), str(self.currentDay).zfill(2)) # default set time to 12:00, since we don't care about that.
+        return get_file_fields(self.currentYear, self.currentMonth, self.currentDay, self.currentArticle)['publish_date']
 
-    # detects if text has repeated substrings and removes if true
-    # this seems like a leetcode problem lol. I'm using this as a ref https://www.geeksforgeeks.org/python-check-if-string-repeats-itself/
+    # removes the extra copies extract-text.js appends to some articles, see repeats.py
     def removeRepeats(self, text):
-        if(len(text) < 2):
-            return text
-        
-        res = None
-        temp = (text + text).find(text, 1, -1)
-        if(temp != -1):
-            res = text[:temp]
-            # self.logger.log(self.get_current_path('article'))
-            # self.logger.log(res)
-            return res
+        start = time.perf_counter()
+        text, repeat = remove_repeats(text)
+        self.metrics.observe('dedupe', time.perf_counter() - start)
+        if(repeat is not None):
+            self.metrics.count('repeats_removed', 'dedupe')
+            self.logger.log('removed %s repeat from %s, kept %d chars' % (repeat.kind, self.get_current_path('article'), repeat.period),
+                            event='repeat_removed', article=self.get_current_relpath(), kind=repeat.kind, kept_chars=repeat.period)
         return text
 
     def get_current_article_data(self):
-        with open(self.get_current_path('article'), 'r') as f:
-            articleRawText = f.read()
-            articleLines = articleRawText.splitlines()
-
-            # perform some sanity checks 
-            try:
-                if(not articleLines[0].startswith('#')):
-                    self.logger.log('error in first line of article %s' % self.get_current_path("article"))
-                if(not articleLines[1].startswith('##')):
-                    self.logger.log('error in second line of article %s' % self.get_current_path("article"))
-                if(not articleLines[2].startswith('###')):
-                    self.logger.log('error in third line of article %s' % self.get_current_path("article"))
-            except:
-                pass
-
-            # extract data
-            try:
-                title = re.sub('\s+', ' ', articleLines[0][2:].strip()) # get rid of extra whitespace, plus skip extra chars
-                subtitle = re.sub('\s+', ' ', articleLines[1][3:].strip()) 
-                author_raw = re.sub('\s+', ' ', articleLines[2][4:].strip())
-            except:
-                title = ""
-                subtitle = ""
-                author_raw = ""
-                
-            author = author_raw
-            authorTitle = ''
-            for possibleTitle in VALID_AUTHOR_TITLES:
-                title_index = author_raw.upper().find(possibleTitle)
-                if(title_index > 0):
-                    authorTitle = possibleTitle
-                    author = author[0:title_index]
-                    break
-
-            articleText = ''
-            for i in range(3, len(articleLines)):
-                articleLines[i] += '\n'
-            articleTextJoined = articleText.join(articleLines[3:])
-            articleText = self.removeRepeats(articleTextJoined)
-            filename_parts = self.currentArticle.split('.')
-            articleType = filename_parts[1]
-            articleNumber = filename_parts[0]
-
-            return {
-                'article_text': articleText,
-                'article_type': articleType,
-                'article_number': articleNumber,
-                'title': title,
-                'subtitle': subtitle,
-                'author': author,
-                'author_title': authorTitle,
-                'publish_date': self.get_current_publish_date()
-            }
+        pool_profiler.tick() # with --profile-articles, stops profiling after that many
+        start = time.perf_counter()
+        article = Article(self.get_current_relpath(), self.archive).read_all() # we need the body as well, so read it all at once
+        read_done = time.perf_counter()
+        self.metrics.observe('read', read_done - start)
+        self.metrics.count('documents', 'read')
+
+        # perform some sanity checks
+        for i in article.header_errors():
+            self.metrics.count('errors', 'parse')
+            self.logger.log('error in %s line of article %s' % (['first', 'second', 'third'][i], self.get_current_path("article")),
+                            event='header_error', article=self.get_current_relpath(), line=i)
+
+        # extract data, the same way as local_search.py and local_suggester.py (see article_reader.py)
+        header_fields = get_header_fields(article)
+        articleBody = get_body_text(article)
+        self.metrics.observe('parse', time.perf_counter() - read_done)
+
+        articleText = self.removeRepeats(articleBody)
+        return build_fields(articleText, header_fields, get_file_fields(self.currentYear, self.currentMonth, self.currentDay, self.currentArticle))
 
     def pretty_print_current_article_data(self):
         current_article_data = self.get_current_article_data()
@@ -274,51 +237,169 @@ class ArchivesTextProcessor:
         fields = self.get_current_article_data()
         return {
             'type': 'add',
-            'id': fields['publish_date'] + fields['article_type'] + str(fields['article_number']),
+            'id': get_document_id(fields),
             'fields': fields
         }
 
-    def get_current_add_request_size_in_bytes(self):
-        current_request = self.create_current_article_cloudsearch_add_request_JSON()
-        size = len(json.dumps(current_request))
-        if(size > MAX_FILE_SIZE):
-            self.logger.log('%s is too big!' % self.get_current_path("article"))
-        return size
+    # encodes the current article's add request exactly once; the article which overflows a batch
+    # stays current, so the next batch reuses these bytes instead of re-reading the file.
+    def get_current_add_request_bytes(self):
+        if(self.currentArticleEncoded is None):
+            current_request = self.create_current_article_cloudsearch_add_request_JSON()
+            self.currentArticleId = current_request['id']
+            start = time.perf_counter()
+            self.currentArticleEncoded = json.dumps(current_request).encode('utf-8')
+            self.metrics.observe('serialize', time.perf_counter() - start)
+            self.metrics.count('bytes', 'serialize', len(self.currentArticleEncoded))
+            self.metrics.count('documents', 'serialize')
+        return self.currentArticleEncoded
 
+    def get_current_add_request_size_in_bytes(self):
+        return len(self.get_current_add_request_bytes())
+
+    # reads ahead until the window holds windowSizeInBytes of documents or windowMaxCandidates articles
+    # (or we run out of articles). Each article is read, parsed and encoded once
+    def fill_window(self):
+        while(not self.is_done and self.windowBytes < self.windowSizeInBytes and len(self.window) < self.windowMaxCandidates):
+            if(self.journal is not None and self.journal.is_completed(self.get_current_relpath())):
+                # uploaded by an earlier run; don't even read the file
+                self.move_to_next_article()
+                continue
+            encoded = self.get_current_add_request_bytes()
+            doc_hash = hash_document(encoded) if self.syncState is not None else None
+            skipped = None
+            if(len(encoded) > MAX_FILE_SIZE):
+                # cloudsearch rejects the whole batch if one document is over the limit, so skip it
+                self.logger.log('%s is too big! skipping it' % self.get_current_path("article"), event='too_big', article=self.get_current_relpath(), bytes=len(encoded))
+                self.metrics.count('errors', 'batch')
+                skipped = 'too_big'
+            elif(self.syncState is not None and self.syncState.is_unchanged(self.currentArticleId, doc_hash)):
+                skipped = 'unchanged'
+            else:
+                self.windowBytes += len(encoded)
+            self.window.append(BatchCandidate(self.nextSeq, self.get_current_relpath(), self.currentArticleId, doc_hash,
+                                              encoded if skipped is None else None, skipped))
+            self.nextSeq += 1
+            self.move_to_next_article()
+
+    # builds the batch directly as the JSON array bytes that get sent to cloudsearch, packed as full as
+    # it'll go from the documents in the window (see batch_packer.py), and the size is the real length of it.
+    # returns a dict with the batch bytes, the (id, hash) of each document in it, how many unchanged
+    # documents were skipped (only when we have a syncState) and the ranges of articles it consumed.
     def create_batch_article_cloudsearch_add_request_JSON(self):
-        self.logger.log('creating a new batch, starting at article %s' % self.get_current_path("article"))
-        current_batch = []
-        article_count = 0
-        # this is pretty inefficient b/c we're computing the add request 3 times.
-        while(self.currentSizeInBytes + self.get_current_add_request_size_in_bytes() < self.batchSizeInBytes):
-            article_count += 1
-            current_batch.append(self.create_current_article_cloudsearch_add_request_JSON())
-            self.currentSizeInBytes += self.get_current_add_request_size_in_bytes()
-            not_done = self.move_to_next_article()
-            if(not_done < 0):
-                break # we've reached the last article
-        self.logger.log('created batch, ended at article %s, has size bytes %d and total of %d articles' % (self.get_current_path("article"), self.currentSizeInBytes, article_count))
-        self.currentSizeInBytes = 0
-        return current_batch
+        self.logger.log('creating a new batch, reading ahead from article %s' % self.get_current_path("article"), event='batch_start')
+        start = time.perf_counter()
+        self.fill_window()
+        chosen, size = pack_batch(self.window, self.batchSizeInBytes)
+        candidates = [self.window[i] for i in chosen]
+        chosen = set(chosen)
+        self.window = [candidate for i, candidate in enumerate(self.window) if i not in chosen]
+        documents = [candidate for candidate in candidates if candidate.encoded is not None]
+        self.windowBytes -= sum(len(candidate.encoded) for candidate in documents)
+        current_batch = b'[' + b','.join(candidate.encoded for candidate in documents) + b']'
+        batch_docs = [(candidate.doc_id, candidate.doc_hash) for candidate in documents]
+        skipped_count = sum(1 for candidate in candidates if candidate.skipped == 'unchanged')
+        ranges = get_consumed_ranges(candidates)
+        fill = len(current_batch) / self.batchSizeInBytes
+        # everything it took to fill the batch, reading and encoding the articles included
+        self.metrics.observe('batch', time.perf_counter() - start)
+        if(len(batch_docs) > 0):
+            self.metrics.count('batches', 'batch')
+            self.metrics.count('bytes', 'batch', len(current_batch))
+            self.metrics.count('documents', 'batch', len(batch_docs))
+        self.metrics.count('unchanged', 'batch', skipped_count)
+        self.logger.log('created batch of %d ranges of articles, has size bytes %d (%.1f%% full) and total of %d articles (%d unchanged articles skipped)' % (len(ranges), len(current_batch), fill * 100, len(batch_docs), skipped_count),
+                        event='batch_created', first_article=ranges[0][0] if len(ranges) > 0 else None, last_article=ranges[-1][1] if len(ranges) > 0 else None,
+                        ranges=len(ranges), bytes=len(current_batch), fill=round(fill, 4), docs=len(batch_docs), skipped=skipped_count)
+        return {
+            'documents': current_batch,
+            'docs': batch_docs,
+            'skipped': skipped_count,
+            'ranges': ranges,
+        }
+
+    def record_batch(self, batch_number, batch, status, attempts, error=None):
+        if(self.journal is not None and len(batch['ranges']) > 0):
+            self.journal.record(batch_number, batch['ranges'], len(batch['docs']), len(batch['documents']), status, attempts, error)
+
+    # builds the next batch, returns (batch number, batch). Batches with nothing to upload are checkpointed right away
+    def create_next_batch(self):
+        batch_number = self.journal.get_next_batch_number() if self.journal is not None else None
+        batch = self.create_batch_article_cloudsearch_add_request_JSON()
+        if(len(batch['docs']) == 0):
+            # everything in range was skipped; still checkpoint it so a resume doesn't re-read those files
+            self.record_batch(batch_number, batch, 'success', 0)
+            self.logger.log("batch is empty, nothing to upload", event='batch', **self.get_batch_fields(batch_number, batch, 'empty', 0))
+        return batch_number, batch
+
+    # what every batch's log record has: which articles it covers, how big it is and how its upload went
+    def get_batch_fields(self, batch_number, batch, status, attempts, seconds=None, error=None):
+        return {
+            'batch': batch_number,
+            'first_article': batch['ranges'][0][0] if len(batch['ranges']) > 0 else None,
+            'last_article': batch['ranges'][-1][1] if len(batch['ranges']) > 0 else None,
+            'bytes': len(batch['documents']),
+            'docs': len(batch['docs']),
+            'skipped': batch['skipped'],
+            'status': status,
+            'attempts': attempts,
+            'upload_seconds': round(seconds, 3) if seconds is not None else None,
+            'error': error,
+        }
+
+    # bookkeeping once cloudsearch has answered (or we gave up retrying). seconds: how long the upload took
+    def finish_batch_upload(self, batch_number, batch, response, attempts, error, seconds=None):
+        if(seconds is not None):
+            self.metrics.observe('upload', seconds)
+        self.metrics.count('retries', 'upload', max(0, attempts - 1))
+        if(response is None):
+            self.metrics.count('errors', 'upload')
+        else:
+            self.metrics.count('bytes', 'upload', len(batch['documents']))
+            self.metrics.count('documents', 'upload', len(batch['docs']))
+        if(response is None):
+            self.logger.log("THERE WAS AN ERROR IN UPLOADING THIS BATCH AFTER %d ATTEMPTS (%s). RUN AGAIN WITH --resume TO RETRY IT" % (attempts, error),
+                            event='batch', **self.get_batch_fields(batch_number, batch, 'failed', attempts, seconds, error))
+            self.record_batch(batch_number, batch, 'failed', attempts, error)
+        else:
+            if(self.syncState is not None):
+                self.syncState.mark_uploaded(batch['docs'])
+            self.record_batch(batch_number, batch, 'success', attempts)
+            self.logger.log("done with batch upload", event='batch', response=response,
+                            **self.get_batch_fields(batch_number, batch, 'success', attempts, seconds))
 
     def upload_article_batch_to_cloudsearch(self):
         self.logger.log("making a batch upload")
-        batch = json.dumps(self.create_batch_article_cloudsearch_add_request_JSON())
+        batch_number, batch = self.create_next_batch()
+        if(len(batch['docs']) == 0):
+            return
         self.logger.log("sending data to cloudsearch")
-        response = self.docClient.upload_documents(documents=batch, contentType="application/json")
-        self.logger.log("cloudsearch response:")
-        self.logger.log(str(response))
-        if(response['status'] != 'success'):
-            self.logger.log("THERE WAS AN ERROR IN UPLOADDING THIS BATCH. WE DON'T CURRENTLY HAVE ERROR HANDLING, YOU WILL NEED TO RETRY THIS BATCH MANUALLY")
-        self.logger.log("done with batch upload")
+        start = time.time()
+        response, attempts, error = upload_with_retry(self.docClient, batch['documents'], self.logger)
+        self.finish_batch_upload(batch_number, batch, response, attempts, error, time.time() - start)
+
+    # uploads everything that's left, parsing the next batches while earlier ones are being sent
+    def upload_all_batches_pipelined(self, max_concurrency=MAX_UPLOAD_CONCURRENCY):
+        pipeline = UploadPipeline(self.docClient, self.logger, max_concurrency=max_concurrency)
+        while(not self.are_we_done()):
+            self.logger.log("making a batch upload")
+            batch_number, batch = self.create_next_batch()
+            if(len(batch['docs']) > 0):
+                self.logger.log("queueing batch %s for upload (upload concurrency is %d)" % (batch_number, pipeline.limiter.get_limit()))
+                pipeline.submit(batch_number, batch)
+            for batch_number, batch, response, attempts, error, seconds in pipeline.get_finished():
+                self.finish_batch_upload(batch_number, batch, response, attempts, error, seconds)
+        for batch_number, batch, response, attempts, error, seconds in pipeline.close():
+            self.finish_batch_upload(batch_number, batch, response, attempts, error, seconds)
 
 """
 some tests
 """
 def test_upload_single_batch_from_year(year):
     print("starting to test process year %d" % year)
-    testProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, year, year + 1, MAX_BATCH_SIZE, DOC_CLIENT)
+    testProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, year, year + 1, MAX_BATCH_SIZE, DOC_CLIENTS.get_client(), get_manifest())
     testProcessor.upload_article_batch_to_cloudsearch()
+    testProcessor.close()
     time.sleep(1)
     print("done with test processing year %d" % year)
 
@@ -328,7 +409,7 @@ def multiprocessing_test():
 
 def tests():
     print('tests:')
-    testProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, 1901, 1902, MAX_BATCH_SIZE, DOC_CLIENT)
+    testProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, 1901, 1902, MAX_BATCH_SIZE, DOC_CLIENTS.get_client(), get_manifest())
     print(testProcessor.create_current_article_cloudsearch_add_request_JSON())
     # # uncomment if you want to see some article data be printed out
     # for i in range(10):
@@ -351,28 +432,94 @@ def tests():
 """
 for actually uploading archive text
 """
-def process_and_upload_year(year):
-    yearProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, year, year + 1, MAX_BATCH_SIZE, DOC_CLIENT)
+# incremental: only upload documents which are new or changed since the last successful upload (see sync_state.py)
+# resume: skip batches the checkpoint journal from an earlier run has as uploaded (see upload_journal.py)
+def process_and_upload_year(year, incremental=False, resume=False):
+    syncState = SyncState(SYNC_STATE_PATH) if incremental else None # opened here so each worker gets its own connection
+    journal = UploadJournal(CHECKPOINT_PATH, str(year), resume)
+    yearProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, year, year + 1, MAX_BATCH_SIZE, DOC_CLIENTS.get_client(), get_manifest(), syncState, journal)
     print("starting to process year %d" % year)
-    while(not yearProcessor.are_we_done()):
-        yearProcessor.upload_article_batch_to_cloudsearch()
-    print("done with processing year %d" % year)
-
-def uploadYears(startYear, endYear):
+    if(resume):
+        print("resuming year %d, %d batches already uploaded according to %s" % (year, journal.completed_range_count(), journal.get_fullpath()))
+    yearProcessor.upload_all_batches_pipelined()
+    yearProcessor.close() # Pool workers exit without running atexit, so the log has to be written out here
+    if(syncState is not None):
+        syncState.close()
+    journal.close()
+    print("done with processing year %d (%s)" % (year, DOC_CLIENTS.describe_stats()))
+    return yearProcessor.metrics.get_snapshot()
+
+# same as process_and_upload_year, but for a chunk of roughly equal size from work_scheduler.plan_chunks
+def process_and_upload_chunk(chunk, incremental=False, resume=False):
+    chunkManifest, startYear, endYear = get_chunk_manifest(chunk)
+    syncState = SyncState(SYNC_STATE_PATH) if incremental else None
+    journal = UploadJournal(CHECKPOINT_PATH, chunk['label'], resume)
+    chunkProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, startYear, endYear, MAX_BATCH_SIZE, DOC_CLIENTS.get_client(), chunkManifest, syncState, journal, chunk['label'])
+    print("starting to process chunk %s (%d bytes)" % (chunk['label'], chunk['size']))
+    chunkProcessor.upload_all_batches_pipelined()
+    chunkProcessor.close()
+    if(syncState is not None):
+        syncState.close()
+    journal.close()
+    print("done with processing chunk %s (%s)" % (chunk['label'], DOC_CLIENTS.describe_stats()))
+    return chunk['label'], chunkProcessor.metrics.get_snapshot()
+
+# how full the batches that had something in them were, on average (the last of every chunk is usually only partly full)
+def get_fill_ratio(metrics, batch_size):
+    batches = metrics.counters.get(('batches', 'batch'), 0)
+    return metrics.counters.get(('bytes', 'batch'), 0) / (batches * batch_size) if batches > 0 else 0.0
+
+# splits the years into chunks of about equal size and keeps all POOL_SIZE workers busy with them, largest first.
+# the workers' metrics are added up and written to METRICS_PATH at the end.
+# profiling: a pool_profiler.Profiling to profile the workers with, or None
+def uploadYears(startYear, endYear, incremental=False, resume=False, profiling=None):
+    metrics = PipelineMetrics('upload')
+    start = time.perf_counter()
+    entries = filter_entries_by_year(get_manifest().entries, startYear, endYear)
+    metrics.observe('walk', time.perf_counter() - start)
+    chunks = plan_chunks(entries, POOL_SIZE)
+    print("upload plan: %s" % describe_plan(chunks))
+    if(not resume):
+        clear_journals(CHECKPOINT_PATH)
+    task = partial(process_and_upload_chunk, incremental=incremental, resume=resume)
+    if(profiling is not None):
+        task = profiling.wrap(task)
     with Pool(POOL_SIZE) as p:
-        p.map(process_and_upload_year, list(range(startYear, endYear + 1)))
+        for label, snapshot in p.imap_unordered(task, chunks, chunksize=1):
+            metrics.merge(snapshot)
+    metrics.write_prometheus(METRICS_PATH)
+    print(metrics.format_summary())
+    print("%d batches, %.1f%% full on average" % (metrics.counters.get(('batches', 'batch'), 0), get_fill_ratio(metrics, MAX_BATCH_SIZE) * 100))
+    print("metrics written to %s" % METRICS_PATH)
 
 # multiprocessed full upload of archives text
-def upload_archives_text():
-    uploadYears(1892, 2014)
+def upload_archives_text(incremental=False, resume=False, profiling=None):
+    uploadYears(1892, 2014, incremental, resume, profiling)
 
-def upload_archives_text_test():
-    uploadYears(1969, 1969)
+def upload_archives_text_test(incremental=False, resume=False, profiling=None):
+    uploadYears(1969, 1969, incremental, resume, profiling)
 
 def main():
+    global DOC_CLIENTS
+    parser = argparse.ArgumentParser(description='process archives-text and upload it to cloudsearch')
+    parser.add_argument('--endpoint-url', default=DOC_ENDPOINT,
+                        help='cloudsearch document endpoint, e.g. a local_cloudsearch_server.py for offline testing')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only upload documents that are new or changed since the last upload, tracked in %s' % SYNC_STATE_PATH)
+    parser.add_argument('--resume', action='store_true',
+                        help='pick up where a crashed or killed run stopped, using the checkpoint journals in %s' % CHECKPOINT_PATH)
+    pool_profiler.add_profile_arguments(parser)
+    args = parser.parse_args()
+    profiling = pool_profiler.get_profiling(args)
+    if(profiling is not None):
+        profiling.start()
+    if(args.endpoint_url != DOC_ENDPOINT):
+        DOC_CLIENTS = ClientFactory(args.endpoint_url) # before the Pool forks, so workers use it
     # tests()
-    # upload_archives_text()
-    upload_archives_text_test()
+    # upload_archives_text(args.incremental, args.resume, profiling)
+    upload_archives_text_test(args.incremental, args.resume, profiling)
+    if(profiling is not None):
+        print("profile written to %s" % ', '.join(profiling.finish()))
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,121 @@
+"""
+makes cloudsearchdomain clients when they're first used, one per process.
+
+importing boto3 and building a client takes a noticeable fraction of a second, so making them at
+import time slows down every Pool worker, every script that imports another one and every --help.
+And a client made before a fork has a connection pool the child shouldn't share with its parent.
+So scripts keep a ClientFactory (which costs nothing to make) and call get_client() where they
+need the client: the first call in each process imports boto3 and builds it, later calls in that
+process return the same one, so its connections stay open and get reused across batches.
+
+    DOC_CLIENTS = ClientFactory(DOC_ENDPOINT)
+    DOC_CLIENTS.get_client().upload_documents(...)
+
+botocore's own retries are turned off: upload_retry.py retries uploads with backoff and tells the
+upload pipeline when it's being throttled, which it can't do for retries it never sees.
+
+the connection pool should have room for every upload the process makes at once (see
+upload_pipeline.py), or the extra uploads open and close a new connection every time. Connections
+are kept open between requests (http keep-alive) and, where botocore supports it (1.27+),
+with tcp keepalive probes so an idle connection isn't silently dropped by a NAT in between.
+
+get_stats() tells how much time went into setting up (importing boto3 and building the client)
+compared with time spent on requests, and how many connections were opened for those requests,
+for this process.
+"""
+
+import os
+import time
+import threading
+from upload_pipeline import MAX_UPLOAD_CONCURRENCY
+
+
+MAX_POOL_CONNECTIONS = MAX_UPLOAD_CONCURRENCY + 2 # every uploader thread, plus a couple for anything else
+CONNECT_TIMEOUT_SECONDS = 10
+READ_TIMEOUT_SECONDS = 120 # cloudsearch can take a while to answer for a 5 mb batch
+TCP_KEEPALIVE = True
+MAX_RETRIES = 0 # see upload_retry.py
+
+# the connection pools of a botocore client, for counting how many connections it opened. These aren't
+# part of botocore's api, so if they move we just don't count connections
+def get_connection_pools(client):
+    try:
+        manager = client._endpoint.http_session._manager
+        return [manager.pools[key] for key in manager.pools.keys()]
+    except (AttributeError, KeyError):
+        return []
+
+class ClientFactory:
+    def __init__(self, endpoint_url, service_name='cloudsearchdomain', max_pool_connections=MAX_POOL_CONNECTIONS,
+                 connect_timeout=CONNECT_TIMEOUT_SECONDS, read_timeout=READ_TIMEOUT_SECONDS, tcp_keepalive=TCP_KEEPALIVE,
+                 max_retries=MAX_RETRIES):
+        self.endpoint_url = endpoint_url
+        self.service_name = service_name
+        self.max_pool_connections = max_pool_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.tcp_keepalive = tcp_keepalive
+        self.max_retries = max_retries
+        self.lock = threading.Lock()
+        self._reset(None)
+
+    def _reset(self, pid):
+        self.pid = pid
+        self.client = None
+        self.sends = threading.local()
+        self.stats = {'setup_seconds': 0.0, 'requests': 0, 'request_seconds': 0.0}
+
+    def get_config(self):
+        from botocore.config import Config
+        # 'max_attempts' counts retries, not attempts (botocore 1.15 doesn't know total_max_attempts)
+        settings = {'max_pool_connections': self.max_pool_connections, 'connect_timeout': self.connect_timeout, 'read_timeout': self.read_timeout,
+                    'retries': {'max_attempts': self.max_retries}}
+        if(self.tcp_keepalive):
+            try:
+                return Config(tcp_keepalive=True, **settings)
+            except TypeError:
+                pass # botocore is older than 1.27
+        return Config(**settings)
+
+    def get_client(self):
+        if(self.client is not None and self.pid == os.getpid()):
+            return self.client
+        with self.lock:
+            if(self.pid != os.getpid()):
+                self._reset(os.getpid()) # made before a fork, or not at all yet
+            if(self.client is None):
+                start = time.perf_counter()
+                import boto3
+                client = boto3.session.Session().client(self.service_name, endpoint_url=self.endpoint_url, config=self.get_config())
+                client.meta.events.register('before-send', self._on_send)
+                client.meta.events.register('needs-retry', self._on_response)
+                self.stats['setup_seconds'] += time.perf_counter() - start
+                self.client = client
+        return self.client
+
+    # botocore events around each http request (each retry is a request of its own). These have to return None
+    def _on_send(self, **kwargs):
+        self.sends.start = time.perf_counter()
+
+    def _on_response(self, **kwargs):
+        start = getattr(self.sends, 'start', None)
+        if(start is None):
+            return
+        self.sends.start = None
+        with self.lock:
+            self.stats['requests'] += 1
+            self.stats['request_seconds'] += time.perf_counter() - start
+
+    # for this process only, each Pool worker has its own
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+        pools = get_connection_pools(self.client) if self.client is not None else []
+        stats['connections_opened'] = sum(getattr(pool, 'num_connections', 0) for pool in pools)
+        stats['connection_reuses'] = max(0, stats['requests'] - stats['connections_opened'])
+        return stats
+
+    def describe_stats(self):
+        stats = self.get_stats()
+        return '%.2fs setting up the client, %d requests in %.2fs over %d connections (%d reused)' % (
+            stats['setup_seconds'], stats['requests'], stats['request_seconds'], stats['connections_opened'], stats['connection_reuses'])
@@ -17,22 +17,36 @@ another example - https://gist.github.com/reedobrien/a7cf32c3e4e6cad0deb6
 
 todo: example for suggest
 """
-import boto3
 import json
 import uuid
 import random
+from search_cache import CachedSearchClient
+from cloudsearch_client import ClientFactory
 
+# loaded the first time random docs are made, not on import
 word_list = []
-with open('random-words.txt') as f:  # or whatever the wordlist is saved as
-  for line in f.readlines():
-    index, word = line.strip().split('\t')
-    word_list.append(word)
+
+def get_word_list():
+    if(len(word_list) == 0):
+        with open('random-words.txt') as f:  # or whatever the wordlist is saved as
+            for line in f.readlines():
+                index, word = line.strip().split('\t')
+                word_list.append(word)
+    return word_list
 
 SEARCH_ENDPOINT = "SEARCH-ENDPOINT-HERE"
 DOC_ENDPOINT = "DOC-ENDPOINT-HERE"
 
-search_client = boto3.client('cloudsearchdomain', endpoint_url=SEARCH_ENDPOINT)
-doc_client = boto3.client('cloudsearchdomain', endpoint_url=DOC_ENDPOINT)
+# clients are made the first time they're used (see cloudsearch_client.py)
+search_clients = ClientFactory(SEARCH_ENDPOINT)
+doc_clients = ClientFactory(DOC_ENDPOINT)
+search_client = None
+
+def get_search_client():
+    global search_client
+    if(search_client is None):
+        search_client = CachedSearchClient(search_clients.get_client()) # repeated searches come out of search_cache.py
+    return search_client
 
 """
 some sample data for us to work with
@@ -85,7 +99,7 @@ def makeSearch():
     """
     testSearch1 = "+test"
     print("\nMaking search", testSearch1)
-    response = search_client.search(query=testSearch1, size=5)
+    response = get_search_client().search(query=testSearch1, size=5)
     print(response, "\n")
 
 """
@@ -110,7 +124,7 @@ Furthermore you should be able to get results from makeSearch()!
 """
 def makeDocUpload(documentsJSON):
     print("\nMaking Doc Upload")
-    response = doc_client.upload_documents(documents=documentsJSON, contentType="application/json")
+    response = doc_clients.get_client().upload_documents(documents=documentsJSON, contentType="application/json")
     print(response,"\n")
 
 """
@@ -124,6 +138,7 @@ just for testing
 """
 def generateRandomSampleDocs(numDocs):
     randomDocs = []
+    word_list = get_word_list()
     for i in range(numDocs):
         randomDocs.append({
             "type": "add",
@@ -4,66 +4,42 @@ to find possible author titles
 
 import os
 import re
+from article_pack import open_archives_text
+from author_titles import find_author_title
+from article_reader import Article
 
-ARCHIVES_TEXT_PATH = "PATH_HERE"
+ARCHIVES_TEXT_PATH = "PATH_HERE" # the archives-text directory, or a pack of it (see article_pack.py)
 
-# note: if see one, safe to assume goes to end?
-KNOWN_TITLES = ['SENIOR STAFF WRITER', 'STAFF WRITER', 'DESK EDITOR', 'CONTRIBUTING WRITER', 
-'MANAGING EDITOR', 'EDITOR IN CHIEF', 'DEPUTY EDITOR', 'EXECUTIVE EDITOR', 'STAFF', 
-'ASSU President', 'ASSU Parlimentarian', 'STAFF FOOTBALL WRITERS', 'FASHION COLUMNIST', 
-'FOOTBALL EDITOR', 'ARTS EDITOR', 'FOOD EDITOR', 'FOOD DINING EDITOR', 'OPINIONS DESK',
-'FOOD DRUNK EDITOR', 'FELLOW', 'DAILY INTERN', 'CONTRIBUTING EDITOR', 'MANAGING WRITER',
-'GUEST COLUMNIST', 'SEX GODDESS', 'GUEST COLUMNISTS', 'EDITORIAL STAKE', 'CONTRIBUTING YANKEE',
-'SPECIAL CONTRIBUTOR', 'EDITORIAL BOARD', 'CONTRIBUTING WRITER', 'EDITORIAL STAFF', 'FILM CRITIC',
-'HEALTH EDITOR', 'ASSHOLE', 'INTERMISSION', 'NEWS EDITOR', 'CLASS PRESIDENT', 'ASSOCIATED PRESS',
-'AP SPORTS WRITER', 'AP BASEBALL WRITER', 'WEEKLY COLUMNIST', 'HEALTH COLUMNIST', 'ASSOCIATED EDITOR',
-'ASSOCIATE EDITOR', 'SPORTS EDITOR', 'EDITOR THE DAILY', ]
+# index of every article in ARCHIVES_TEXT_PATH (see archives_manifest.py), so we don't have to list directories
+MANIFEST = None
+
+def get_manifest():
+    global MANIFEST
+    if(MANIFEST is None):
+        MANIFEST = open_archives_text(ARCHIVES_TEXT_PATH).load_manifest()
+    return MANIFEST
 
 def get_archives_years():
-    entries = os.listdir(ARCHIVES_TEXT_PATH)
-    filtered = []
-    for i in range(0, len(entries)):
-        try: 
-            filtered.append( int(entries[i]))
-        except:
-            continue
-    return filtered
+    return get_manifest().years()
 
 def get_archives_months(year):
-    entries = os.listdir(ARCHIVES_TEXT_PATH + str(year).zfill(4) + "/")
-    filtered = []
-    for i in range(0, len(entries)):
-        try: 
-            filtered.append( int(entries[i]))
-        except:
-            continue
-    return filtered
+    return get_manifest().months(year)
 
 def get_archives_days(year, month):
-    entries = os.listdir(ARCHIVES_TEXT_PATH + str(year).zfill(4) + "/" + str(month).zfill(2) + "/")
-    filtered = []
-    for i in range(0, len(entries)):
-        try: 
-            filtered.append( int(entries[i]))
-        except:
-            continue
-    return filtered
+    return get_manifest().days(year, month)
 
 def get_archives_article_filenames(year, month, day):
-    entries = os.listdir(ARCHIVES_TEXT_PATH + str(year).zfill(4) + "/" + str(month).zfill(2) + "/" + str(day).zfill(2))
-    return entries
+    return get_manifest().articles(year, month, day)
 
 """
 returns a dict containing article data
 """
 def get_author_data(year, month, day, filename):
-    with open(ARCHIVES_TEXT_PATH + str(year).zfill(4) + "/" + str(month).zfill(2) + "/" + str(day).zfill(2) + "/" + filename, 'r') as f:
-        articleData = f.read()
-        articleLines = articleData.splitlines()
-        if(not articleLines[2].startswith('###')):
-            print("error in third line of article", year, month, day, filename)
-        author = articleLines[2][4:]
-        return author
+    # only reads the start of the file, see article_reader.py
+    article = Article(str(year).zfill(4) + "/" + str(month).zfill(2) + "/" + str(day).zfill(2) + "/" + filename, open_archives_text(ARCHIVES_TEXT_PATH))
+    if(2 in article.header_errors() or not article.has_full_header()):
+        print("error in third line of article", year, month, day, filename)
+    return article.author
 
 def main():
     total_seen = 0
@@ -78,11 +54,8 @@ def main():
                 article_names = get_archives_article_filenames(year, month, day)
                 for article in article_names:
                     authorname = get_author_data(year, month, day, article)
-                    skip = 0
-                    for known_title in KNOWN_TITLES:
-                        if(authorname.upper().find(known_title) > 0):
-                            skip = 1
-                    if(skip == 0 and len(authorname.strip()) > 0):
+                    # only lines without a title we know about are interesting
+                    if(find_author_title(authorname) is None and len(authorname.strip()) > 0):
                         parts = authorname.split(' ')
                         if(len(parts) > 3):
                             print(parts[2:])
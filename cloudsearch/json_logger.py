@@ -0,0 +1,119 @@
+"""
+log files as JSON lines, written from a background thread.
+
+    logger = JsonLogger('./logs/', '1969')
+    logger.log('uploaded batch', event='batch', docs=812, bytes=5242001, status='success')
+    logger.close()
+
+every record is one line of json with the time (seconds since the epoch), the log's label and the
+message, plus whatever fields were passed, e.g.
+    {"time": 1586980000.123, "label": "1969", "message": "uploaded batch", "event": "batch", "docs": 812, ...}
+so a run can be picked apart by a script (json.loads each line) instead of by grepping.
+
+log() only puts the record on a queue, so it never waits on the disk. The writer thread encodes
+records and writes them out every flush_seconds, or sooner once flush_bytes are waiting, and
+everything left is written by close(), which also happens at exit for loggers that weren't
+closed (Pool workers exit without running atexit, so close them yourself there).
+
+the file is opened for appending, so a run started again after a crash (--resume) adds to the log
+of the run that crashed instead of wiping it out. Once the file is over max_bytes it's rotated
+like logging.handlers.RotatingFileHandler: NAME.log becomes NAME.log.1, NAME.log.1 becomes
+NAME.log.2 and so on, keeping backup_count old files. With backup_count=0 it isn't rotated at all.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+
+
+LOG_FLUSH_SECONDS = 1.0
+LOG_FLUSH_BYTES = 64 * 1024
+LOG_MAX_BYTES = 64 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+_STOP = object() # put on the queue by close()
+
+class JsonLogger:
+    # path: directory for the log, with a trailing slash (like LOG_PATH). The file is path + basename + '.log'
+    def __init__(self, path, basename, flush_seconds=LOG_FLUSH_SECONDS, flush_bytes=LOG_FLUSH_BYTES,
+                 max_bytes=LOG_MAX_BYTES, backup_count=LOG_BACKUP_COUNT):
+        self.fullpath = path + basename + '.log'
+        self.label = basename
+        self.flush_seconds = flush_seconds
+        self.flush_bytes = flush_bytes
+        self.max_bytes = max_bytes
+        self.backup_count = backup_count
+        self._open()
+        self.records = queue.SimpleQueue()
+        self.closed = False
+        self.thread = threading.Thread(target=self._write_records, daemon=True)
+        self.thread.start()
+        atexit.register(self.close)
+        self.log('logger start', event='start')
+
+    def log(self, message, **fields):
+        record = {'time': round(time.time(), 3), 'label': self.label, 'message': message}
+        record.update(fields)
+        self.records.put(record)
+
+    def get_fullpath(self):
+        return self.fullpath
+
+    def _write_records(self):
+        lines = []
+        buffered = 0
+        last_flush = time.monotonic()
+        while(True):
+            # with nothing waiting to be written there's no reason to wake up
+            timeout = max(0, self.flush_seconds - (time.monotonic() - last_flush)) if len(lines) > 0 else None
+            try:
+                record = self.records.get(timeout=timeout)
+            except queue.Empty:
+                record = None
+            stopping = record is _STOP
+            if(record is not None and not stopping):
+                line = (json.dumps(record, default=str) + '\n').encode('utf-8')
+                lines.append(line)
+                buffered += len(line)
+            if(stopping or buffered >= self.flush_bytes or time.monotonic() - last_flush >= self.flush_seconds):
+                if(len(lines) > 0):
+                    self._write(b''.join(lines))
+                    lines = []
+                    buffered = 0
+                last_flush = time.monotonic()
+            if(stopping):
+                return
+
+    def _write(self, data):
+        if(self.backup_count > 0 and self.file_bytes > 0 and self.file_bytes + len(data) > self.max_bytes):
+            self._rotate()
+        self.file.write(data)
+        self.file.flush() # so the log can be followed while the run goes on
+        self.file_bytes += len(data)
+
+    # appends to whatever is already there
+    def _open(self):
+        self.file = open(self.fullpath, 'ab')
+        self.file_bytes = os.fstat(self.file.fileno()).st_size
+
+    def _rotate(self):
+        self.file.close()
+        for i in range(self.backup_count - 1, 0, -1):
+            if(os.path.exists('%s.%d' % (self.fullpath, i))):
+                os.replace('%s.%d' % (self.fullpath, i), '%s.%d' % (self.fullpath, i + 1))
+        os.replace(self.fullpath, self.fullpath + '.1')
+        self._open()
+
+    # writes out everything that was logged and closes the file. Safe to call more than once
+    def close(self):
+        if(self.closed):
+            return
+        self.log('logger done', event='done')
+        self.closed = True
+        self.records.put(_STOP)
+        self.thread.join()
+        self.file.close()
+        atexit.unregister(self.close)
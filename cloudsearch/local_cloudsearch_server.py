@@ -0,0 +1,276 @@
+"""
+a local stand-in for the cloudsearch document and search endpoints, for offline throughput and
+retry testing (no AWS credentials or domain needed).
+
+implements enough of the cloudsearchdomain REST API for boto3's upload_documents and search:
+    POST /2013-01-01/documents/batch   json batches of add/delete requests
+    GET  /2013-01-01/search            simple query parser only (+required -excluded optional terms), size/start.
+                                       boto3 actually sends searches as a form encoded POST, so that works too.
+                                       with --search-index, searches are answered from a local_search.py index
+                                       instead (BM25 ranking, fq, sort and facets) and uploads don't affect them
+    GET  /2013-01-01/suggest           with --suggest-index, suggestions from local_suggester.py's title and author suggesters
+    GET  /_stats                       counters for load tests (not part of cloudsearch)
+
+documents are kept in memory. Like the real thing, batches over 5 mb and documents over 1 mb are
+rejected, and it can be told to be slow, throttle or fail at random.
+
+run it:
+    python local_cloudsearch_server.py --port 8080 --latency 0.2 --throttle-rate 0.05 --error-rate 0.01
+
+then point boto3 at it. Requests still get signed, so any credentials will do:
+    AWS_ACCESS_KEY_ID=local AWS_SECRET_ACCESS_KEY=local AWS_DEFAULT_REGION=us-east-1 \\
+        python cloudsearch-process-and-upload.py --endpoint-url http://localhost:8080
+
+or start one in process with start_server() (e.g. from a test or benchmark).
+"""
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from local_search import LocalSearchIndex, search_from_params
+from local_suggester import LocalSuggesters
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+
+MAX_BATCH_SIZE = 5242880 # 5 MB
+MAX_FILE_SIZE = 1048576 # 1 MB
+
+class LocalCloudSearch:
+    """
+    in memory documents plus the fault injection settings. Shared by all request handler threads.
+    latency: mean seconds added to every request (uniformly jittered by +-latency_jitter)
+    throttle_rate / error_rate: fraction of requests answered with a 429 throttling / 500 error
+    search_index: a LocalSearchIndex to answer searches from, or None to search the uploaded documents
+    suggesters: LocalSuggesters to answer suggest requests from, or None
+    """
+    def __init__(self, latency=0, latency_jitter=0, throttle_rate=0, error_rate=0, seed=None, search_index=None, suggesters=None):
+        self.latency = latency
+        self.latency_jitter = latency_jitter
+        self.throttle_rate = throttle_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.search_index = search_index
+        self.suggesters = suggesters
+        self.documents = {}
+        self.lock = threading.Lock()
+        self.stats = {'upload_requests': 0, 'search_requests': 0, 'suggest_requests': 0, 'throttled': 0, 'errors': 0, 'rejected': 0,
+                      'adds': 0, 'deletes': 0, 'bytes_received': 0}
+
+    def count(self, stat, amount=1):
+        with self.lock:
+            self.stats[stat] += amount
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['documents'] = len(self.documents)
+        return stats
+
+    # sleeps for the configured latency, then returns 'throttle', 'error' or None
+    def inject_faults(self):
+        delay = self.latency + self.random.uniform(-self.latency_jitter, self.latency_jitter)
+        if(delay > 0):
+            time.sleep(delay)
+        roll = self.random.random()
+        if(roll < self.throttle_rate):
+            self.count('throttled')
+            return 'throttle'
+        if(roll < self.throttle_rate + self.error_rate):
+            self.count('errors')
+            return 'error'
+        return None
+
+    # returns (http status, response body dict)
+    def upload_documents(self, body):
+        self.count('upload_requests')
+        self.count('bytes_received', len(body))
+        if(len(body) > MAX_BATCH_SIZE):
+            self.count('rejected')
+            return 413, document_error('Request size %d exceeds the %d byte batch limit' % (len(body), MAX_BATCH_SIZE))
+        try:
+            batch = json.loads(body)
+        except ValueError as e:
+            self.count('rejected')
+            return 400, document_error('Malformed JSON batch: %s' % e)
+        if(not isinstance(batch, list)):
+            self.count('rejected')
+            return 400, document_error('A batch must be a JSON array of document operations')
+
+        adds = {}
+        deletes = []
+        for operation in batch:
+            doc_id = operation.get('id') if isinstance(operation, dict) else None
+            if(doc_id is None):
+                self.count('rejected')
+                return 400, document_error('Every document operation needs an id')
+            if(operation.get('type') == 'add'):
+                size = len(json.dumps(operation).encode('utf-8'))
+                if(size > MAX_FILE_SIZE):
+                    self.count('rejected')
+                    return 400, document_error('Document %s is %d bytes, over the %d byte limit' % (doc_id, size, MAX_FILE_SIZE))
+                adds[doc_id] = operation.get('fields', {})
+            elif(operation.get('type') == 'delete'):
+                deletes.append(doc_id)
+            else:
+                self.count('rejected')
+                return 400, document_error('Document %s has an invalid type %s' % (doc_id, operation.get('type')))
+
+        with self.lock:
+            self.documents.update(adds)
+            for doc_id in deletes:
+                self.documents.pop(doc_id, None)
+            self.stats['adds'] += len(adds)
+            self.stats['deletes'] += len(deletes)
+        return 200, {'status': 'success', 'adds': len(adds), 'deletes': len(deletes), 'warnings': []}
+
+    # simple query parser: '+word' must match, '-word' must not, plain words are optional (at least one must match)
+    def search(self, params):
+        self.count('search_requests')
+        if(self.search_index is not None):
+            return 200, search_from_params(self.search_index, params)
+        start_time = time.time()
+        query = params.get('q', [''])[0]
+        size = int(params.get('size', ['10'])[0])
+        start = int(params.get('start', ['0'])[0])
+        required, excluded, optional = [], [], []
+        for term in query.lower().split():
+            if(term.startswith('+')):
+                required.append(term[1:])
+            elif(term.startswith('-')):
+                excluded.append(term[1:])
+            else:
+                optional.append(term)
+
+        with self.lock:
+            documents = dict(self.documents)
+        hits = []
+        for doc_id, fields in documents.items():
+            words = set(re.findall(r'\w+', ' '.join(str(value) for value in fields.values()).lower()))
+            if(any(term not in words for term in required) or any(term in words for term in excluded)):
+                continue
+            if(len(optional) > 0 and len(required) == 0 and not any(term in words for term in optional)):
+                continue
+            hits.append(doc_id)
+        hits.sort()
+        page = [{'id': doc_id, 'fields': to_search_fields(documents[doc_id])} for doc_id in hits[start:start + size]]
+        return 200, {
+            'status': {'timems': int((time.time() - start_time) * 1000), 'rid': 'local'},
+            'hits': {'found': len(hits), 'start': start, 'hit': page},
+        }
+
+    def suggest(self, params):
+        self.count('suggest_requests')
+        suggester = params.get('suggester', [''])[0]
+        if(self.suggesters is None or suggester not in self.suggesters.suggesters):
+            return 400, {'__type': 'SearchException', 'message': 'No suggester named %s' % suggester}
+        return 200, self.suggesters.suggest(params.get('q', [''])[0], suggester, int(params.get('size', ['10'])[0]))
+
+def document_error(message):
+    return {'__type': 'DocumentServiceException', 'status': 'error', 'message': message}
+
+# search results return every field value as a list of strings
+def to_search_fields(fields):
+    return {name: [str(value)] for name, value in fields.items()}
+
+class LocalCloudSearchHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1' # keep-alive, like the real endpoint
+
+    def send_json(self, status, body, error_type=None):
+        encoded = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(encoded)))
+        if(error_type is not None):
+            self.send_header('x-amzn-ErrorType', error_type)
+        self.end_headers()
+        self.wfile.write(encoded)
+
+    def send_fault(self, fault):
+        if(fault == 'throttle'):
+            self.send_json(429, {'__type': 'Throttling', 'message': 'Rate exceeded'}, 'Throttling')
+        else:
+            self.send_json(500, {'__type': 'InternalFailure', 'message': 'Injected internal error'}, 'InternalFailure')
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if(url.path == '/2013-01-01/search'):
+            self.handle_search(parse_qs(body.decode('utf-8')))
+            return
+        if(url.path != '/2013-01-01/documents/batch'):
+            self.send_json(404, {'message': 'Not found: %s' % url.path})
+            return
+        fault = self.server.cloudsearch.inject_faults()
+        if(fault is not None):
+            self.send_fault(fault)
+            return
+        status, response = self.server.cloudsearch.upload_documents(body)
+        self.send_json(status, response, 'DocumentServiceException' if status != 200 else None)
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if(url.path == '/_stats'):
+            self.send_json(200, self.server.cloudsearch.get_stats())
+        elif(url.path == '/2013-01-01/search'):
+            self.handle_search(parse_qs(url.query))
+        elif(url.path == '/2013-01-01/suggest'):
+            self.handle_suggest(parse_qs(url.query))
+        else:
+            self.send_json(404, {'message': 'Not found: %s' % url.path})
+
+    def handle_search(self, params):
+        fault = self.server.cloudsearch.inject_faults()
+        if(fault is not None):
+            self.send_fault(fault)
+            return
+        status, response = self.server.cloudsearch.search(params)
+        self.send_json(status, response)
+
+    def handle_suggest(self, params):
+        fault = self.server.cloudsearch.inject_faults()
+        if(fault is not None):
+            self.send_fault(fault)
+            return
+        status, response = self.server.cloudsearch.suggest(params)
+        self.send_json(status, response, 'SearchException' if status != 200 else None)
+
+    def log_message(self, format, *args):
+        pass # one line per request drowns out everything else during load tests
+
+# starts a server in a background thread. returns the server; its url is server.url, stop it with server.shutdown()
+def start_server(port=0, **cloudsearch_options):
+    server = ThreadingHTTPServer(('127.0.0.1', port), LocalCloudSearchHandler)
+    server.daemon_threads = True
+    server.cloudsearch = LocalCloudSearch(**cloudsearch_options)
+    server.url = 'http://127.0.0.1:%d' % server.server_address[1]
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main():
+    parser = argparse.ArgumentParser(description='local stand-in for the cloudsearch document/search endpoints')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='seconds added to every request')
+    parser.add_argument('--latency-jitter', type=float, default=0, help='latency varies uniformly by +- this many seconds')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='fraction of requests answered with 429 Throttling')
+    parser.add_argument('--error-rate', type=float, default=0, help='fraction of requests answered with 500 InternalFailure')
+    parser.add_argument('--seed', type=int, default=None, help='random seed, for repeatable fault patterns')
+    parser.add_argument('--search-index', default=None, help='answer searches from this local_search.py index')
+    parser.add_argument('--suggest-index', default=None, help='answer suggest requests from these local_suggester.py suggesters')
+    args = parser.parse_args()
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), LocalCloudSearchHandler)
+    server.daemon_threads = True
+    search_index = LocalSearchIndex(args.search_index) if args.search_index is not None else None
+    suggesters = LocalSuggesters(args.suggest_index) if args.suggest_index is not None else None
+    server.cloudsearch = LocalCloudSearch(args.latency, args.latency_jitter, args.throttle_rate, args.error_rate, args.seed, search_index, suggesters)
+    print('local cloudsearch listening on http://127.0.0.1:%d' % args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print(server.cloudsearch.get_stats())
+
+if __name__ == '__main__':
+    main()
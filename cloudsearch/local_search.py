@@ -0,0 +1,472 @@
+"""
+a local search engine over archives-text with the same fields as our cloudsearch domain (see
+docs/search.md), for searching offline and for dev environments that shouldn't pay for a domain.
+
+    python local_search.py build ./archives-text/ ./search-index/ --workers 8
+    python local_search.py search ./search-index/ "+stanford football" --from 1950-01-01 --to 1959-12-31 --facet article_type
+
+or serve it through local_cloudsearch_server.py (--search-index ./search-index/) and use boto3's search.
+
+what's indexed is what cloudsearch-process-and-upload.py uploads: title, subtitle, author and
+article_text are text (searched together, as one bag of words), article_type and author_title are
+literals (filters and facets), publish_date is the date (range filters, sorting). Text is lowercased
+and split into words, and the usual english stopwords are dropped; there's no stemming or phrase
+search. Queries use the simple query parser's syntax: +word must match, -word must not, other words
+are optional (if there's no +word, at least one of them has to match). Results are ranked with BM25.
+
+building: the manifest is split into chunks (work_scheduler.py) that a Pool indexes in parallel,
+each into a segment on disk. Documents are numbered in manifest order, which is date order, so each
+chunk knows its document numbers up front and the segments merge into one index by concatenating
+postings, term by term. The index is:
+
+    meta.json         document count, average length, literal values
+    terms             every term, sorted, one after the other; terms.offsets says where each starts
+    postings          per term: its documents (uint32, ascending), then a uint16 key per document,
+                      tf * 256 + the document's length in one byte (see encode_length).
+                      postings.offsets says where each term's postings start
+    dates, article_types, author_titles
+                      one entry per document: YYYYMMDD, and the literal values as numbers
+    stored            the returned fields (everything but article_text), one json line per document,
+                      stored.offsets says where each starts
+
+searching: everything is memory mapped, a term is found by binary search and its postings are read
+with array.frombytes, so opening an index costs next to nothing. Because documents are in date
+order a date range is a range of document numbers, and each term's postings are cut down to it
+with bisect. The matching documents come from set operations on the postings, BM25's per document
+part is a lookup of the posting's key in a table (built once per index), and the top hits come out
+of heapq.nlargest. All of those loop in C, not python, so a query costs milliseconds per million
+postings it touches.
+"""
+
+import os
+import re
+import json
+import math
+import mmap
+import time
+import heapq
+import shutil
+import argparse
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from functools import partial, lru_cache
+from itertools import compress, repeat
+from multiprocessing import Pool
+from operator import add, mul, eq
+from article_pack import open_archives_text
+from archives_manifest import get_entry_relpath
+from article_reader import Article, get_article_fields, get_document_id
+from work_scheduler import plan_chunks
+
+
+INDEX_PATH = './search-index/'
+POOL_SIZE = os.cpu_count()
+
+TEXT_FIELDS = ['title', 'subtitle', 'author', 'article_text']
+LITERAL_FIELDS = ['article_type', 'author_title']
+# lucene's english stopwords, like cloudsearch's _en_default_ analysis scheme drops
+STOPWORDS = set(['a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if', 'in', 'into', 'is', 'it', 'no', 'not',
+                 'of', 'on', 'or', 'such', 'that', 'the', 'their', 'then', 'there', 'these', 'they', 'this', 'to', 'was', 'will', 'with'])
+_WORD = re.compile(r'\w+')
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+MAX_TF = 255
+# document lengths are stored in one byte, on a log scale: about 6% steps, up to a million words
+LENGTH_SCALE = 18.0
+POSTINGS_CACHE_SIZE = 256 # terms
+
+def tokenize(text):
+    return [word for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+def encode_length(length):
+    return min(255, int(round(math.log1p(length) * LENGTH_SCALE)))
+
+def decode_length(code):
+    return math.expm1(code / LENGTH_SCALE)
+
+def get_date_number(year, month, day):
+    return int(year) * 10000 + int(month) * 100 + int(day)
+
+# parses YYYY-MM-DD (or a cloudsearch date, 1950-01-01T00:00:00Z) into YYYYMMDD
+def parse_date(date):
+    year, month, day = date[:10].split('-')
+    return get_date_number(year, month, day)
+
+# the same fields cloudsearch-process-and-upload.py uploads (see article_reader.py), plus the document id
+def get_search_fields(archive, entry):
+    fields, repeat = get_article_fields(Article(get_entry_relpath(entry), archive), entry.year, entry.month, entry.day, entry.filename)
+    fields['id'] = get_document_id(fields)
+    return fields
+
+"""
+building
+"""
+def get_segment_path(segment_dir, chunk_number, name):
+    return os.path.join(segment_dir, '%06d.%s' % (chunk_number, name))
+
+# indexes one chunk (in a pool worker) into a segment. numbered_chunk is (chunk number, first document number, entries).
+# returns (chunk number, number of documents, total length)
+def index_chunk(archives_text_path, segment_dir, numbered_chunk):
+    chunk_number, first_doc, entries = numbered_chunk
+    archive = open_archives_text(archives_text_path)
+    postings = {} # term -> (documents, keys)
+    total_length = 0
+    with open(get_segment_path(segment_dir, chunk_number, 'docs'), 'w', encoding='utf-8') as docs_file:
+        for doc, entry in enumerate(entries, first_doc):
+            fields = get_search_fields(archive, entry)
+            counts = Counter(tokenize(' '.join(fields[field] for field in TEXT_FIELDS)))
+            length = sum(counts.values())
+            total_length += length
+            length_code = encode_length(length)
+            for term, tf in counts.items():
+                term_postings = postings.get(term)
+                if(term_postings is None):
+                    term_postings = postings[term] = (array('I'), array('H'))
+                term_postings[0].append(doc)
+                term_postings[1].append(min(tf, MAX_TF) * 256 + length_code)
+            del fields['article_text']
+            fields['date'] = get_date_number(entry.year, entry.month, entry.day)
+            docs_file.write(json.dumps(fields) + '\n')
+    with open(get_segment_path(segment_dir, chunk_number, 'postings'), 'wb') as postings_file, \
+         open(get_segment_path(segment_dir, chunk_number, 'terms'), 'w', encoding='utf-8') as terms_file:
+        for term in sorted(postings):
+            docs, keys = postings[term]
+            terms_file.write('%s\t%d\t%d\n' % (term, len(docs), postings_file.tell()))
+            docs.tofile(postings_file)
+            keys.tofile(postings_file)
+    return chunk_number, len(entries), total_length
+
+def _iter_segment_terms(segment_dir, chunk_number):
+    with open(get_segment_path(segment_dir, chunk_number, 'terms'), 'r', encoding='utf-8') as f:
+        for line in f:
+            term, df, offset = line.rstrip('\n').split('\t')
+            yield term, chunk_number, int(df), int(offset)
+
+# merges the segments' postings, term by term. segments are numbered in document order, so a term's postings
+# are each segment's postings one after the other
+def _merge_postings(segment_dir, chunk_numbers, index_path):
+    segment_files = {}
+    segment_maps = {}
+    for chunk_number in chunk_numbers:
+        segment_files[chunk_number] = open(get_segment_path(segment_dir, chunk_number, 'postings'), 'rb')
+        if(os.fstat(segment_files[chunk_number].fileno()).st_size > 0):
+            segment_maps[chunk_number] = mmap.mmap(segment_files[chunk_number].fileno(), 0, access=mmap.ACCESS_READ)
+    term_offsets = array('Q', [0])
+    postings_offsets = array('Q', [0])
+    merged = heapq.merge(*[_iter_segment_terms(segment_dir, chunk_number) for chunk_number in chunk_numbers])
+    with open(os.path.join(index_path, 'terms'), 'wb') as terms_file, open(os.path.join(index_path, 'postings'), 'wb') as postings_file:
+        current_term = None
+        parts = []
+        for term, chunk_number, df, offset in merged:
+            if(term != current_term and current_term is not None):
+                _write_term(current_term, parts, segment_maps, terms_file, postings_file, term_offsets, postings_offsets)
+                parts = []
+            current_term = term
+            parts.append((chunk_number, df, offset))
+        if(current_term is not None):
+            _write_term(current_term, parts, segment_maps, terms_file, postings_file, term_offsets, postings_offsets)
+    for chunk_number in chunk_numbers:
+        if(chunk_number in segment_maps):
+            segment_maps[chunk_number].close()
+        segment_files[chunk_number].close()
+    with open(os.path.join(index_path, 'terms.offsets'), 'wb') as f:
+        term_offsets.tofile(f)
+    with open(os.path.join(index_path, 'postings.offsets'), 'wb') as f:
+        postings_offsets.tofile(f)
+    return len(term_offsets) - 1
+
+def _write_term(term, parts, segment_maps, terms_file, postings_file, term_offsets, postings_offsets):
+    encoded = term.encode('utf-8')
+    terms_file.write(encoded)
+    term_offsets.append(term_offsets[-1] + len(encoded))
+    for chunk_number, df, offset in parts:
+        postings_file.write(segment_maps[chunk_number][offset:offset + 4 * df])
+    for chunk_number, df, offset in parts:
+        postings_file.write(segment_maps[chunk_number][offset + 4 * df:offset + 6 * df])
+    postings_offsets.append(postings_offsets[-1] + 6 * sum(df for chunk_number, df, offset in parts))
+
+# the per document tables and stored fields, from the segments' docs in document order. returns the literal values
+def _merge_docs(segment_dir, chunk_numbers, index_path):
+    dates = array('i')
+    literal_codes = {field: array('H') for field in LITERAL_FIELDS}
+    literal_values = {field: {} for field in LITERAL_FIELDS} # value -> code
+    stored_offsets = array('Q', [0])
+    with open(os.path.join(index_path, 'stored'), 'wb') as stored_file:
+        for chunk_number in chunk_numbers:
+            with open(get_segment_path(segment_dir, chunk_number, 'docs'), 'rb') as f:
+                for line in f:
+                    fields = json.loads(line)
+                    dates.append(fields.pop('date'))
+                    for field in LITERAL_FIELDS:
+                        codes = literal_values[field]
+                        literal_codes[field].append(codes.setdefault(fields[field], len(codes)))
+                    stored_file.write(line)
+                    stored_offsets.append(stored_offsets[-1] + len(line))
+    with open(os.path.join(index_path, 'dates'), 'wb') as f:
+        dates.tofile(f)
+    for field in LITERAL_FIELDS:
+        with open(os.path.join(index_path, field + 's'), 'wb') as f:
+            literal_codes[field].tofile(f)
+    with open(os.path.join(index_path, 'stored.offsets'), 'wb') as f:
+        stored_offsets.tofile(f)
+    return {field: sorted(values, key=values.get) for field, values in literal_values.items()}
+
+def build_index(archives_text_path, index_path=INDEX_PATH, workers=POOL_SIZE):
+    manifest = open_archives_text(archives_text_path).load_manifest()
+    entries = manifest.entries
+    # chunks are contiguous date ranges; numbering them in date order gives every chunk its first document number
+    chunks = sorted(plan_chunks(entries, workers), key=lambda chunk: chunk['entries'][0])
+    numbered_chunks = []
+    first_doc = 0
+    for chunk_number, chunk in enumerate(chunks):
+        numbered_chunks.append((chunk_number, first_doc, chunk['entries']))
+        first_doc += len(chunk['entries'])
+    numbered_chunks.sort(key=lambda numbered_chunk: len(numbered_chunk[2]), reverse=True) # biggest first, like plan_chunks
+
+    tmp_path = os.path.normpath(index_path) + '.tmp'
+    segment_dir = os.path.join(tmp_path, 'segments')
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(segment_dir)
+    index = partial(index_chunk, archives_text_path, segment_dir)
+    if(workers == 1):
+        results = list(map(index, numbered_chunks))
+    else:
+        with Pool(workers) as p:
+            results = list(p.imap_unordered(index, numbered_chunks, chunksize=1))
+    total_length = sum(length for chunk_number, documents, length in results)
+
+    chunk_numbers = list(range(len(chunks)))
+    term_count = _merge_postings(segment_dir, chunk_numbers, tmp_path)
+    literal_values = _merge_docs(segment_dir, chunk_numbers, tmp_path)
+    shutil.rmtree(segment_dir)
+    meta = {
+        'documents': len(entries),
+        'terms': term_count,
+        'average_length': total_length / max(1, len(entries)),
+        'literal_values': literal_values,
+        'source': archives_text_path,
+    }
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    # swap the finished index in, so searches never see half of one
+    shutil.rmtree(index_path, ignore_errors=True)
+    os.replace(tmp_path, index_path)
+    return meta
+
+"""
+searching
+"""
+# memory maps a whole file, as a memoryview of typecode if one is given (local_suggester.py uses this too)
+def map_file(path, typecode=None):
+    with open(path, 'rb') as f:
+        if(os.fstat(f.fileno()).st_size == 0):
+            return memoryview(b'').cast(typecode) if typecode is not None else b''
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(data).cast(typecode) if typecode is not None else data
+
+def _read_array(path, typecode):
+    values = array(typecode)
+    with open(path, 'rb') as f:
+        values.frombytes(f.read())
+    return values
+
+class LocalSearchIndex:
+    def __init__(self, index_path=INDEX_PATH):
+        self.path = index_path
+        with open(os.path.join(index_path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.documents = self.meta['documents']
+        self.terms = map_file(os.path.join(index_path, 'terms'))
+        self.term_offsets = map_file(os.path.join(index_path, 'terms.offsets'), 'Q')
+        self.postings = map_file(os.path.join(index_path, 'postings'))
+        self.postings_offsets = map_file(os.path.join(index_path, 'postings.offsets'), 'Q')
+        self.stored = map_file(os.path.join(index_path, 'stored'))
+        self.stored_offsets = map_file(os.path.join(index_path, 'stored.offsets'), 'Q')
+        self.dates = _read_array(os.path.join(index_path, 'dates'), 'i')
+        self.literal_codes = {field: _read_array(os.path.join(index_path, field + 's'), 'H') for field in LITERAL_FIELDS}
+        self.literal_values = self.meta['literal_values']
+        # BM25's per document part for every posting key (tf * 256 + length code)
+        average_length = max(self.meta['average_length'], 1)
+        norms = [BM25_K1 * (1 - BM25_B + BM25_B * decode_length(code) / average_length) for code in range(256)]
+        self.weights = [tf * (BM25_K1 + 1) / (tf + norms[code]) for tf in range(MAX_TF + 1) for code in range(256)]
+        self.get_postings = lru_cache(maxsize=POSTINGS_CACHE_SIZE)(self._get_postings)
+
+    def _get_term(self, i):
+        return self.terms[self.term_offsets[i]:self.term_offsets[i + 1]].decode('utf-8')
+
+    # index of term in the sorted terms, or None
+    def find_term(self, term):
+        low, high = 0, len(self.term_offsets) - 1
+        while(low < high):
+            middle = (low + high) // 2
+            if(self._get_term(middle) < term):
+                low = middle + 1
+            else:
+                high = middle
+        if(low < len(self.term_offsets) - 1 and self._get_term(low) == term):
+            return low
+        return None
+
+    # (documents, keys) for a term, both empty if it isn't in the index
+    def _get_postings(self, term):
+        docs = array('I')
+        keys = array('H')
+        i = self.find_term(term)
+        if(i is not None):
+            start, end = self.postings_offsets[i], self.postings_offsets[i + 1]
+            df = (end - start) // 6
+            docs.frombytes(self.postings[start:start + 4 * df])
+            keys.frombytes(self.postings[start + 4 * df:end])
+        return docs, keys
+
+    def get_idf(self, df):
+        return math.log(1 + (self.documents - df + 0.5) / (df + 0.5))
+
+    def get_fields(self, doc):
+        return json.loads(self.stored[self.stored_offsets[doc]:self.stored_offsets[doc + 1]])
+
+    # query: simple query parser syntax. start_date/end_date: YYYY-MM-DD, inclusive. filters: {literal field: value}.
+    # facets: literal fields to count values of among all matches. sort: '_score', 'publish_date desc' or 'publish_date asc'.
+    # returns a response shaped like cloudsearch's
+    def search(self, query, start=0, size=10, start_date=None, end_date=None, filters=None, facets=(), sort='_score'):
+        start_time = time.time()
+        required, excluded, optional = [], [], []
+        for word in query.split():
+            if(word.startswith('+')):
+                required.extend(tokenize(word[1:]))
+            elif(word.startswith('-')):
+                excluded.extend(tokenize(word[1:]))
+            else:
+                optional.extend(tokenize(word))
+
+        # documents are in date order, so a date range is a range of document numbers
+        first_doc = 0 if start_date is None else bisect_left(self.dates, parse_date(start_date))
+        end_doc = self.documents if end_date is None else bisect_left(self.dates, parse_date(end_date) + 1)
+        postings = {}
+        for term in set(required + excluded + optional):
+            docs, keys = self.get_postings(term)
+            i, j = bisect_left(docs, first_doc), bisect_left(docs, end_doc)
+            postings[term] = (docs[i:j], keys[i:j], len(docs))
+
+        if(len(required) > 0):
+            matches = set(postings[required[0]][0])
+            for term in required[1:]:
+                matches.intersection_update(postings[term][0])
+        else:
+            matches = set()
+            for term in optional:
+                matches.update(postings[term][0])
+        for term in excluded:
+            matches.difference_update(postings[term][0])
+        matches = list(matches)
+        for field, value in (filters or {}).items():
+            code = self.literal_values[field].index(value) if value in self.literal_values[field] else -1
+            matches = list(compress(matches, map(eq, map(self.literal_codes[field].__getitem__, matches), repeat(code))))
+
+        scores = None
+        if(sort == '_score'):
+            for term in set(required + optional):
+                docs, keys, df = postings[term]
+                if(len(docs) == 0):
+                    continue
+                weights = dict(zip(docs, map(self.weights.__getitem__, keys)))
+                term_scores = map(mul, map(weights.get, matches, repeat(0.0)), repeat(self.get_idf(df)))
+                scores = list(term_scores) if scores is None else list(map(add, scores, term_scores))
+            if(scores is None):
+                scores = [0.0] * len(matches)
+            # ties go to the later article
+            top = heapq.nlargest(start + size, zip(scores, matches))[start:]
+        else:
+            top = [(None, doc) for doc in sorted(matches, reverse=(sort != 'publish_date asc'))[start:start + size]]
+
+        hits = []
+        for score, doc in top:
+            fields = self.get_fields(doc)
+            doc_id = fields.pop('id')
+            if(score is not None):
+                fields['_score'] = '%.6f' % score
+            hits.append({'id': doc_id, 'fields': {name: [str(value)] for name, value in fields.items()}})
+        response = {
+            'status': {'timems': int((time.time() - start_time) * 1000), 'rid': 'local'},
+            'hits': {'found': len(matches), 'start': start, 'hit': hits},
+        }
+        if(len(facets) > 0):
+            response['facets'] = {}
+            for field in facets:
+                counts = Counter(map(self.literal_codes[field].__getitem__, matches))
+                response['facets'][field] = {'buckets': [{'value': self.literal_values[field][code], 'count': count}
+                                                         for code, count in counts.most_common()]}
+        return response
+
+# the parts of a cloudsearch filter query (fq) we understand: field:'value' and publish_date:['from','to'], and-ed together
+_FILTER_LITERAL = re.compile(r"(\w+):'((?:[^'\\]|\\.)*)'")
+_FILTER_RANGE = re.compile(r"(\w+):[\[{]'?([^,'\]}]*)'?,'?([^,'\]}]*)'?[\]}]")
+
+# answers a cloudsearch search request (the query string/form params, as lists like parse_qs gives) from the index
+def search_from_params(index, params):
+    filters = {}
+    start_date = end_date = None
+    fq = params.get('fq', [''])[0]
+    for field, value in _FILTER_LITERAL.findall(fq):
+        filters[field] = value.replace("\\'", "'")
+    for field, start_value, end_value in _FILTER_RANGE.findall(fq):
+        if(field == 'publish_date'):
+            start_date = start_value or None
+            end_date = end_value or None
+    # boto3 sends facets as one json object (facet={"article_type":{}}), the REST API as facet.article_type={}
+    facets = [field for field in LITERAL_FIELDS if 'facet.' + field in params]
+    if('facet' in params):
+        facets.extend(field for field in json.loads(params['facet'][0]) if field in LITERAL_FIELDS and field not in facets)
+    sort = params.get('sort', ['_score desc'])[0]
+    return index.search(params.get('q', [''])[0],
+                        start=int(params.get('start', ['0'])[0]),
+                        size=int(params.get('size', ['10'])[0]),
+                        start_date=start_date, end_date=end_date, filters=filters,
+                        facets=facets,
+                        sort='_score' if sort.startswith('_score') else sort)
+
+def main():
+    parser = argparse.ArgumentParser(description='build and search a local index of archives-text')
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help='index archives-text (a directory or a pack, see article_pack.py)')
+    build_parser.add_argument('archives_text_path')
+    build_parser.add_argument('index_path', nargs='?', default=INDEX_PATH)
+    build_parser.add_argument('--workers', type=int, default=POOL_SIZE)
+    search_parser = subparsers.add_parser('search', help='search an index')
+    search_parser.add_argument('index_path')
+    search_parser.add_argument('query')
+    search_parser.add_argument('--from', dest='start_date', default=None, help='YYYY-MM-DD')
+    search_parser.add_argument('--to', dest='end_date', default=None, help='YYYY-MM-DD')
+    search_parser.add_argument('--article-type', default=None)
+    search_parser.add_argument('--author-title', default=None)
+    search_parser.add_argument('--facet', action='append', default=[], choices=LITERAL_FIELDS)
+    search_parser.add_argument('--sort', default='_score', choices=['_score', 'publish_date desc', 'publish_date asc'])
+    search_parser.add_argument('--start', type=int, default=0)
+    search_parser.add_argument('--size', type=int, default=10)
+    args = parser.parse_args()
+
+    if(args.command == 'build'):
+        start_time = time.time()
+        meta = build_index(args.archives_text_path, args.index_path, args.workers)
+        print('indexed %d documents (%d terms) into %s in %.1f seconds' % (meta['documents'], meta['terms'], args.index_path, time.time() - start_time))
+    elif(args.command == 'search'):
+        filters = {}
+        if(args.article_type is not None):
+            filters['article_type'] = args.article_type
+        if(args.author_title is not None):
+            filters['author_title'] = args.author_title
+        response = LocalSearchIndex(args.index_path).search(args.query, args.start, args.size, args.start_date, args.end_date,
+                                                            filters, args.facet, args.sort)
+        print('%d found in %d ms' % (response['hits']['found'], response['status']['timems']))
+        for hit in response['hits']['hit']:
+            fields = hit['fields']
+            print('%s  %s  %s' % (fields.get('_score', [''])[0], hit['id'], fields['title'][0]))
+        for field, facet in response.get('facets', {}).items():
+            print('%s: %s' % (field, ', '.join('%s (%d)' % (bucket['value'], bucket['count']) for bucket in facet['buckets'])))
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
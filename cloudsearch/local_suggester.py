@@ -0,0 +1,318 @@
+"""
+a local stand-in for the cloudsearch suggesters (see SUGGESTER in cloudsearch-test.py), for
+autocompleting titles and authors in the archive browse UI without a round trip to AWS per keystroke.
+
+    python local_suggester.py build ./archives-text/ ./suggest-index/
+    python local_suggester.py suggest ./suggest-index/ title "stanfrod foot"
+
+or serve it through local_cloudsearch_server.py (--suggest-index ./suggest-index/), where the
+suggesters are called title and author.
+
+suggestions are whole titles or authors (as cloudsearch-process-and-upload.py uploads them) that
+start with what was typed, ignoring case and extra whitespace, ranked by how many articles have
+them. If there aren't enough of those, the rest are ones that start with what was typed give or
+take one typo (a missing, extra, wrong or swapped letter, like cloudsearch's 'low' fuzzy matching).
+
+each suggester is a trie over the sorted, lowercased suggestions, written to disk as flat arrays
+and memory mapped, so it loads instantly and only the nodes a lookup visits get read. Every node
+knows the range of suggestions under it and the TOP_SIZE most frequent of them, so a suggestion is
+a walk down the trie (binary searching each node's children) and reading that list. Nodes with
+TOP_SIZE or fewer suggestions under them don't get children; the rest of the prefix is checked
+against those few suggestions directly, which keeps the trie to a few nodes per TOP_SIZE suggestions.
+The files in each suggester's directory:
+
+    keys, keys.offsets          the suggestions lowercased and whitespace collapsed, sorted
+    values, values.offsets      what's shown: the most common spelling, a tab, the newest article's id
+    counts                      articles per suggestion
+    node_chars, node_first_child, node_child_count, node_start, node_end, node_top
+                                one entry per node, breadth first, so a node's children are next to each
+                                other (sorted by character). [start, end) is its range of suggestions
+    top                         TOP_SIZE (or fewer) suggestion numbers per node, most frequent first
+"""
+
+import os
+import json
+import time
+import heapq
+import shutil
+import argparse
+from array import array
+from bisect import bisect_left
+from collections import Counter, deque
+from article_pack import open_archives_text
+from archives_manifest import get_entry_relpath
+from article_reader import Article, get_header_fields, get_file_fields, get_document_id
+from local_search import map_file
+
+
+INDEX_PATH = './suggest-index/'
+SUGGEST_FIELDS = ['title', 'author']
+TOP_SIZE = 10
+MAX_KEY_LENGTH = 200 # longer "titles" are OCR running the title into the body
+NODE_ARRAYS = ['node_chars', 'node_first_child', 'node_child_count', 'node_start', 'node_end', 'node_top']
+
+def normalize_key(text):
+    return ' '.join(text.lower().split())
+
+# the title and author an article is uploaded with (see article_reader.py's get_header_fields), plus the document id.
+# only reads the header
+def get_suggest_fields(archive, entry):
+    header_fields = get_header_fields(Article(get_entry_relpath(entry), archive))
+    return {
+        'title': header_fields['title'],
+        'author': header_fields['author'].strip(),
+        'id': get_document_id(get_file_fields(entry.year, entry.month, entry.day, entry.filename)),
+    }
+
+"""
+building
+"""
+def _write_array(path, values):
+    with open(path, 'wb') as f:
+        values.tofile(f)
+
+def _write_strings(path, strings):
+    offsets = array('Q', [0])
+    with open(path, 'wb') as f:
+        for string in strings:
+            encoded = string.encode('utf-8')
+            f.write(encoded)
+            offsets.append(offsets[-1] + len(encoded))
+    _write_array(path + '.offsets', offsets)
+
+# keys: sorted, counts: parallel to keys. returns the node arrays and the top lists
+def build_trie(keys, counts, top_size=TOP_SIZE):
+    nodes = {name: array('I') for name in NODE_ARRAYS}
+    depths = []
+    queue = deque([(0, 0, len(keys), 0)]) # (char, start, end, depth)
+    # breadth first, so every node's children get consecutive numbers
+    while(len(queue) > 0):
+        char, start, end, depth = queue.popleft()
+        node = len(depths)
+        nodes['node_chars'].append(char)
+        nodes['node_start'].append(start)
+        nodes['node_end'].append(end)
+        depths.append(depth)
+        nodes['node_first_child'].append(0)
+        nodes['node_child_count'].append(0)
+        if(end - start <= top_size):
+            continue # a leaf, see the docstring
+        # the key that's exactly this prefix (if there is one) sorts first, then each next character's range
+        i = start
+        if(len(keys[i]) == depth):
+            i += 1
+        children = 0
+        while(i < end):
+            c = keys[i][depth]
+            j = i + 1
+            while(j < end and keys[j][depth] == c):
+                j += 1
+            queue.append((ord(c), i, j, depth + 1))
+            children += 1
+            i = j
+        nodes['node_first_child'][node] = node + 1 + len(queue) - children # everything before them in the queue is numbered first
+        nodes['node_child_count'][node] = children
+
+    # each node's most frequent suggestions, from its children's (a node's children always come after it)
+    node_count = len(depths)
+    tops = [None] * node_count
+    for node in range(node_count - 1, -1, -1):
+        start, end = nodes['node_start'][node], nodes['node_end'][node]
+        first_child, child_count = nodes['node_first_child'][node], nodes['node_child_count'][node]
+        if(child_count == 0):
+            candidates = range(start, end)
+        else:
+            candidates = [start] if len(keys[start]) == depths[node] else []
+            for child in range(first_child, first_child + child_count):
+                candidates.extend(tops[child])
+        tops[node] = heapq.nlargest(top_size, candidates, key=lambda i: (counts[i], -i))
+    top = array('I')
+    top_starts = array('I')
+    for node in range(node_count):
+        top_starts.append(len(top))
+        top.extend(tops[node])
+    top_starts.append(len(top))
+    nodes['node_top'] = top_starts
+    return nodes, top
+
+def build_suggester(values_by_key, path, top_size=TOP_SIZE):
+    os.makedirs(path)
+    keys = sorted(values_by_key)
+    counts = array('I', (sum(values_by_key[key]['spellings'].values()) for key in keys))
+    values = [values_by_key[key]['spellings'].most_common(1)[0][0] + '\t' + values_by_key[key]['id'] for key in keys]
+    _write_strings(os.path.join(path, 'keys'), keys)
+    _write_strings(os.path.join(path, 'values'), values)
+    _write_array(os.path.join(path, 'counts'), counts)
+    nodes, top = build_trie(keys, counts, top_size)
+    for name in NODE_ARRAYS:
+        _write_array(os.path.join(path, name), nodes[name])
+    _write_array(os.path.join(path, 'top'), top)
+    return len(keys), len(nodes['node_chars'])
+
+def build_index(archives_text_path, index_path=INDEX_PATH):
+    archive = open_archives_text(archives_text_path)
+    # field -> key -> {'spellings': Counter, 'id': newest article's id}
+    values_by_key = {field: {} for field in SUGGEST_FIELDS}
+    for entry in archive.load_manifest().entries:
+        fields = get_suggest_fields(archive, entry)
+        for field in SUGGEST_FIELDS:
+            key = normalize_key(fields[field])
+            if(len(key) == 0 or len(key) > MAX_KEY_LENGTH):
+                continue
+            value = values_by_key[field].setdefault(key, {'spellings': Counter(), 'id': None})
+            value['spellings'][fields[field]] += 1
+            value['id'] = fields['id'] # entries are in date order, so the last one wins
+    tmp_path = os.path.normpath(index_path) + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    meta = {'source': archives_text_path, 'top_size': TOP_SIZE, 'suggesters': {}}
+    for field in SUGGEST_FIELDS:
+        suggestions, nodes = build_suggester(values_by_key[field], os.path.join(tmp_path, field))
+        meta['suggesters'][field] = {'suggestions': suggestions, 'nodes': nodes}
+    with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+        json.dump(meta, f)
+    shutil.rmtree(index_path, ignore_errors=True)
+    os.replace(tmp_path, index_path)
+    return meta
+
+"""
+suggesting
+"""
+# True if key starts with query, allowing `edits` edits (a deleted, inserted, changed or swapped character)
+def matches_prefix(key, query, edits):
+    i = 0
+    while(i < len(query) and i < len(key) and key[i] == query[i]):
+        i += 1
+    if(i == len(query)):
+        return True
+    if(edits == 0):
+        return False
+    return (matches_prefix(key[i:], query[i + 1:], 0) or # a character typed that shouldn't be there
+            matches_prefix(key[i + 1:], query[i + 1:], 0) or # the wrong character
+            matches_prefix(key[i + 1:], query[i:], 0) or # a character missed out
+            (i + 1 < len(query) and i + 1 < len(key) and key[i] == query[i + 1] and key[i + 1] == query[i]
+             and matches_prefix(key[i + 2:], query[i + 2:], 0)))
+
+class Suggester:
+    def __init__(self, path):
+        self.path = path
+        self.keys = map_file(os.path.join(path, 'keys'))
+        self.key_offsets = map_file(os.path.join(path, 'keys.offsets'), 'Q')
+        self.values = map_file(os.path.join(path, 'values'))
+        self.value_offsets = map_file(os.path.join(path, 'values.offsets'), 'Q')
+        self.counts = map_file(os.path.join(path, 'counts'), 'I')
+        self.top = map_file(os.path.join(path, 'top'), 'I')
+        for name in NODE_ARRAYS:
+            setattr(self, name, map_file(os.path.join(path, name), 'I'))
+
+    def get_key(self, i):
+        return self.keys[self.key_offsets[i]:self.key_offsets[i + 1]].decode('utf-8')
+
+    def get_value(self, i):
+        return self.values[self.value_offsets[i]:self.value_offsets[i + 1]].decode('utf-8').split('\t')
+
+    def get_child(self, node, char):
+        first = self.node_first_child[node]
+        children = self.node_chars[first:first + self.node_child_count[node]]
+        i = bisect_left(children, ord(char))
+        if(i < len(children) and children[i] == ord(char)):
+            return first + i
+        return None
+
+    def get_top(self, node):
+        return self.top[self.node_top[node]:self.node_top[node + 1]]
+
+    # the suggestions under node whose keys (from depth on) start with query[position:], within `edits` edits
+    def _collect(self, node, depth, query, position, edits, found):
+        if(position == len(query)):
+            found.update(self.get_top(node))
+            return
+        if(self.node_child_count[node] == 0):
+            rest = query[position:]
+            for i in range(self.node_start[node], self.node_end[node]):
+                if(matches_prefix(self.get_key(i)[depth:], rest, edits)):
+                    found.add(i)
+            return
+        child = self.get_child(node, query[position])
+        if(child is not None):
+            self._collect(child, depth + 1, query, position + 1, edits, found)
+        if(edits == 0):
+            return
+        self._collect(node, depth, query, position + 1, 0, found) # a character typed that shouldn't be there
+        first = self.node_first_child[node]
+        for other in range(first, first + self.node_child_count[node]):
+            if(other == child):
+                continue
+            self._collect(other, depth + 1, query, position + 1, 0, found) # the wrong character
+            self._collect(other, depth + 1, query, position, 0, found) # a character missed out
+        if(position + 1 < len(query) and query[position] != query[position + 1]):
+            # two characters the wrong way round
+            swapped = query[:position] + query[position + 1] + query[position] + query[position + 2:]
+            self._collect(node, depth, swapped, position, 0, found)
+
+    def _rank(self, found, size):
+        return heapq.nlargest(size, found, key=lambda i: (self.counts[i], -i))
+
+    # returns [(suggestion, number of articles, newest article's id)], exact prefix matches first, then one typo away
+    def suggest(self, query, size=TOP_SIZE):
+        query = normalize_key(query)
+        if(len(query) == 0 or len(self.node_chars) == 0):
+            return []
+        exact = set()
+        self._collect(0, 0, query, 0, 0, exact)
+        ranked = self._rank(exact, size)
+        if(len(ranked) < size):
+            fuzzy = set()
+            self._collect(0, 0, query, 0, 1, fuzzy)
+            ranked.extend(self._rank(fuzzy - exact, size - len(ranked)))
+        suggestions = []
+        for i in ranked:
+            suggestion, doc_id = self.get_value(i)
+            suggestions.append((suggestion, self.counts[i], doc_id))
+        return suggestions
+
+class LocalSuggesters:
+    def __init__(self, index_path=INDEX_PATH):
+        with open(os.path.join(index_path, 'meta.json'), 'r') as f:
+            self.meta = json.load(f)
+        self.suggesters = {field: Suggester(os.path.join(index_path, field)) for field in self.meta['suggesters']}
+
+    # returns a response shaped like cloudsearch's suggest
+    def suggest(self, query, suggester, size=TOP_SIZE):
+        start_time = time.time()
+        suggestions = self.suggesters[suggester].suggest(query, size)
+        return {
+            'status': {'timems': int((time.time() - start_time) * 1000), 'rid': 'local'},
+            'suggest': {'query': query, 'found': len(suggestions),
+                        'suggestions': [{'suggestion': suggestion, 'score': count, 'id': doc_id} for suggestion, count, doc_id in suggestions]},
+        }
+
+def main():
+    parser = argparse.ArgumentParser(description='build and query local title/author suggesters')
+    subparsers = parser.add_subparsers(dest='command')
+    build_parser = subparsers.add_parser('build', help='build the suggesters from archives-text (a directory or a pack, see article_pack.py)')
+    build_parser.add_argument('archives_text_path')
+    build_parser.add_argument('index_path', nargs='?', default=INDEX_PATH)
+    suggest_parser = subparsers.add_parser('suggest', help='get suggestions')
+    suggest_parser.add_argument('index_path')
+    suggest_parser.add_argument('suggester', choices=SUGGEST_FIELDS)
+    suggest_parser.add_argument('query')
+    suggest_parser.add_argument('--size', type=int, default=TOP_SIZE)
+    args = parser.parse_args()
+
+    if(args.command == 'build'):
+        start_time = time.time()
+        meta = build_index(args.archives_text_path, args.index_path)
+        for field, info in meta['suggesters'].items():
+            print('%s: %d suggestions, %d trie nodes' % (field, info['suggestions'], info['nodes']))
+        print('built %s in %.1f seconds' % (args.index_path, time.time() - start_time))
+    elif(args.command == 'suggest'):
+        start_time = time.perf_counter()
+        suggestions = LocalSuggesters(args.index_path).suggesters[args.suggester].suggest(args.query, args.size)
+        for suggestion, count, doc_id in suggestions:
+            print('%6d  %s' % (count, suggestion))
+        print('%.2f ms' % ((time.perf_counter() - start_time) * 1000))
+    else:
+        parser.print_help()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+"""
+per stage timings and counters for the processing pipelines (the uploader, fix-repeats.py and
+corrections.py), cheap enough to leave on for real runs.
+
+each stage (reading a file, parsing it, removing repeats, encoding it, uploading a batch, ...) is
+timed into a histogram, and counters keep how many bytes and documents went through it and how
+many errors it hit:
+
+    metrics = PipelineMetrics('upload')
+    start = time.perf_counter()
+    data = read_the_article()
+    metrics.observe('read', time.perf_counter() - start)
+    metrics.count('bytes', 'read', len(data))
+
+an observation is a bisect and two additions, so it costs well under a microsecond next to the tens
+of microseconds each article takes anyway.
+
+Pool workers each keep their own PipelineMetrics and send get_snapshot() back with their results,
+which the parent merge()s. At the end of the run the parent writes write_prometheus(path), the
+Prometheus text format (for node_exporter's textfile collector, or just to diff between runs), and
+prints format_summary(), a table of every stage.
+"""
+
+import os
+import time
+from bisect import bisect_left
+
+
+# upper bounds in seconds. Reading and parsing an article are well under a millisecond, uploading a 5 mb batch is seconds
+HISTOGRAM_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+METRIC_PREFIX = 'archives'
+COUNTER_HELP = {
+    'bytes': 'bytes that went through each stage',
+    'documents': 'documents (articles or files) that went through each stage',
+    'errors': 'errors in each stage',
+    'retries': 'upload attempts that had to be retried',
+    'batches': 'upload batches built',
+    'unchanged': 'documents skipped because they were unchanged since the last upload',
+    'repeats_removed': 'articles that had a repeat removed',
+    'normalized': 'articles whose whitespace was normalized',
+    'written': 'files rewritten because something changed',
+}
+
+class PipelineMetrics:
+    # pipeline: 'upload', 'fix_repeats' or 'corrections', a label on every metric
+    def __init__(self, pipeline):
+        self.pipeline = pipeline
+        self.histograms = {} # stage -> [count per bucket..., count over the last bucket, sum of seconds]
+        self.counters = {} # (name, stage) -> total
+
+    def observe(self, stage, seconds):
+        histogram = self.histograms.get(stage)
+        if(histogram is None):
+            histogram = self.histograms[stage] = [0] * (len(HISTOGRAM_BUCKETS) + 1) + [0.0]
+        histogram[bisect_left(HISTOGRAM_BUCKETS, seconds)] += 1
+        histogram[-1] += seconds
+
+    def count(self, name, stage, amount=1):
+        key = (name, stage)
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    # plain dicts and lists, to send back from a Pool worker
+    def get_snapshot(self):
+        return {'histograms': self.histograms, 'counters': self.counters}
+
+    def merge(self, snapshot):
+        for stage, histogram in snapshot['histograms'].items():
+            mine = self.histograms.get(stage)
+            if(mine is None):
+                self.histograms[stage] = list(histogram)
+            else:
+                for i, value in enumerate(histogram):
+                    mine[i] += value
+        for key, amount in snapshot['counters'].items():
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def get_stages(self):
+        stages = list(self.histograms)
+        for name, stage in self.counters:
+            if(stage not in stages):
+                stages.append(stage)
+        return stages
+
+    # upper bound of the bucket the q quantile falls in (the last bucket's bound if it's past them all)
+    def get_quantile(self, stage, q):
+        histogram = self.histograms[stage]
+        total = sum(histogram[:-1])
+        seen = 0
+        for i, bucket_count in enumerate(histogram[:-1]):
+            seen += bucket_count
+            if(seen >= q * total):
+                return HISTOGRAM_BUCKETS[min(i, len(HISTOGRAM_BUCKETS) - 1)]
+        return HISTOGRAM_BUCKETS[-1]
+
+    def format_prometheus(self):
+        lines = []
+        name = '%s_stage_seconds' % METRIC_PREFIX
+        lines.append('# HELP %s time spent in each stage of the pipeline' % name)
+        lines.append('# TYPE %s histogram' % name)
+        for stage, histogram in sorted(self.histograms.items()):
+            labels = 'pipeline="%s",stage="%s"' % (self.pipeline, stage)
+            cumulative = 0
+            for bound, bucket_count in zip(HISTOGRAM_BUCKETS, histogram):
+                cumulative += bucket_count
+                lines.append('%s_bucket{%s,le="%g"} %d' % (name, labels, bound, cumulative))
+            cumulative += histogram[-2]
+            lines.append('%s_bucket{%s,le="+Inf"} %d' % (name, labels, cumulative))
+            lines.append('%s_sum{%s} %.6f' % (name, labels, histogram[-1]))
+            lines.append('%s_count{%s} %d' % (name, labels, cumulative))
+        for counter in sorted(set(counter for counter, stage in self.counters)):
+            name = '%s_%s_total' % (METRIC_PREFIX, counter)
+            lines.append('# HELP %s %s' % (name, COUNTER_HELP.get(counter, counter)))
+            lines.append('# TYPE %s counter' % name)
+            for (other, stage), amount in sorted(self.counters.items()):
+                if(other == counter):
+                    lines.append('%s{pipeline="%s",stage="%s"} %d' % (name, self.pipeline, stage, amount))
+        name = '%s_last_run_timestamp_seconds' % METRIC_PREFIX
+        lines.append('# HELP %s when the pipeline last finished' % name)
+        lines.append('# TYPE %s gauge' % name)
+        lines.append('%s{pipeline="%s"} %d' % (name, self.pipeline, time.time()))
+        return '\n'.join(lines) + '\n'
+
+    # written to a temporary file and renamed, so the textfile collector never reads half a file
+    def write_prometheus(self, path):
+        directory = os.path.dirname(path)
+        if(directory != ''):
+            os.makedirs(directory, exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.format_prometheus())
+        os.replace(path + '.tmp', path)
+
+    def format_summary(self):
+        lines = ['%-18s %10s %10s %9s %9s %9s %12s %10s %7s' % ('stage', 'calls', 'seconds', 'p50 ms', 'p95 ms', 'p99 ms', 'bytes', 'documents', 'errors')]
+        for stage in self.get_stages():
+            histogram = self.histograms.get(stage)
+            if(histogram is not None):
+                timing = '%10d %10.3f %9g %9g %9g' % (sum(histogram[:-1]), histogram[-1], self.get_quantile(stage, 0.5) * 1000,
+                                                     self.get_quantile(stage, 0.95) * 1000, self.get_quantile(stage, 0.99) * 1000)
+            else:
+                timing = '%10s %10s %9s %9s %9s' % ('', '', '', '', '')
+            lines.append('%-18s %s %12d %10d %7d' % (stage, timing, self.counters.get(('bytes', stage), 0),
+                                                     self.counters.get(('documents', stage), 0), self.counters.get(('errors', stage), 0)))
+        return '\n'.join(lines)
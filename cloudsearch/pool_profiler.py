@@ -0,0 +1,216 @@
+"""
+profiles a multiprocessing run, workers included, for the scripts' --profile option.
+
+cProfile run around main() only sees the parent, which spends the run waiting on the Pool. Here
+every process profiles itself: the parent calls start(), the work function handed to the Pool is
+wrapped with wrap(), and each worker profiles the tasks it runs with cProfile and, at the same
+time, samples its call stack every SAMPLE_INTERVAL seconds. Both are saved after every task (Pool
+workers exit without running atexit). At the end the parent's finish() adds them all up into
+    profile_dir/profile.prof        pstats, e.g. python -m pstats ./profiles/profile.prof
+    profile_dir/profile.txt         the top functions by cumulative and by own time
+    profile_dir/profile.collapsed   the sampled stacks in the collapsed format flamegraph.pl and
+                                    speedscope read: frame;frame;frame count
+
+    profiling = Profiling(max_seconds=60)
+    profiling.start()
+    with Pool(POOL_SIZE) as p:
+        for result in p.imap_unordered(profiling.wrap(process_chunk), chunks, chunksize=1):
+            ...
+    profiling.finish()
+
+max_seconds and max_items only profile the start of each process's work (its first N seconds,
+or its first N articles, counted by the tick() the processors call for every article), which is
+usually enough to find the hot spots and keeps a full run from crawling under cProfile.
+
+only the main thread of each process is profiled: that's where parsing happens. The uploader's
+upload threads (see upload_pipeline.py) are waiting on the network and don't show up.
+"""
+
+import os
+import sys
+import glob
+import time
+import pstats
+import shutil
+import cProfile
+import threading
+
+
+PROFILE_DIR = './profiles/'
+SAMPLE_INTERVAL = 0.005 # seconds between stack samples
+REPORT_LINES = 40
+
+_CURRENT = None # this process's ProcessProfile, if it's being profiled
+
+# one frame of a collapsed stack
+def describe_frame(frame):
+    code = frame.f_code
+    return '%s (%s:%d)' % (code.co_name, os.path.basename(code.co_filename), code.co_firstlineno)
+
+class StackSampler(threading.Thread):
+    """
+    counts the call stacks of one thread, sampled every interval seconds while active. A sample
+    is only taken if the process used the cpu for most of the interval, so time spent waiting (on
+    the Pool's results, on a full upload queue) doesn't show up
+    """
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL, max_seconds=None):
+        threading.Thread.__init__(self, daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.active = False
+        self.stacks = {} # 'outermost;...;innermost' -> samples
+        self.lock = threading.Lock()
+        self.started_at = time.perf_counter()
+
+    def run(self):
+        last_cpu = time.process_time()
+        while(self.max_seconds is None or time.perf_counter() - self.started_at < self.max_seconds):
+            time.sleep(self.interval)
+            cpu = time.process_time()
+            busy = cpu - last_cpu >= self.interval / 2
+            last_cpu = cpu
+            if(not self.active or not busy):
+                continue
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while(frame is not None):
+                stack.append(describe_frame(frame))
+                frame = frame.f_back
+            key = ';'.join(reversed(stack))
+            with self.lock:
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+
+    def get_stacks(self):
+        with self.lock:
+            return dict(self.stacks)
+
+class ProcessProfile:
+    def __init__(self, settings, label):
+        self.settings = settings
+        self.pid = os.getpid()
+        self.path = os.path.join(settings.get_process_dir(), '%s-%d' % (label, self.pid))
+        self.profiler = cProfile.Profile()
+        self.sampler = StackSampler(threading.get_ident(), settings.sample_interval, settings.max_seconds)
+        self.sampler.start()
+        self.started_at = time.perf_counter()
+        self.items = 0
+        self.enabled = False
+        self.stopped = False
+
+    def resume(self):
+        if(not self.stopped and not self.enabled):
+            self.profiler.enable()
+            self.sampler.active = True
+            self.enabled = True
+
+    def pause(self):
+        if(self.enabled):
+            self.profiler.disable()
+            self.sampler.active = False
+            self.enabled = False
+
+    # for every article (or whatever the unit of work is); stops profiling once past the limits
+    def tick(self):
+        self.items += 1
+        settings = self.settings
+        if((settings.max_items is not None and self.items > settings.max_items) or
+           (settings.max_seconds is not None and time.perf_counter() - self.started_at >= settings.max_seconds)):
+            self.pause()
+            self.stopped = True
+
+    def save(self):
+        self.profiler.dump_stats(self.path + '.prof')
+        with open(self.path + '.collapsed', 'w') as f:
+            for stack, samples in self.sampler.get_stacks().items():
+                f.write('%s %d\n' % (stack, samples))
+
+# this process's profile. A forked worker starts one of its own, and turns off the parent's it inherited
+def get_process_profile(settings, label):
+    global _CURRENT
+    if(_CURRENT is not None and _CURRENT.pid != os.getpid()):
+        _CURRENT.profiler.disable()
+        _CURRENT = None
+    if(_CURRENT is None):
+        _CURRENT = ProcessProfile(settings, label)
+    return _CURRENT
+
+# call for every article; does nothing unless this process is being profiled
+def tick():
+    if(_CURRENT is not None and _CURRENT.enabled):
+        _CURRENT.tick()
+
+class ProfiledTask:
+    """
+    a Pool work function, profiled in whichever worker runs it. Pickles as long as fn does
+    """
+    def __init__(self, fn, settings):
+        self.fn = fn
+        self.settings = settings
+
+    def __call__(self, *args, **kwargs):
+        profile = get_process_profile(self.settings, 'worker')
+        profile.resume()
+        try:
+            return self.fn(*args, **kwargs)
+        finally:
+            profile.pause()
+            profile.save()
+
+class Profiling:
+    # max_seconds/max_items: only profile each process's first seconds/articles, None for all of it
+    def __init__(self, profile_dir=PROFILE_DIR, max_seconds=None, max_items=None, sample_interval=SAMPLE_INTERVAL):
+        self.profile_dir = profile_dir
+        self.max_seconds = max_seconds
+        self.max_items = max_items
+        self.sample_interval = sample_interval
+
+    def get_process_dir(self):
+        return os.path.join(self.profile_dir, 'processes')
+
+    # starts profiling this (the parent) process, and clears out profiles from an earlier run
+    def start(self):
+        shutil.rmtree(self.get_process_dir(), ignore_errors=True)
+        os.makedirs(self.get_process_dir())
+        get_process_profile(self, 'main').resume()
+
+    def wrap(self, fn):
+        return ProfiledTask(fn, self)
+
+    # stops profiling the parent and merges every process's profile. returns the paths written
+    def finish(self):
+        profile = get_process_profile(self, 'main')
+        profile.pause()
+        profile.save()
+        prefix = os.path.join(self.profile_dir, 'profile')
+        stats = pstats.Stats(*sorted(glob.glob(os.path.join(self.get_process_dir(), '*.prof'))))
+        stats.dump_stats(prefix + '.prof')
+        with open(prefix + '.txt', 'w') as f:
+            stats.stream = f
+            f.write('%d processes profiled\n' % len(glob.glob(os.path.join(self.get_process_dir(), '*.prof'))))
+            stats.sort_stats('cumulative').print_stats(REPORT_LINES)
+            stats.sort_stats('tottime').print_stats(REPORT_LINES)
+        stacks = {}
+        for path in glob.glob(os.path.join(self.get_process_dir(), '*.collapsed')):
+            with open(path) as f:
+                for line in f:
+                    stack, samples = line.rstrip('\n').rsplit(' ', 1)
+                    stacks[stack] = stacks.get(stack, 0) + int(samples)
+        with open(prefix + '.collapsed', 'w') as f:
+            for stack, samples in sorted(stacks.items()):
+                f.write('%s %d\n' % (stack, samples))
+        return [prefix + '.prof', prefix + '.txt', prefix + '.collapsed']
+
+# --profile, --profile-seconds and --profile-ITEMS for a script's argparse parser
+def add_profile_arguments(parser, items='articles'):
+    parser.add_argument('--profile', action='store_true',
+                        help='profile every process (workers included) and write the merged profile to %s' % PROFILE_DIR)
+    parser.add_argument('--profile-seconds', type=float, default=None, help='with --profile, only profile the first N seconds of each process')
+    parser.add_argument('--profile-' + items, type=int, default=None, dest='profile_items',
+                        help='with --profile, only profile the first N %s of each process' % items)
+
+# a Profiling for the parsed arguments, or None without --profile
+def get_profiling(args):
+    if(not args.profile):
+        return None
+    return Profiling(max_seconds=args.profile_seconds, max_items=args.profile_items)
@@ -13,24 +13,17 @@ ref https://github.com/awsdocs/amazon-cloudsearch-developer-guide/blob/master/do
 import boto3
 import os
 import re
+from article_pack import open_archives_text
+from author_titles import split_author_title, VALID_AUTHOR_TITLES
+from article_reader import Article
 
 # DOC_ENDPOINT = "https://ENDPOINT_HERE"
 # doc_client = boto3.client('cloudsearchdomain', endpoint_url=DOC_ENDPOINT)
 
 # You need to set this
-ARCHIVES_TEXT_PATH = "/Users/alexfu/Desktop/School/College/Clubs_Activities/Stanford-Daily/archives-text/"
+ARCHIVES_TEXT_PATH = "/Users/alexfu/Desktop/School/College/Clubs_Activities/Stanford-Daily/archives-text/" # or a pack of it, see article_pack.py
 
 VALID_ARTICLE_TYPES = ['article', 'advertisement',]
-VALID_AUTHOR_TITLES = ['', 'SENIOR STAFF WRITER', 'STAFF WRITER', 'DESK EDITOR', 'CONTRIBUTING WRITER', 
-'MANAGING EDITOR', 'EDITOR IN CHIEF', 'DEPUTY EDITOR', 'EXECUTIVE EDITOR', 'STAFF', 
-'ASSU President', 'ASSU Parlimentarian', 'STAFF FOOTBALL WRITERS', 'FASHION COLUMNIST', 
-'FOOTBALL EDITOR', 'ARTS EDITOR', 'FOOD EDITOR', 'FOOD DINING EDITOR', 'OPINIONS DESK',
-'FOOD DRUNK EDITOR', 'FELLOW', 'DAILY INTERN', 'CONTRIBUTING EDITOR', 'MANAGING WRITER',
-'GUEST COLUMNIST', 'SEX GODDESS', 'GUEST COLUMNISTS', 'EDITORIAL STAKE', 'CONTRIBUTING YANKEE',
-'SPECIAL CONTRIBUTOR', 'EDITORIAL BOARD', 'CONTRIBUTING WRITER', 'EDITORIAL STAFF', 'FILM CRITIC',
-'HEALTH EDITOR', 'ASSHOLE', 'INTERMISSION', 'NEWS EDITOR', 'CLASS PRESIDENT', 'ASSOCIATED PRESS',
-'AP SPORTS WRITER', 'AP BASEBALL WRITER', 'WEEKLY COLUMNIST', 'HEALTH COLUMNIST', 'ASSOCIATED EDITOR',
-'ASSOCIATE EDITOR', 'SPORTS EDITOR', 'EDITOR THE DAILY', ]
 
 # see here for limits https://github.com/awsdocs/amazon-cloudsearch-developer-guide/blob/master/doc_source/limits.md
 MAX_BATCH_SIZE = 5242880 # 5 MB
@@ -82,83 +75,58 @@ def create_article_fields(articleText, articleType, articleNumber, publishDate,
     }
     return fields
 
+# index of every article in ARCHIVES_TEXT_PATH (see archives_manifest.py), so we don't have to list directories
+MANIFEST = None
+
+def get_manifest():
+    global MANIFEST
+    if(MANIFEST is None):
+        MANIFEST = open_archives_text(ARCHIVES_TEXT_PATH).load_manifest()
+    return MANIFEST
+
 def get_archives_years():
-    entries = os.listdir(ARCHIVES_TEXT_PATH)
-    filtered = []
-    for i in range(0, len(entries)):
-        try: 
-            filtered.append( int(entries[i]))
-        except:
-            continue
-    return filtered
+    return get_manifest().years()
 
 def get_archives_months(year):
-    entries = os.listdir(ARCHIVES_TEXT_PATH + str(year).zfill(4) + "/")
-    filtered = []
-    for i in range(0, len(entries)):
-        try: 
-            filtered.append( int(entries[i]))
-        except:
-            continue
-    return filtered
+    return get_manifest().months(year)
 
 def get_archives_days(year, month):
-    entries = os.listdir(ARCHIVES_TEXT_PATH + str(year).zfill(4) + "/" + str(month).zfill(2) + "/")
-    filtered = []
-    for i in range(0, len(entries)):
-        try: 
-            filtered.append( int(entries[i]))
-        except:
-            continue
-    return filtered
+    return get_manifest().days(year, month)
 
 def get_archives_article_filenames(year, month, day):
-    entries = os.listdir(ARCHIVES_TEXT_PATH + str(year).zfill(4) + "/" + str(month).zfill(2) + "/" + str(day).zfill(2))
-    return entries
+    return get_manifest().articles(year, month, day)
 
 """
 returns a dict containing article data
 """
 def get_article_data(year, month, day, filename):
-    with open(ARCHIVES_TEXT_PATH + str(year).zfill(4) + "/" + str(month).zfill(2) + "/" + str(day).zfill(2) + "/" + filename, 'r') as f:
-        articleData = f.read()
-        articleLines = articleData.splitlines()
-        if(not articleLines[0].startswith('#')):
-            print("error in first line of article", year, month, day, filename)
-        if(not articleLines[1].startswith('##')):
-            print("error in second line of article", year, month, day, filename)
-        if(not articleLines[2].startswith('###')):
-            print("error in third line of article", year, month, day, filename)
-        title = articleLines[0][2:]
-        subtitle = articleLines[1][3:]
-        author = articleLines[2][4:]
-        articleText = ""
-        articleText = articleText.join(articleLines[3:])
-        
-        filename_parts = filename.split('.')
-        articleType = filename_parts[1]
-        articleNumber = filename_parts[0]
-
-        authorTitle = '' 
-        for possibleTitle in VALID_AUTHOR_TITLES:
-            title_index = author.upper().find(possibleTitle)
-            if(title_index > 0):
-                authorTitle = possibleTitle
-                author = author[0:title_index]
-                break
-
-
-        articleData = {
-            'articleText': articleText.strip(),
-            'articleType': articleType.strip(),
-            'articleNumber': articleNumber,
-            'publishDate': {'year': year, 'month': month, 'day': day},
-            'title': title.strip(),
-            'subtitle': subtitle.strip(),
-            'author': author.strip(),
-            'authorTitle': authorTitle, # authorTitle not yet implemented.
-        }
-        return articleData
+    article = Article(str(year).zfill(4) + "/" + str(month).zfill(2) + "/" + str(day).zfill(2) + "/" + filename, open_archives_text(ARCHIVES_TEXT_PATH)).read_all()
+    for i in article.header_errors():
+        print("error in %s line of article" % ['first', 'second', 'third'][i], year, month, day, filename)
+    title = article.title
+    subtitle = article.subtitle
+    author = article.author
+    articleText = ""
+    articleText = articleText.join(article.body.splitlines())
+
+    filename_parts = filename.split('.')
+    articleType = filename_parts[1]
+    articleNumber = filename_parts[0]
+
+    author, authorTitle = split_author_title(author)
+
+
+    articleData = {
+        'articleText': articleText.strip(),
+        'articleType': articleType.strip(),
+        'articleNumber': articleNumber,
+        'publishDate': {'year': year, 'month': month, 'day': day},
+        'title': title.strip(),
+        'subtitle': subtitle.strip(),
+        'author': author.strip(),
+        'authorTitle': authorTitle, # authorTitle not yet implemented.
+    }
+    return articleData
 
 def pretty_print_article_fields(article_fields):
     print("----------------------------------------------------------")
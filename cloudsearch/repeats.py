@@ -0,0 +1,172 @@
+"""
+finds and removes repeated article text, shared by cloudsearch-process-and-upload.py and fix-repeats.py.
+
+extract-text.js uses appendFile, so when a section gets extracted twice its text ends up in the
+file twice. Sometimes that's an exact copy, but often the second copy is cut short or has
+different whitespace (different line breaks from the OCR columns). We handle three kinds:
+    exact       the text is one block repeated a whole number of times: XX, XXX
+    partial     one or more full copies followed by a truncated copy: XXX' (X' is a prefix of X)
+    whitespace  either of the above once every run of whitespace is collapsed to a single space
+
+everything is based on the longest border of the text (the longest proper prefix that's also a
+suffix), from the KMP failure function. If the border has length b the text has period n - b, and
+that's the smallest period there is, so cutting there keeps exactly one copy. This is O(n) time
+with one array of n ints, instead of the old (text + text).find(text) which builds a string twice
+the size of the article.
+
+a short border on its own doesn't mean anything (an article can end with the same word it starts
+with), so partial repeats need at least MIN_PARTIAL_REPEAT_LENGTH characters of trailing copy, and
+so do whitespace repeats ('ha ha' is just text). Long texts only need borders at least that long,
+so they look for the period with str.find first (see _find_long_border); almost no article has its
+first MIN_PARTIAL_REPEAT_LENGTH characters twice, so the common case costs one str.find.
+
+whitespace repeats are found the same way without making a collapsed copy of the text: wherever
+the first word shows up again, we compare the words from there with the words from the start, first
+for MIN_PARTIAL_REPEAT_LENGTH characters and, if those match, to the end (see _find_whitespace_repeat).
+"""
+
+import re
+from array import array
+from collections import namedtuple
+
+
+MIN_PARTIAL_REPEAT_LENGTH = 64
+MAX_BORDER_CANDIDATES = 8
+
+# period: how many characters of the original text to keep. kind: 'exact', 'partial' or 'whitespace'
+Repeat = namedtuple('Repeat', ['period', 'kind'])
+
+# length of the longest proper prefix of text that is also a suffix (KMP failure function)
+def longest_border(text):
+    n = len(text)
+    failure = array('l', bytes(array('l').itemsize * (n + 1)))
+    k = 0
+    for i in range(1, n):
+        c = text[i]
+        while(k > 0 and text[k] != c):
+            k = failure[k]
+        if(text[k] == c):
+            k += 1
+        failure[i + 1] = k
+    return failure[n]
+
+# longest_border(text), as long as that's at least MIN_PARTIAL_REPEAT_LENGTH, otherwise 0.
+# every repeat we report has a border that long once the text is twice MIN_PARTIAL_REPEAT_LENGTH (a
+# whole repeat's border is at least half the text), and the border starts with text[:MIN_PARTIAL_REPEAT_LENGTH],
+# so the period has to be somewhere that prefix shows up again. Checking the first few of those with
+# str.find/startswith is much faster than running KMP in python; past MAX_BORDER_CANDIDATES (text like
+# '-----...') we fall back to KMP so it stays O(n).
+def _find_long_border(text):
+    n = len(text)
+    prefix = text[:MIN_PARTIAL_REPEAT_LENGTH]
+    candidates = 0
+    i = text.find(prefix, 1)
+    while(i != -1):
+        if(candidates == MAX_BORDER_CANDIDATES):
+            border = longest_border(text)
+            return border if border >= MIN_PARTIAL_REPEAT_LENGTH else 0
+        if(n - i >= MIN_PARTIAL_REPEAT_LENGTH and text.startswith(text[i:])):
+            return n - i
+        candidates += 1
+        i = text.find(prefix, i + 1)
+    return 0
+
+# returns (period, kind) for text that's made of repeats, without looking at whitespace, or None
+def _find_exact_repeat(text):
+    n = len(text)
+    if(n < 2):
+        return None
+    if(n < 2 * MIN_PARTIAL_REPEAT_LENGTH):
+        border = longest_border(text)
+    else:
+        border = _find_long_border(text)
+    if(border == 0):
+        return None
+    period = n - border
+    if(n % period == 0):
+        return Repeat(period, 'exact')
+    if(border >= MIN_PARTIAL_REPEAT_LENGTH):
+        return Repeat(period, 'partial')
+    return None
+
+WORD_PATTERN = re.compile(r'\S+')
+
+# index in text of the character at normalized_index in ' '.join(text.split())
+def _to_original_index(text, normalized, normalized_index):
+    word_index = normalized.count(' ', 0, normalized_index)
+    offset = normalized_index - (normalized.rfind(' ', 0, normalized_index) + 1)
+    for i, match in enumerate(WORD_PATTERN.finditer(text)):
+        if(i == word_index):
+            return match.start() + offset
+    return len(text)
+
+# compares the words of text from i on with its words from the start, up to limit characters of
+# ' '.join(text.split()) (or all of them). returns how many characters matched, or -1 if a word didn't.
+# the copy's last word can be cut short
+def _match_words(text, i, limit=None):
+    copy = WORD_PATTERN.finditer(text, i)
+    original = WORD_PATTERN.finditer(text)
+    length = -1
+    word = next(copy, None)
+    while(word is not None and (limit is None or length < limit)):
+        other = next(original, None)
+        following = next(copy, None)
+        if(other is None):
+            return -1
+        if(word.group() != other.group() and (following is not None or not other.group().startswith(word.group()))):
+            return -1
+        length += len(word.group()) + 1
+        word = following
+    return length
+
+# the old way, for text where the prefix shows up too often (like '- - - - ...'): collapse the whitespace and
+# look for a repeat in that. returns the period in text, or None
+def _find_normalized_repeat(text):
+    normalized = ' '.join(text.split())
+    repeat = _find_exact_repeat(normalized)
+    if(repeat is None):
+        # a trailing space makes 'X X' (a copy after a line break) look like 'X X ', an exact repeat
+        repeat = _find_exact_repeat(normalized + ' ')
+    if(repeat is None or len(normalized) - repeat.period < MIN_PARTIAL_REPEAT_LENGTH):
+        return None
+    return _to_original_index(text, normalized, repeat.period)
+
+# period of a repeat of at least MIN_PARTIAL_REPEAT_LENGTH characters once whitespace is collapsed, or None.
+# a copy starts with the first word (maybe stuck to the end of the last copy) and has the same words as the
+# start of the text from there to the end; the first such place leaves the longest copy, so cutting there
+# keeps exactly one. Most places the first word shows up again differ within a word or two
+def _find_whitespace_repeat(text):
+    first = WORD_PATTERN.search(text)
+    if(first is None):
+        return None
+    word = first.group()
+    candidates = 0
+    i = text.find(word, first.start() + 1)
+    while(i != -1):
+        end = i + len(word)
+        # a copy's first word is followed by whitespace (one that's only that word is an exact or partial repeat)
+        if(end < len(text) and text[end].isspace() and _match_words(text, i, MIN_PARTIAL_REPEAT_LENGTH) >= MIN_PARTIAL_REPEAT_LENGTH):
+            if(candidates == MAX_BORDER_CANDIDATES):
+                return _find_normalized_repeat(text)
+            candidates += 1
+            if(_match_words(text, i) >= MIN_PARTIAL_REPEAT_LENGTH):
+                return i
+        i = text.find(word, i + 1)
+    return None
+
+# returns a Repeat(period, kind) if text is repeated, or None
+def find_repeat(text):
+    repeat = _find_exact_repeat(text)
+    if(repeat is not None):
+        return repeat
+    period = _find_whitespace_repeat(text)
+    if(period is None):
+        return None
+    return Repeat(period, 'whitespace')
+
+# returns (text with only its first copy kept, the Repeat found or None)
+def remove_repeats(text):
+    repeat = find_repeat(text)
+    if(repeat is None):
+        return text, None
+    return text[:repeat.period], repeat
@@ -0,0 +1,196 @@
+"""
+a caching wrapper around a cloudsearchdomain search client, so a popular archive query that's
+asked thousands of times only goes to cloudsearch once in a while.
+
+    search_client = CachedSearchClient(boto3.client('cloudsearchdomain', endpoint_url=SEARCH_ENDPOINT))
+    response = search_client.search(query='big game', size=10)
+    print(search_client.get_stats())
+
+search() takes the same arguments as boto3's. Responses are cached under the query (whitespace
+collapsed, but not lowercased: case can matter in phrases and field-scoped terms, depending on
+how the field is analyzed) plus every other argument (filters, sort, start, size, ...), so
+different pages and sorts are cached separately. Entries expire after ttl seconds, and the least recently used ones are dropped once
+the cache holds more than max_bytes of responses (their json encoding, which is what's stored).
+A response from the cache is a fresh copy, without boto3's ResponseMetadata.
+
+if several threads ask for the same query while it isn't cached, only the first one calls
+cloudsearch and the others wait for its response (or its error, which isn't cached).
+
+with disk_path, responses are also written to a SQLite file, so the cache survives restarts: a
+query that's not in memory is looked up there before going to cloudsearch, and keeps the time it
+expires at from when it was first fetched. Like sync_state.py's,
+the connection can't be shared across a fork, so make the CachedSearchClient in each process.
+
+everything else (suggest, upload_documents, ...) is passed straight through to the client.
+"""
+
+import json
+import time
+import sqlite3
+import threading
+from collections import OrderedDict
+
+
+DEFAULT_TTL_SECONDS = 3600 # the archives only change when we upload, so responses stay good for a while
+MAX_CACHE_BYTES = 64 * 1024 * 1024
+SEARCH_CACHE_PATH = './search-cache.sqlite'
+MAX_DISK_ENTRIES = 100000
+DISK_PRUNE_INTERVAL = 1000 # writes between removing expired (and the oldest extra) rows from the disk cache
+
+def get_cache_key(params):
+    params = dict(params)
+    params['query'] = ' '.join(params.get('query', '').split())
+    for name, value in params.items():
+        if(isinstance(value, str) and name != 'query'):
+            params[name] = value.strip()
+    return json.dumps(params, sort_keys=True)
+
+class _Flight:
+    # a search that's on its way to cloudsearch, for the other threads asking the same thing to wait on
+    def __init__(self):
+        self.done = threading.Event()
+        self.data = None
+        self.error = None
+
+class DiskCache:
+    def __init__(self, path=SEARCH_CACHE_PATH, max_entries=MAX_DISK_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.writes = 0
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response BLOB NOT NULL, expires_at REAL NOT NULL)')
+        self.connection.commit()
+        self.prune()
+
+    # returns (encoded response, when it expires as a time.time()), or None if it isn't there or has expired
+    def get(self, key):
+        with self.lock:
+            row = self.connection.execute('SELECT response, expires_at FROM responses WHERE key = ?', (key,)).fetchone()
+        if(row is None or row[1] < time.time()):
+            return None
+        return row[0], row[1]
+
+    def put(self, key, data, ttl):
+        with self.lock:
+            with self.connection:
+                self.connection.execute('INSERT OR REPLACE INTO responses (key, response, expires_at) VALUES (?, ?, ?)', (key, data, time.time() + ttl))
+            self.writes += 1
+            prune = self.writes % DISK_PRUNE_INTERVAL == 0
+        if(prune):
+            self.prune()
+
+    def prune(self):
+        with self.lock:
+            with self.connection:
+                self.connection.execute('DELETE FROM responses WHERE expires_at < ?', (time.time(),))
+                self.connection.execute('DELETE FROM responses WHERE key NOT IN (SELECT key FROM responses ORDER BY expires_at DESC LIMIT ?)', (self.max_entries,))
+
+    def close(self):
+        self.connection.close()
+
+class CachedSearchClient:
+    # client: a boto3 cloudsearchdomain client (anything with search(**params) really)
+    # disk_path: SQLite file for the on-disk cache, or None to only cache in memory
+    def __init__(self, client, ttl=DEFAULT_TTL_SECONDS, max_bytes=MAX_CACHE_BYTES, disk_path=None):
+        self.client = client
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.disk = DiskCache(disk_path) if disk_path is not None else None
+        self.entries = OrderedDict() # key -> (expires at, encoded response), least recently used first
+        self.bytes = 0
+        self.in_flight = {} # key -> _Flight
+        self.lock = threading.Lock()
+        self.stats = {'requests': 0, 'hits': 0, 'disk_hits': 0, 'coalesced': 0, 'misses': 0, 'errors': 0, 'expired': 0, 'evictions': 0}
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+    def _remove(self, key):
+        expires_at, data = self.entries.pop(key)
+        self.bytes -= len(key) + len(data)
+
+    def _put(self, key, data, expires_at):
+        size = len(key) + len(data)
+        if(size > self.max_bytes):
+            return
+        if(key in self.entries):
+            self._remove(key)
+        self.entries[key] = (expires_at, data)
+        self.bytes += size
+        while(self.bytes > self.max_bytes):
+            self._remove(next(iter(self.entries)))
+            self.stats['evictions'] += 1
+
+    def search(self, **params):
+        key = get_cache_key(params)
+        with self.lock:
+            self.stats['requests'] += 1
+            entry = self.entries.get(key)
+            if(entry is not None and entry[0] < time.monotonic()):
+                self._remove(key)
+                self.stats['expired'] += 1
+                entry = None
+            if(entry is not None):
+                self.entries.move_to_end(key)
+                self.stats['hits'] += 1
+                return json.loads(entry[1])
+            flight = self.in_flight.get(key)
+            leader = flight is None
+            if(leader):
+                flight = self.in_flight[key] = _Flight()
+            else:
+                self.stats['coalesced'] += 1
+
+        if(not leader):
+            flight.done.wait()
+            if(flight.error is not None):
+                raise flight.error
+            return json.loads(flight.data)
+
+        try:
+            row = self.disk.get(key) if self.disk is not None else None
+            if(row is not None):
+                stat = 'disk_hits'
+                data, disk_expires_at = row
+                expires_at = time.monotonic() + (disk_expires_at - time.time()) # only as long as it has left on disk
+            else:
+                stat = 'misses'
+                response = dict(self.client.search(**params))
+                response.pop('ResponseMetadata', None) # the request id and headers of this one request
+                data = json.dumps(response).encode('utf-8')
+                if(self.disk is not None):
+                    self.disk.put(key, data, self.ttl)
+                expires_at = time.monotonic() + self.ttl
+            flight.data = data
+        except BaseException as e:
+            flight.error = e
+            stat = 'errors'
+            raise
+        finally:
+            with self.lock:
+                self.stats[stat] += 1
+                if(flight.error is None):
+                    self._put(key, flight.data, expires_at)
+                del self.in_flight[key]
+            flight.done.set()
+        return json.loads(data)
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.bytes
+        answered = stats['hits'] + stats['disk_hits'] + stats['coalesced']
+        stats['hit_rate'] = answered / stats['requests'] if stats['requests'] > 0 else 0.0
+        return stats
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def close(self):
+        if(self.disk is not None):
+            self.disk.close()
@@ -0,0 +1,53 @@
+"""
+local state for incremental cloudsearch uploads.
+
+keeps a SQLite file mapping each cloudsearch document id (publish_date + article_type + article_number)
+to a hash of the add request we last uploaded successfully for it. The uploader can then skip
+documents whose hash hasn't changed, so after a fix-repeats.py or corrections.py pass only the
+articles that actually changed get sent again.
+
+each process opens its own connection (sqlite connections can't be shared across a fork); WAL mode
+lets the Pool workers read and write the file at the same time.
+
+note: documents are only ever added/updated. If articles are deleted from archives-text, their
+rows (and the cloudsearch documents) are left as is.
+"""
+
+import sqlite3
+import hashlib
+import time
+
+
+SYNC_STATE_PATH = './sync-state.sqlite'
+
+def hash_document(encoded_add_request):
+    return hashlib.sha1(encoded_add_request).hexdigest()
+
+class SyncState:
+    def __init__(self, path=SYNC_STATE_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS documents (id TEXT PRIMARY KEY, hash TEXT NOT NULL, uploaded_at INTEGER NOT NULL)')
+        self.connection.commit()
+
+    def get_hash(self, doc_id):
+        row = self.connection.execute('SELECT hash FROM documents WHERE id = ?', (doc_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    # True if doc_id was already uploaded with exactly this content
+    def is_unchanged(self, doc_id, doc_hash):
+        return self.get_hash(doc_id) == doc_hash
+
+    # call only once cloudsearch has accepted the batch; docs is a list of (doc_id, doc_hash)
+    def mark_uploaded(self, docs):
+        now = int(time.time())
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO documents (id, hash, uploaded_at) VALUES (?, ?, ?)',
+                                        [(doc_id, doc_hash, now) for doc_id, doc_hash in docs])
+
+    def count(self):
+        return self.connection.execute('SELECT COUNT(*) FROM documents').fetchone()[0]
+
+    def close(self):
+        self.connection.close()
@@ -0,0 +1,154 @@
+"""
+generates a synthetic archives-text tree for benchmarks (see benchmark.py) and offline testing.
+
+same layout and file format as the real thing:
+    YYYY/MM/DD/MODSMD_ARTICLE4.article.txt
+    YYYY/MM/DD/DIVL148.advertisement.txt
+each file has the `# title` / `## subtitle` / `### author` header lines followed by the body, built
+from the vocabulary in random-words.txt.
+
+knobs:
+- size: years, issues per year, articles per issue (and how that count is distributed), words per article
+- growth: how much bigger late years are than early ones (the real 1990s are >10x the 1890s)
+- repeat rate: fraction of articles whose body is repeated the way extract-text.js's appendFile
+  does it: an exact second copy, a copy with different whitespace, or a truncated copy
+
+    python synthetic_corpus.py ./synthetic-archives-text/ --start-year 1900 --end-year 1909 --seed 1
+"""
+
+import os
+import random
+import argparse
+from author_titles import AUTHOR_TITLES # the titles the uploader knows how to split off
+
+
+WORDS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'random-words.txt')
+WORDS_PER_LINE = (3, 9) # OCR'd newspaper columns are narrow
+
+def load_words(path=WORDS_PATH):
+    words = []
+    with open(path) as f:
+        for line in f:
+            index, word = line.strip().split('\t')
+            words.append(word)
+    return words
+
+class SyntheticCorpusGenerator:
+    def __init__(self, words, seed=None, issues_per_year=150, articles_per_issue=40, distribution='lognormal',
+                 words_per_article=400, growth=4.0, repeat_rate=0.05, advertisement_rate=0.2):
+        self.words = words
+        self.random = random.Random(seed)
+        self.issues_per_year = issues_per_year
+        self.articles_per_issue = articles_per_issue
+        self.distribution = distribution
+        self.words_per_article = words_per_article
+        self.growth = growth
+        self.repeat_rate = repeat_rate
+        self.advertisement_rate = advertisement_rate
+        self.stats = {'articles': 0, 'advertisements': 0, 'repeats': 0, 'bytes': 0, 'issues': 0}
+
+    def sample_article_count(self, mean):
+        if(self.distribution == 'fixed'):
+            return max(1, int(round(mean)))
+        if(self.distribution == 'uniform'):
+            return self.random.randint(1, max(1, int(2 * mean)))
+        # lognormal: most issues near the mean, a few much bigger ones
+        return max(1, int(self.random.lognormvariate(0, 0.5) * mean))
+
+    def make_words(self, count, capitalize=False):
+        chosen = self.random.choices(self.words, k=count)
+        if(capitalize):
+            chosen = [word.capitalize() for word in chosen]
+        return ' '.join(chosen)
+
+    def make_body(self, word_count):
+        lines = []
+        while(word_count > 0):
+            line_length = min(word_count, self.random.randint(*WORDS_PER_LINE))
+            lines.append(self.make_words(line_length))
+            word_count -= line_length
+        return '\n'.join(lines)
+
+    # mimics extract-text.js appending a section's text again to a file that already exists
+    def make_repeat(self, body):
+        kind = self.random.choice(['exact', 'whitespace', 'truncated'])
+        if(kind == 'exact'):
+            return body + body
+        if(kind == 'whitespace'):
+            return body + '\n' + body.replace('\n', ' \n  ').replace(' ', '  ', 3)
+        return body + '\n' + body[:self.random.randint(len(body) // 4, max(len(body) // 4, len(body) - 1))]
+
+    def make_article(self, is_advertisement):
+        title = self.make_words(self.random.randint(1, 8), capitalize=True)
+        subtitle = self.make_words(self.random.randint(2, 10), capitalize=True) if self.random.random() < 0.2 else ''
+        author = ''
+        if(not is_advertisement and self.random.random() < 0.4):
+            author = self.make_words(2, capitalize=True)
+            if(self.random.random() < 0.5):
+                author += ' ' + self.random.choice(AUTHOR_TITLES)
+        word_count = max(5, int(self.random.lognormvariate(0, 0.8) * self.words_per_article))
+        if(is_advertisement):
+            word_count = max(5, word_count // 4)
+        body = self.make_body(word_count)
+        if(self.random.random() < self.repeat_rate):
+            body = self.make_repeat(body)
+            self.stats['repeats'] += 1
+        return '# %s\n## %s\n### %s\n%s' % (title, subtitle, author, body)
+
+    def generate_issue(self, base_path, year, month, day, mean_articles):
+        day_path = os.path.join(base_path, str(year).zfill(4), str(month).zfill(2), str(day).zfill(2))
+        os.makedirs(day_path, exist_ok=True)
+        for i in range(self.sample_article_count(mean_articles)):
+            is_advertisement = self.random.random() < self.advertisement_rate
+            prefix = 'DIVL' if self.random.random() < 0.3 else 'MODSMD_ARTICLE'
+            filename = '%s%d.%s.txt' % (prefix, i + 1, 'advertisement' if is_advertisement else 'article')
+            text = self.make_article(is_advertisement)
+            with open(os.path.join(day_path, filename), 'w') as f:
+                f.write(text)
+            self.stats['advertisements' if is_advertisement else 'articles'] += 1
+            self.stats['bytes'] += len(text.encode('utf-8'))
+        self.stats['issues'] += 1
+
+    def generate(self, base_path, startYear, endYear):
+        span = max(1, endYear - startYear)
+        for year in range(startYear, endYear + 1):
+            # later years get up to (1 + growth) times as many articles per issue
+            mean_articles = self.articles_per_issue * (1 + self.growth * (year - startYear) / span) / (1 + self.growth / 2)
+            days = sorted(self.random.sample(range(365), min(365, self.issues_per_year)))
+            for day_of_year in days:
+                month, day = day_of_year_to_date(day_of_year)
+                self.generate_issue(base_path, year, month, day, mean_articles)
+        return self.stats
+
+def day_of_year_to_date(day_of_year):
+    month_lengths = [31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31]
+    month = 1
+    for month_length in month_lengths:
+        if(day_of_year < month_length):
+            return month, day_of_year + 1
+        day_of_year -= month_length
+        month += 1
+    return 12, 31
+
+def main():
+    parser = argparse.ArgumentParser(description='generate a synthetic archives-text tree')
+    parser.add_argument('output_path')
+    parser.add_argument('--start-year', type=int, default=1900)
+    parser.add_argument('--end-year', type=int, default=1904)
+    parser.add_argument('--issues-per-year', type=int, default=150)
+    parser.add_argument('--articles-per-issue', type=float, default=40, help='mean articles per issue (over all years)')
+    parser.add_argument('--distribution', choices=['lognormal', 'uniform', 'fixed'], default='lognormal',
+                        help='how the number of articles per issue is distributed')
+    parser.add_argument('--words-per-article', type=int, default=400, help='median words per article')
+    parser.add_argument('--growth', type=float, default=4.0, help='the last year has about (1 + growth) times the articles of the first')
+    parser.add_argument('--repeat-rate', type=float, default=0.05, help='fraction of articles with an appendFile style repeat')
+    parser.add_argument('--advertisement-rate', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    generator = SyntheticCorpusGenerator(load_words(), args.seed, args.issues_per_year, args.articles_per_issue, args.distribution,
+                                         args.words_per_article, args.growth, args.repeat_rate, args.advertisement_rate)
+    stats = generator.generate(args.output_path, args.start_year, args.end_year)
+    print('generated %(issues)d issues, %(articles)d articles, %(advertisements)d advertisements (%(repeats)d with repeats), %(bytes)d bytes' % stats)
+
+if __name__ == '__main__':
+    main()
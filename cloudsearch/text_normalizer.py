@@ -0,0 +1,82 @@
+"""
+whitespace normalization for archives-text files, used by fix-repeats.py.
+
+an article file is three header lines (# title, ## subtitle, ### author) and then the body. The
+header is kept as it is. In the body every line gets its runs of whitespace collapsed to one space
+and is stripped, and every line ends with '\\n'. That's the same result as the old
+
+    for line in body.splitlines():
+        line = re.sub('\\s+', ' ', line).strip() + '\\n'
+
+but done with a handful of passes over the whole body (str.translate and str.replace), so
+there's no python code running per line. Text that's already clean, like a file fix-repeats has
+seen before, only costs a few str searches. Line breaks are whatever str.splitlines counts as one
+(\\r\\n, \\r, \\x0c, ...).
+
+normalize_article does a whole file and also says whether that changed anything.
+"""
+
+import re
+
+
+# what str.splitlines splits on
+_LINE_BREAK_CHARS = '\n\r\v\f\x1c\x1d\x1e\x85\u2028\u2029'
+_LINE_BREAK = re.compile('\\r\\n|[%s]' % _LINE_BREAK_CHARS)
+# any whitespace that isn't ' ' or '\n'. Most files don't have any, and then we don't need to translate
+_OTHER_WHITESPACE = re.compile('[^\\S \\n]')
+# every other whitespace character -> '\n' if it's a line break, otherwise ' ' (U+3000 is the last whitespace character)
+_WHITESPACE_TABLE = {ord(c): ('\n' if c in _LINE_BREAK_CHARS else ' ') for c in map(chr, range(0x3001)) if c.isspace() and c not in ' \n'}
+_ASCII_OTHER_WHITESPACE = [c for c in map(chr, range(128)) if c.isspace() and c not in ' \n']
+HEADER_LINES = 3
+
+# returns (the first HEADER_LINES lines, without their line breaks, and where the body starts in raw_text)
+def split_header_lines(raw_text):
+    lines = []
+    pos = 0
+    while(len(lines) < HEADER_LINES and pos < len(raw_text)):
+        match = _LINE_BREAK.search(raw_text, pos)
+        if(match is None):
+            lines.append(raw_text[pos:])
+            pos = len(raw_text)
+        else:
+            lines.append(raw_text[pos:match.start()])
+            pos = match.end()
+    return lines, pos
+
+# returns (header, body). header is the first HEADER_LINES lines, each ending in '\n'
+def split_article(raw_text):
+    lines, pos = split_header_lines(raw_text)
+    return ''.join(line + '\n' for line in lines), raw_text[pos:]
+
+# scanning with a regex is slow next to str's own searches, so ascii text (almost all of it) checks each character with `in`
+def _has_other_whitespace(text):
+    if(text.isascii()):
+        return any(c in text for c in _ASCII_OTHER_WHITESPACE)
+    return _OTHER_WHITESPACE.search(text) is not None
+
+def _collapse(text):
+    if(_has_other_whitespace(text)):
+        text = text.replace('\r\n', '\n').translate(_WHITESPACE_TABLE)
+    # each pass halves every run of spaces. str.replace is a lot faster than re.sub(' {2,}', ...) on OCR text,
+    # which has a double space every few words
+    while('  ' in text):
+        text = text.replace('  ', ' ')
+    # now there's only ' ' and '\n', and at most one space on either side of a '\n'
+    return text.replace(' \n', '\n').replace('\n ', '\n')
+
+def normalize_body(body):
+    collapsed = _collapse(body)
+    # the ends of the body are the only places _collapse can leave a space, and a last line without a line break still needs its '\n'
+    if(collapsed.startswith(' ')):
+        collapsed = collapsed[1:]
+    if(collapsed.endswith(' ')):
+        collapsed = collapsed[:-1]
+    if(len(body) > 0 and body[-1] not in _LINE_BREAK_CHARS):
+        collapsed += '\n'
+    return collapsed
+
+# returns (normalized text, True if that's different from raw_text)
+def normalize_article(raw_text):
+    header, body = split_article(raw_text)
+    text = header + normalize_body(body)
+    return text, text != raw_text
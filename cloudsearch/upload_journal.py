@@ -0,0 +1,105 @@
+"""
+durable checkpoint journal for cloudsearch uploads.
+
+every batch the uploader sends gets one JSON line in the journal once we know how it went:
+    {"batch": 12, "ranges": [["1969/03/02/A.article.txt", "1969/03/09/Z.article.txt"]], "docs": 950,
+     "bytes": 5241000, "status": "success", "attempts": 2, "error": null, "time": 1588888888.0}
+
+ranges are [first, last] article paths (relative to archives-text, so they sort the same way the
+processor walks the tree) covering every article the batch consumed, including ones that were
+skipped for being too big or unchanged. Each line is flushed and fsynced before we move on, so
+after a crash or kill the journal has exactly the batches that finished.
+
+a --resume run loads every journal in the checkpoint directory (so it still works if the run is
+split into different chunks this time, see work_scheduler.py) and skips every article inside the
+range of a successful batch. Failed batches (and the one that was in flight when we died) aren't
+in a successful range, so they simply get rebuilt and sent again. A fresh (non resume) run should
+call clear_journals first so old journals can't be mistaken for this run's progress.
+"""
+
+import os
+import json
+import time
+from bisect import bisect_right
+
+
+CHECKPOINT_PATH = './checkpoints/'
+JOURNAL_SUFFIX = '.journal'
+
+def get_journal_paths(path):
+    if(not os.path.isdir(path)):
+        return []
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith(JOURNAL_SUFFIX)]
+
+def clear_journals(path):
+    for journal_path in get_journal_paths(path):
+        os.remove(journal_path)
+
+class UploadJournal:
+    # resume: keep the existing journals and skip what they say is done; otherwise start a fresh one
+    def __init__(self, path, basename, resume=False):
+        os.makedirs(path, exist_ok=True)
+        self.fullpath = os.path.join(path, basename + JOURNAL_SUFFIX)
+        self.range_starts = []
+        self.range_ends = []
+        self.next_batch_number = 0
+        if(resume):
+            self._load(get_journal_paths(path))
+        self.f = open(self.fullpath, 'a' if resume else 'w')
+
+    def _load(self, journal_paths):
+        ranges = []
+        for journal_path in journal_paths:
+            with open(journal_path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # a torn last line from a kill mid-write; that batch didn't finish
+                    if(journal_path == self.fullpath):
+                        self.next_batch_number = max(self.next_batch_number, record['batch'] + 1)
+                    if(record['status'] == 'success'):
+                        ranges.extend(record['ranges'])
+        # a resumed batch's range can wrap around ranges finished earlier, so merge into disjoint ranges
+        merged = []
+        for start, end in sorted(ranges):
+            if(len(merged) > 0 and start <= merged[-1][1]):
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.range_starts = [start for start, end in merged]
+        self.range_ends = [end for start, end in merged]
+
+    def get_fullpath(self):
+        return self.fullpath
+
+    def get_next_batch_number(self):
+        batch_number = self.next_batch_number
+        self.next_batch_number += 1
+        return batch_number
+
+    # True if relpath was covered by a batch that cloudsearch accepted in an earlier run
+    def is_completed(self, relpath):
+        i = bisect_right(self.range_starts, relpath) - 1
+        return i >= 0 and relpath <= self.range_ends[i]
+
+    def completed_range_count(self):
+        return len(self.range_starts)
+
+    def record(self, batch_number, ranges, doc_count, size_in_bytes, status, attempts, error=None):
+        record = {
+            'batch': batch_number,
+            'ranges': [[min(start, end), max(start, end)] for start, end in ranges],
+            'docs': doc_count,
+            'bytes': size_in_bytes,
+            'status': status,
+            'attempts': attempts,
+            'error': error,
+            'time': time.time(),
+        }
+        self.f.write(json.dumps(record) + '\n')
+        self.f.flush()
+        os.fsync(self.f.fileno())
+
+    def close(self):
+        self.f.close()
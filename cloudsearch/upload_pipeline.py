@@ -0,0 +1,113 @@
+"""
+producer/consumer pipeline for cloudsearch uploads, so parsing and network I/O overlap.
+
+the processor (producer) builds batches and puts them on a bounded queue; a few uploader
+threads take batches off the queue and send them. When the queue is full the producer blocks,
+so we never hold more than a handful of 5 mb batches in memory.
+
+how many uploads are in flight at once adjusts itself (AIMD, like TCP congestion control):
+after a full window of successful uploads the limit goes up by one, and on a throttling
+error it's halved. So we use as much of the document endpoint as it will give us without
+hand tuning POOL_SIZE.
+
+results come back on a second queue and are handled by the producer thread, so the journal,
+sync state (sqlite connections can't cross threads) and logs are only touched from one thread.
+"""
+
+import time
+import queue
+import threading
+from upload_retry import upload_with_retry
+
+
+UPLOAD_QUEUE_SIZE = 4 # ready to send batches; each is up to 5 mb
+INITIAL_UPLOAD_CONCURRENCY = 2
+MAX_UPLOAD_CONCURRENCY = 8
+THROTTLE_COOLDOWN_SECONDS = 5 # one burst of throttling errors only halves the limit once
+
+class AdaptiveConcurrencyLimiter:
+    def __init__(self, initial=INITIAL_UPLOAD_CONCURRENCY, minimum=1, maximum=MAX_UPLOAD_CONCURRENCY):
+        self.limit = max(minimum, min(initial, maximum))
+        self.minimum = minimum
+        self.maximum = maximum
+        self.in_flight = 0
+        self.successes = 0
+        self.last_decrease = 0
+        self.condition = threading.Condition()
+
+    def acquire(self):
+        with self.condition:
+            while(self.in_flight >= self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+
+    def release(self, succeeded):
+        with self.condition:
+            self.in_flight -= 1
+            if(succeeded):
+                self.successes += 1
+                if(self.successes >= self.limit and self.limit < self.maximum):
+                    self.limit += 1
+                    self.successes = 0
+            self.condition.notify_all()
+
+    def on_throttled(self):
+        with self.condition:
+            now = time.time()
+            if(now - self.last_decrease >= THROTTLE_COOLDOWN_SECONDS):
+                self.limit = max(self.minimum, self.limit // 2)
+                self.last_decrease = now
+            self.successes = 0
+
+    def get_limit(self):
+        return self.limit
+
+class UploadPipeline:
+    def __init__(self, docClient, logger, queue_size=UPLOAD_QUEUE_SIZE, initial_concurrency=INITIAL_UPLOAD_CONCURRENCY,
+                 max_concurrency=MAX_UPLOAD_CONCURRENCY):
+        self.docClient = docClient
+        self.logger = logger
+        self.limiter = AdaptiveConcurrencyLimiter(initial_concurrency, 1, max_concurrency)
+        self.batches = queue.Queue(maxsize=queue_size)
+        self.results = queue.Queue()
+        self.threads = [threading.Thread(target=self._upload_worker, daemon=True) for i in range(max_concurrency)]
+        for thread in self.threads:
+            thread.start()
+
+    def _upload_worker(self):
+        while(True):
+            self.limiter.acquire()
+            item = self.batches.get()
+            if(item is None):
+                self.limiter.release(False)
+                return
+            batch_number, batch = item
+            start = time.time()
+            try:
+                response, attempts, error = upload_with_retry(self.docClient, batch['documents'], self.logger,
+                                                              on_throttled=self.limiter.on_throttled)
+            except Exception as e: # never let a worker die with a batch the producer is waiting on
+                response, attempts, error = None, 1, repr(e)
+            self.limiter.release(response is not None)
+            self.results.put((batch_number, batch, response, attempts, error, time.time() - start))
+
+    # blocks while the queue is full
+    def submit(self, batch_number, batch):
+        self.batches.put((batch_number, batch))
+
+    # results of uploads that have finished since the last call, without waiting
+    def get_finished(self):
+        finished = []
+        while(True):
+            try:
+                finished.append(self.results.get_nowait())
+            except queue.Empty:
+                return finished
+
+    # waits for every submitted batch to be uploaded, stops the threads and returns the remaining results
+    def close(self):
+        for thread in self.threads:
+            self.batches.put(None)
+        for thread in self.threads:
+            thread.join()
+        return self.get_finished()
@@ -0,0 +1,76 @@
+"""
+retries for cloudsearch document uploads: exponential backoff with full jitter
+(https://aws.amazon.com/blogs/architecture/exponential-backoff-and-jitter/).
+
+only errors that can succeed on a second try are retried: throttling, 5xx responses and
+connection problems. A 4xx like a malformed document fails straight away.
+
+this should be the only layer of retries: a client that retries on its own underneath (botocore
+does by default) multiplies the requests per batch and hides throttling from on_throttled. If it
+does anyway, the requests it retried are counted from the response's RetryAttempts.
+"""
+
+import time
+import random
+from botocore.exceptions import ClientError, BotoCoreError
+
+
+MAX_UPLOAD_ATTEMPTS = 6
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 60
+
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException', 'ThrottledException', 'RequestThrottled',
+                          'TooManyRequestsException', 'RequestLimitExceeded', 'SlowDown']
+
+def backoff_delay(attempt):
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * (2 ** (attempt - 1))))
+
+def is_throttling_error(error):
+    if(not isinstance(error, ClientError)):
+        return False
+    code = error.response.get('Error', {}).get('Code', '')
+    status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+    return code in THROTTLING_ERROR_CODES or status == 429
+
+def is_retryable_error(error):
+    if(isinstance(error, ClientError)):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return is_throttling_error(error) or status >= 500
+    return isinstance(error, (BotoCoreError, ConnectionError, TimeoutError))
+
+# how many requests botocore sent for one call, its own retries included
+def get_request_count(response):
+    return 1 + response.get('ResponseMetadata', {}).get('RetryAttempts', 0)
+
+# uploads documents (already encoded JSON batch bytes), retrying with backoff.
+# on_throttled is called on every throttling error (e.g. so the upload pipeline can back off), and
+# whenever the client had to retry a request itself, since those were throttled or failed too
+# returns (response or None, number of requests sent, last error message or None)
+def upload_with_retry(docClient, documents, logger, max_attempts=MAX_UPLOAD_ATTEMPTS, on_throttled=None):
+    error_message = None
+    requests = 0
+    for attempt in range(1, max_attempts + 1):
+        try:
+            response = docClient.upload_documents(documents=documents, contentType="application/json")
+            sent = get_request_count(response)
+            requests += sent
+            if(on_throttled is not None and sent > 1):
+                on_throttled()
+            if(response['status'] == 'success'):
+                return response, requests, None
+            error_message = 'cloudsearch returned status %s: %s' % (response['status'], response)
+            retryable = True
+        except Exception as e:
+            sent = get_request_count(e.response) if isinstance(e, ClientError) else 1
+            requests += sent
+            error_message = repr(e)
+            retryable = is_retryable_error(e)
+            if(on_throttled is not None and (is_throttling_error(e) or sent > 1)):
+                on_throttled()
+        if(not retryable or attempt == max_attempts):
+            break
+        delay = backoff_delay(attempt)
+        logger.log('upload attempt %d failed (%s), retrying in %.1fs' % (attempt, error_message, delay),
+                   event='upload_retry', attempt=attempt, error=error_message, delay=round(delay, 3))
+        time.sleep(delay)
+    return None, requests, error_message
@@ -0,0 +1,81 @@
+"""
+splits archives-text into chunks of roughly equal bytes, so a Pool can be kept busy for the whole run.
+
+one process per year doesn't work well: the 1890s are tiny next to the 1990s, so most workers
+finish early and a few run alone for hours. Instead we group consecutive issues (days) or months
+until each chunk holds about total_bytes / (workers * CHUNKS_PER_WORKER) of text, then hand the
+chunks out largest first with Pool.imap_unordered(..., chunksize=1). Workers pull the next chunk
+off the pool's shared task queue whenever they finish one, so nobody sits idle while there's
+work left, and the small chunks at the end fill in the gaps. Total run time ends up close to
+total work / number of workers.
+
+sizes come from the manifest (see archives_manifest.py).
+"""
+
+from archives_manifest import Manifest
+
+
+CHUNKS_PER_WORKER = 4 # more chunks balance better, fewer mean less per-chunk overhead
+
+def _group_key(entry, level):
+    if(level == 'month'):
+        return (entry.year, entry.month)
+    return (entry.year, entry.month, entry.day)
+
+def _format_key(key):
+    return '-'.join(str(part).zfill(2) for part in key)
+
+# entries: manifest entries (sorted). level: 'day' (an issue) or 'month', the smallest unit a chunk is made of.
+# returns a list of chunks, largest first. each chunk is a dict with a label, its entries and size in bytes.
+def plan_chunks(entries, num_workers, level='day', chunks_per_worker=CHUNKS_PER_WORKER):
+    groups = []
+    for entry in entries:
+        key = _group_key(entry, level)
+        if(len(groups) == 0 or groups[-1]['key'] != key):
+            groups.append({'key': key, 'entries': [], 'size': 0})
+        groups[-1]['entries'].append(entry)
+        groups[-1]['size'] += entry.size
+    if(len(groups) == 0):
+        return []
+
+    total_size = sum(group['size'] for group in groups)
+    target_size = max(1, total_size // max(1, num_workers * chunks_per_worker))
+
+    # merge consecutive groups (so a chunk is a contiguous date range) until a chunk reaches the target
+    chunks = []
+    current = None
+    for group in groups:
+        if(current is None):
+            current = {'first_key': group['key'], 'last_key': group['key'], 'entries': [], 'size': 0}
+        current['entries'].extend(group['entries'])
+        current['size'] += group['size']
+        current['last_key'] = group['key']
+        if(current['size'] >= target_size):
+            chunks.append(current)
+            current = None
+    if(current is not None):
+        chunks.append(current)
+
+    for chunk in chunks:
+        if(chunk['first_key'] == chunk['last_key']):
+            chunk['label'] = _format_key(chunk['first_key'])
+        else:
+            chunk['label'] = '%s_%s' % (_format_key(chunk['first_key']), _format_key(chunk['last_key']))
+        del chunk['first_key']
+        del chunk['last_key']
+    chunks.sort(key=lambda chunk: chunk['size'], reverse=True)
+    return chunks
+
+def filter_entries_by_year(entries, startYear, endYear):
+    return [entry for entry in entries if startYear <= entry.year <= endYear]
+
+# what a processor needs to walk just this chunk: a manifest of its entries and the year range it spans
+def get_chunk_manifest(chunk):
+    years = [entry.year for entry in chunk['entries']]
+    return Manifest(chunk['entries']), min(years), max(years) + 1
+
+def describe_plan(chunks):
+    sizes = [chunk['size'] for chunk in chunks]
+    if(len(sizes) == 0):
+        return 'nothing to do'
+    return '%d chunks, %d bytes total, largest %d bytes, smallest %d bytes' % (len(chunks), sum(sizes), max(sizes), min(sizes))
@@ -1,51 +1,326 @@
 """
 Runs corrections from Veridian and applies them to the text files.
 Usage:
-    wget [FILE URL] 
-    tar -xf stanford-text-corrections-20190513.tar.gz
-    python3 -m pip install tqdm 
-    python3 corrections.py 
+    wget [FILE URL]
+    python3 -m pip install tqdm
+    python3 corrections.py --tarball stanford-text-corrections-20190513.tar.gz
+or, with the tarball already extracted (tar -xf stanford-text-corrections-20190513.tar.gz):
+    python3 corrections.py
+
+the change logs are read one after the other (straight out of the compressed tarball with
+--tarball) and parsed incrementally, block by block, so memory doesn't grow with the size of the
+corrections. Each block is its blockID and {old line: new line}. A tarball isn't in sorted order,
+so a day's editions (-01, -02) can be apart within their year: with --tarball a year's days are
+held until the archive moves on to the next year (see iter_issues), so at most a year's blocks are
+in memory. As soon as all of a day's logs have been read we read the day's article files once and
+index which files contain which of the old lines. A block is a TextBlock on the page (ids like
+P1_TB00014), and every block belongs to one article, so all of a block's corrections go to the
+file that contains the most of its old lines (all of them, if files tie). Each file with
+corrections is then rewritten once, and only if something changed (see
+cloudsearch/atomic_writer.py).
+
+issues don't share any files, so they're applied in parallel: the change logs are read in this
+process and grouped into chunks of about CORRECTIONS_PER_CHUNK corrections, which a Pool of
+--workers processes works through. Progress and the totals come back from the workers as each
+chunk finishes.
+
+a correction is a hit if its old line was found in the file its block went to, a miss otherwise.
+
+how long each stage took (reading the change logs, reading the day's files, matching blocks to
+files, writing them) is written to METRICS_PATH and printed at the end, see
+cloudsearch/pipeline_metrics.py.
 """
 import xml.etree.ElementTree as ET
 import os
 import re
-import fileinput
+import sys
+import argparse
+import tarfile
+import time
+from functools import partial
+from multiprocessing import Pool
 from tqdm import tqdm
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cloudsearch'))
+from atomic_writer import AtomicBatchWriter, reset_modified_list_dir, merge_modified_lists
+from pipeline_metrics import PipelineMetrics
+import pool_profiler
+
 PATH = "./stanford-text-corrections/stanford"
 LOCATION = "./output"
-def create_corrections():
-    years = os.listdir(PATH)
-    for year in filter(lambda x: os.path.isdir(os.path.join(PATH, x)), years):
-        for directory in os.listdir(os.path.join(PATH, year)):
+# relative paths (inside LOCATION) of every file the last run changed. workers write their own lists to MODIFIED_LIST_DIR while running
+MODIFIED_LIST_PATH = "./corrections-modified.txt"
+MODIFIED_LIST_DIR = "./corrections-modified/"
+METRICS_PATH = "./metrics/corrections.prom"
+POOL_SIZE = os.cpu_count()
+# issues are handed to the workers in chunks of about this many corrections: big enough that passing
+# them to a worker costs nothing next to applying them, small enough to keep every worker busy until the end
+CORRECTIONS_PER_CHUNK = 2000
+
+CHANGE_LOG_PATTERN = re.compile(r'stanford((\d{4})(\d{2})(\d{2})-\d{2})-changes\.log$')
+READ_SIZE = 65536
+
+# yields (year, month, day, change log path) for every issue in the extracted corrections
+def find_change_logs(path):
+    for year in sorted(os.listdir(path)):
+        if(not os.path.isdir(os.path.join(path, year))):
+            continue
+        for directory in sorted(os.listdir(os.path.join(path, year))):
             for (dirname, year, month, day) in re.findall(r'((\d{4})(\d{2})(\d{2})-\d{2})', directory):
-                tqdm.write(dirname) 
-                path = os.path.join(PATH, year, dirname + ".dir", f"stanford{dirname}-changes.log")
-                with open(path) as f:
-                    xml = f.read()
-                tree = ET.fromstring("<root>" + xml + "</root>")
-                # print(tree, year, month, day)
-                corrections = []
-                files = [os.path.join(LOCATION, year, month, day, file) for file in os.listdir(os.path.join(LOCATION, year, month, day))]
-                print("files", files) 
-                for textCorrectedBlock in tree:
-                    blockID = textCorrectedBlock.attrib["blockID"]
-                    corrections = {} 
-                    for textCorrectedLine in textCorrectedBlock:
-                        oldTextValue = textCorrectedLine.findtext("OldTextValue").strip()
-                        newTextValue = textCorrectedLine.findtext("NewTextValue").strip()
-                        corrections[oldTextValue] = newTextValue
-                if len(corrections) > 0: 
-                    yield files, corrections
-
-for files, corrections in tqdm(create_corrections()):
-    for file in files:
-        print(file)
-        with open(file, "r") as f:
-            lines = f.readlines()
-        with open(file, "w") as f:
-            for line in lines:
-                if line.strip() in corrections:
-                    f.write(corrections[line.strip()] + "\n")
-                else:
-                    f.write(line)
+                yield year, month, day, os.path.join(path, year, dirname + ".dir", f"stanford{dirname}-changes.log")
+
+# yields (blockID, {old line: new line}) for each block in a change log (a binary file object), lines stripped.
+# the log is a list of TextCorrectedBlock elements without a root element, so we feed it to the parser inside
+# one, a chunk at a time, and drop every block once it's been read. Memory doesn't grow with the size of the log.
+def iter_change_log_blocks(f):
+    parser = ET.XMLPullParser(events=('start', 'end'))
+    parser.feed(b"<root>")
+    root = None
+    done = False
+    while(not done):
+        chunk = f.read(READ_SIZE)
+        if(len(chunk) == 0):
+            parser.feed(b"</root>")
+            done = True
+        else:
+            parser.feed(chunk)
+        for event, element in parser.read_events():
+            if(root is None):
+                root = element
+            if(event != 'end' or element.tag != "TextCorrectedBlock"):
+                continue
+            corrections = {}
+            for textCorrectedLine in element:
+                oldTextValue = (textCorrectedLine.findtext("OldTextValue") or "").strip()
+                newTextValue = (textCorrectedLine.findtext("NewTextValue") or "").strip()
+                if(len(oldTextValue) > 0 and oldTextValue != newTextValue):
+                    corrections[oldTextValue] = newTextValue
+            blockID = element.attrib.get("blockID")
+            root.clear() # the finished blocks are all we've got under root
+            if(len(corrections) > 0):
+                yield blockID, corrections
+    parser.close()
+
+# yields (year, month, day, blocks) for every change log in the extracted corrections directory, in sorted order
+def iter_directory_change_logs(path, metrics):
+    for year, month, day, log_path in find_change_logs(path):
+        start = time.perf_counter()
+        with open(log_path, 'rb') as f:
+            blocks = list(iter_change_log_blocks(f))
+        metrics.observe('read_change_logs', time.perf_counter() - start)
+        metrics.count('documents', 'read_change_logs')
+        yield year, month, day, blocks
+
+# same, but reading the change logs straight out of stanford-text-corrections-*.tar.gz as it's decompressed,
+# without extracting anything to disk. 'r|*' reads the archive as a stream, one member after the other, in
+# whatever order they were added to it: tar goes through one year directory at a time, but lists each one in
+# no particular order
+def iter_tarball_change_logs(tarball_path, metrics):
+    with tarfile.open(tarball_path, 'r|*') as tar:
+        for member in tar:
+            match = CHANGE_LOG_PATTERN.search(member.name)
+            if(not member.isfile() or match is None):
+                continue
+            dirname, year, month, day = match.groups()
+            start = time.perf_counter()
+            blocks = list(iter_change_log_blocks(tar.extractfile(member)))
+            metrics.observe('read_change_logs', time.perf_counter() - start)
+            metrics.count('documents', 'read_change_logs')
+            metrics.count('bytes', 'read_change_logs', member.size)
+            yield year, month, day, blocks
+
+# groups the change logs of each day (an issue can have more than one edition, -01, -02) into
+# ((year, month, day), blocks). A day's editions can come anywhere within a group of logs, so days are
+# held until the logs move on to the next group (get_group of the day): the day itself for the sorted
+# directory, the year for a tarball. A day that shows up again after that would be applied twice (and
+# its two halves could race each other), so that's an error
+def iter_issues(change_logs, get_group):
+    waiting = {}
+    done = set()
+    group = None
+    for year, month, day, blocks in change_logs:
+        key = (year, month, day)
+        if(get_group(key) != group):
+            for waiting_key in sorted(waiting):
+                yield waiting_key, waiting[waiting_key]
+            done.update(waiting)
+            waiting = {}
+            group = get_group(key)
+        if(key in done):
+            raise ValueError('the change logs for %s are not together (with --tarball, every year has to be in one place in the archive); '
+                             'extract it and use --corrections instead' % '-'.join(key))
+        waiting.setdefault(key, []).extend(blocks)
+    for waiting_key in sorted(waiting):
+        yield waiting_key, waiting[waiting_key]
+
+# which of the day's files each block goes to. returns {filename: {old line: new line}} and adds to stats
+def assign_blocks(blocks, filenames, lines_by_file, stats):
+    # old line -> indexes of the files that have it
+    wanted = set(old for blockID, corrections in blocks for old in corrections)
+    found_in = {}
+    for i, filename in enumerate(filenames):
+        for line in set(lines_by_file[filename]) & wanted:
+            found_in.setdefault(line, []).append(i)
+
+    file_corrections = {}
+    for blockID, corrections in blocks:
+        counts = {}
+        for old in corrections:
+            for i in found_in.get(old, []):
+                counts[i] = counts.get(i, 0) + 1
+        if(len(counts) == 0):
+            stats['misses'] += len(corrections)
+            continue
+        best = max(counts.values())
+        targets = [i for i, count in counts.items() if count == best]
+        if(len(targets) > 1):
+            stats['ambiguous_blocks'] += 1
+        stats['hits'] += best
+        stats['misses'] += len(corrections) - best
+        for i in targets:
+            file_corrections.setdefault(filenames[i], {}).update(corrections)
+    return file_corrections
+
+# the day's article files, sorted. Hidden files aren't articles (.DS_Store, atomic_writer.py's temp
+# files, some of them maybe still waiting to be renamed), same as in cloudsearch/archives_manifest.py
+def list_day_files(day_path):
+    with os.scandir(day_path) as it:
+        return sorted(entry.name for entry in it if entry.is_file() and not entry.name.startswith('.'))
+
+def apply_issue_corrections(location, year, month, day, blocks, writer, stats, metrics):
+    day_path = os.path.join(location, year, month, day)
+    if(not os.path.isdir(day_path)):
+        stats['missing_issues'] += 1
+        stats['misses'] += sum(len(corrections) for blockID, corrections in blocks)
+        metrics.count('errors', 'read')
+        return
+    start = time.perf_counter()
+    filenames = list_day_files(day_path)
+    raw_by_file = {}
+    lines_by_file = {}
+    for filename in filenames:
+        with open(os.path.join(day_path, filename), 'rb') as f:
+            raw_by_file[filename] = f.read()
+        lines_by_file[filename] = [line.strip() for line in raw_by_file[filename].decode('utf-8').splitlines()]
+        metrics.count('bytes', 'read', len(raw_by_file[filename]))
+    metrics.count('documents', 'read', len(filenames))
+    read_done = time.perf_counter()
+    metrics.observe('read', read_done - start) # one observation per issue, all its files
+
+    misses = stats['misses']
+    file_corrections = assign_blocks(blocks, filenames, lines_by_file, stats)
+    write_start = time.perf_counter()
+    metrics.observe('match', write_start - read_done)
+    metrics.count('documents', 'match', len(file_corrections))
+    metrics.count('errors', 'match', stats['misses'] - misses) # corrections whose old line wasn't found
+
+    for filename, corrections in file_corrections.items():
+        lines = raw_by_file[filename].decode('utf-8').splitlines(keepends=True)
+        new_lines = []
+        for line in lines:
+            if line.strip() in corrections:
+                new_lines.append(corrections[line.strip()] + "\n")
+            else:
+                new_lines.append(line)
+        relpath = '/'.join([year, month, day, filename])
+        data = ''.join(new_lines).encode('utf-8')
+        if(writer.write_if_changed(os.path.join(day_path, filename), data, raw_by_file[filename], relpath)):
+            stats['files_changed'] += 1
+            metrics.count('written', 'write')
+            metrics.count('bytes', 'write', len(data))
+    metrics.observe('write', time.perf_counter() - write_start)
+
+# groups issues into chunks of about CORRECTIONS_PER_CHUNK corrections, the unit of work for the pool.
+# yields (chunk number, [((year, month, day), blocks), ...]). Chunks only run in parallel safely because
+# no two of them touch the same files, so every day has to come in once, with all its logs merged (see iter_issues)
+def iter_issue_chunks(issues, corrections_per_chunk=CORRECTIONS_PER_CHUNK):
+    chunk = []
+    chunk_corrections = 0
+    chunk_number = 0
+    seen = set()
+    for issue in issues:
+        if(issue[0] in seen):
+            raise ValueError('%s came in twice, its corrections would be applied by two chunks at once' % '-'.join(issue[0]))
+        seen.add(issue[0])
+        chunk.append(issue)
+        chunk_corrections += sum(len(corrections) for blockID, corrections in issue[1])
+        if(chunk_corrections >= corrections_per_chunk):
+            yield chunk_number, chunk
+            chunk = []
+            chunk_corrections = 0
+            chunk_number += 1
+    if(len(chunk) > 0):
+        yield chunk_number, chunk
+
+def new_stats():
+    return {'hits': 0, 'misses': 0, 'ambiguous_blocks': 0, 'missing_issues': 0, 'files_changed': 0}
+
+# applies one chunk of issues (in a pool worker). every chunk keeps its own list of the files it changed,
+# so workers never write to the same list. returns (number of issues, stats, metrics snapshot)
+def apply_chunk(location, list_dir, numbered_chunk):
+    chunk_number, chunk = numbered_chunk
+    stats = new_stats()
+    metrics = PipelineMetrics('corrections')
+    writer = AtomicBatchWriter(os.path.join(list_dir, '%06d.txt' % chunk_number))
+    for (year, month, day), blocks in chunk:
+        pool_profiler.tick() # with --profile-issues, stops profiling after that many
+        apply_issue_corrections(location, year, month, day, blocks, writer, stats, metrics)
+    writer.close()
+    return len(chunk), stats, metrics.get_snapshot()
+
+# adds up apply_chunk's results as they come in
+def add_results(results, stats, metrics, progress):
+    for issue_count, chunk_stats, snapshot in results:
+        progress.update(issue_count)
+        for stat in stats:
+            stats[stat] += chunk_stats[stat]
+        metrics.merge(snapshot)
+
+def main():
+    parser = argparse.ArgumentParser(description='apply the Veridian text corrections to the text files')
+    parser.add_argument('--corrections', default=PATH, help='the extracted stanford-text-corrections/stanford directory')
+    parser.add_argument('--tarball', default=None, help='read the change logs straight from stanford-text-corrections-*.tar.gz instead (no need to extract it)')
+    parser.add_argument('--location', default=LOCATION, help='the text files, YYYY/MM/DD/*.txt')
+    parser.add_argument('--workers', type=int, default=POOL_SIZE, help='processes applying corrections, 1 to do it all in this one')
+    pool_profiler.add_profile_arguments(parser, 'issues')
+    args = parser.parse_args()
+    profiling = pool_profiler.get_profiling(args)
+    if(profiling is not None):
+        profiling.start()
+
+    # the change logs are read as the pool asks for more chunks, in its task feeder thread, so the reading
+    # has its own metrics instead of sharing the ones the workers' results are merged into
+    read_metrics = PipelineMetrics('corrections')
+    if(args.tarball is not None):
+        change_logs = iter_tarball_change_logs(args.tarball, read_metrics)
+        get_group = lambda key: key[0] # the year
+    else:
+        change_logs = iter_directory_change_logs(args.corrections, read_metrics)
+        get_group = lambda key: key
+    # issues are handed out as soon as all of their change logs have been read; every issue's files are
+    # independent of every other issue's, so the workers can apply them in any order
+    chunks = iter_issue_chunks(iter_issues(change_logs, get_group))
+    stats = new_stats()
+    metrics = PipelineMetrics('corrections')
+    reset_modified_list_dir(MODIFIED_LIST_DIR)
+    apply = partial(apply_chunk, args.location, MODIFIED_LIST_DIR)
+    with tqdm(desc="applying", unit="issues") as progress:
+        if(args.workers == 1):
+            add_results(map(apply, chunks), stats, metrics, progress)
+        else:
+            with Pool(args.workers) as pool:
+                add_results(pool.imap_unordered(profiling.wrap(apply) if profiling is not None else apply, chunks, chunksize=1),
+                            stats, metrics, progress)
+    metrics.merge(read_metrics.get_snapshot()) # every chunk has been read by now
+    merge_modified_lists(MODIFIED_LIST_DIR, MODIFIED_LIST_PATH)
+    print("%(hits)d corrections applied, %(misses)d not found, %(ambiguous_blocks)d blocks matched more than one file, "
+          "%(missing_issues)d issues not in the text files, %(files_changed)d files changed" % stats)
+    print("changed files are listed in %s" % MODIFIED_LIST_PATH)
+    metrics.write_prometheus(METRICS_PATH)
+    print(metrics.format_summary())
+    print("metrics written to %s" % METRICS_PATH)
+    if(profiling is not None):
+        print("profile written to %s" % ', '.join(profiling.finish()))
+
+if __name__ == '__main__':
+    main()
@@ -8,39 +8,54 @@ import json
 from multiprocessing import Pool
 import time
 import argparse
+import sys
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cloudsearch'))
+from article_pack import open_archives_text, ArticlePack
+from work_scheduler import plan_chunks, filter_entries_by_year, get_chunk_manifest, describe_plan
+from repeats import remove_repeats
+from text_normalizer import split_article, normalize_article, normalize_body
+from atomic_writer import AtomicBatchWriter, reset_modified_list_dir, merge_modified_lists
+from pipeline_metrics import PipelineMetrics
+import pool_profiler
 
-ARCHIVES_TEXT_PATH = './cloudsearch/archives-text/'
 
-# for multiprocessing; set this to a reasonable number.
-POOL_SIZE = 123
+ARCHIVES_TEXT_PATH = './cloudsearch/archives-text/' # a pack of it (see cloudsearch/article_pack.py) can be read, but not fixed
 
-class Logger:
-    def __init__(self, path, basename):
-        self.fullpath = path + basename + '.log'
-        f = open(self.fullpath, 'w')
-        f.write("logger start\n")
-        f.close()
+# index of every article in ARCHIVES_TEXT_PATH, see cloudsearch/archives_manifest.py. loaded once per run
+# (before the Pool forks, so workers share it instead of each listing directories)
+MANIFEST = None
 
-    def log(self, message):
-        f = open(self.fullpath, 'a') # open and close here for live updates
-        f.write(message + "\n")
-        f.close()
+def get_manifest():
+    global MANIFEST
+    if(MANIFEST is None):
+        MANIFEST = open_archives_text(ARCHIVES_TEXT_PATH).load_manifest()
+    return MANIFEST
 
-    def get_fullpath(self):
-        return self.fullpath
+# relative paths (inside ARCHIVES_TEXT_PATH) of every article the last run changed, for archives-text-git.sh.
+# workers write their own lists to MODIFIED_LIST_DIR while running
+MODIFIED_LIST_PATH = './fix-repeats-modified.txt'
+MODIFIED_LIST_DIR = './fix-repeats-modified/'
+METRICS_PATH = './metrics/fix-repeats.prom' # per stage timings and counters of the last run, see cloudsearch/pipeline_metrics.py
+
+# for multiprocessing; set this to a reasonable number. The corpus is split into chunks of about
+# equal size (see cloudsearch/work_scheduler.py), so there's no point in more processes than cores.
+POOL_SIZE = os.cpu_count()
 
-    def __del__(self):
-        f = open(self.fullpath, 'a') # open and close here for live updates
-        f.write("logger done\n")
-        f.close()
-        
 class ArchivesTextProcessor:
-    def __init__(self, base_path, startYear, endYear):
-        self.base_path = base_path
+    # writer: an AtomicBatchWriter, which the caller has to close when done. by default every changed file is written right away
+    # metrics: PipelineMetrics the stages are timed into, by default one of its own
+    def __init__(self, base_path, startYear, endYear, manifest=None, writer=None, metrics=None):
+        self.archive = open_archives_text(base_path)
+        self.base_path = os.path.join(base_path, '')
+        self.writer = writer if writer is not None else AtomicBatchWriter(fsync_batch_size=1)
+        self.currentArticleBytes = None
+        self.manifest = manifest if manifest is not None else self.archive.load_manifest()
         self.startYear = startYear
         self.endYear = endYear
         self.is_done = False
+        self.repeats_removed = {} # kind of repeat -> number of articles, see cloudsearch/repeats.py
+        self.metrics = metrics if metrics is not None else PipelineMetrics('fix_repeats')
 
         # initialize some data
         self.years_left = list(range(startYear, endYear))
@@ -73,40 +88,20 @@ class ArchivesTextProcessor:
         elif(level == 'article'):
             return self.base_path + str(self.currentYear).zfill(4) + '/' + str(self.currentMonth).zfill(2) + '/' + str(self.currentDay).zfill(2) + '/' + self.currentArticle
 
+    # path of the current article relative to base_path, e.g. 1969/03/02/MODSMD_ARTICLE4.article.txt
+    def get_current_relpath(self):
+        return str(self.currentYear).zfill(4) + '/' + str(self.currentMonth).zfill(2) + '/' + str(self.currentDay).zfill(2) + '/' + self.currentArticle
 
+    # the manifest hands back fresh sorted lists, which we pop from as we go
     def set_months_left_in_year(self):
-        months = os.listdir(self.get_current_path('year'))
-        filtered_months = []
-        for i in range(0, len(months)):
-            try:
-                filtered_months.append(int(months[i]))
-            except:
-                continue
-        filtered_months.sort()
-        self.months_left_in_year = filtered_months
+        self.months_left_in_year = self.manifest.months(self.currentYear)
 
     def set_days_left_in_month(self):
-        days = os.listdir(self.get_current_path('month'))
-        filtered_days = []
-        for i in range(0, len(days)):
-            try:
-                filtered_days.append(int(days[i]))
-            except:
-                continue
-        filtered_days.sort()
-        self.days_left_in_month = filtered_days
+        self.days_left_in_month = self.manifest.days(self.currentYear, self.currentMonth)
 
     def set_articles_left_in_day(self):
-        articles = os.listdir(self.get_current_path('day'))
-        filtered_articles = []
-        for i in range(0, len(articles)):
-            try:
-                filtered_articles.append(articles[i])
-            except:
-                continue
-        filtered_articles.sort()
-        self.articles_left_in_day = filtered_articles
-        
+        self.articles_left_in_day = self.manifest.articles(self.currentYear, self.currentMonth, self.currentDay)
+
     # returns -1 if we can't move anymore (i.e. we're done), 1 on success
     def move_to_next_year(self):
         if(len(self.years_left) == 0):
@@ -147,50 +142,61 @@ class ArchivesTextProcessor:
     """
     fns for processing text and removing repeats
     """
-    # detects if text has repeated substrings and removes if true
-    # this seems like a leetcode problem lol. I'm using this as a ref https://www.geeksforgeeks.org/python-check-if-string-repeats-itself/
+    # removes the extra copies extract-text.js appends to some articles, see cloudsearch/repeats.py
     def removeRepeats(self, text):
-        if(len(text) < 2):
-            return text
-        
-        res = None
-        temp = (text + text).find(text, 1, -1)
-        if(temp != -1):
-            res = text[:temp]
-            return res
+        start = time.perf_counter()
+        text, repeat = remove_repeats(text)
+        self.metrics.observe('dedupe', time.perf_counter() - start)
+        if(repeat is not None):
+            self.repeats_removed[repeat.kind] = self.repeats_removed.get(repeat.kind, 0) + 1
+            self.metrics.count('repeats_removed', 'dedupe')
         return text
 
+    # returns the fixed article text, or None if the file can't be read or is empty.
+    # the file's bytes are kept in self.currentArticleBytes so fix_current_article_data can tell if anything changed
     def get_current_article_data(self):
-        with open(self.get_current_path('article'), 'r') as f:
-            articleRawText = ''
-            try:
-                articleRawText = f.read()
-            except:
-                print("error: %s", self.get_current_path('article'))
-                return ""
-            articleLines = articleRawText.splitlines()
-            if(len(articleLines) == 0):
-                print("error: %s", self.get_current_path('article'))
-                return ""
-            articleStart = ''
-            for i in range(0, 3):
-                articleLines[i] += '\n'
-            articleStart = articleStart.join(articleLines[0:3])
-
-            articleText = ''
-            for i in range(3, len(articleLines)):
-                articleLines[i] = re.sub('\s+', ' ', articleLines[i]).strip()
-                articleLines[i] += '\n'
-            articleTextJoined = articleText.join(articleLines[3:])
-            articleText = self.removeRepeats(articleTextJoined)
-
-            return articleStart + articleText
-
+        pool_profiler.tick() # with --profile-articles, stops profiling after that many
+        start = time.perf_counter()
+        self.currentArticleBytes = self.archive.read(self.get_current_relpath())
+        read_done = time.perf_counter()
+        self.metrics.observe('read', read_done - start)
+        self.metrics.count('bytes', 'read', len(self.currentArticleBytes))
+        self.metrics.count('documents', 'read')
+        try:
+            articleRawText = self.currentArticleBytes.decode('utf-8')
+        except:
+            print("error: %s", self.get_current_path('article'))
+            self.metrics.count('errors', 'parse')
+            return None
+        if(len(articleRawText) == 0):
+            print("error: %s", self.get_current_path('article'))
+            self.metrics.count('errors', 'parse')
+            return None
+        # header lines as they are, body lines with their whitespace collapsed (see cloudsearch/text_normalizer.py)
+        articleNormalized, changed = normalize_article(articleRawText)
+        if(changed):
+            self.metrics.count('normalized', 'parse')
+        articleStart, articleBody = split_article(articleNormalized)
+        self.metrics.observe('parse', time.perf_counter() - read_done)
+        articleText = self.removeRepeats(articleBody)
+        if(len(articleText) != len(articleBody)):
+            # a repeat can start in the middle of a line, so the first copy may not end with a clean '\n'
+            articleText = normalize_body(articleText)
+
+        return articleStart + articleText
+
+    # only rewrites the file if the fixed text is different, see cloudsearch/atomic_writer.py.
+    # the archive has to be a directory, see check_archive_writable
     def fix_current_article_data(self):
         newArticleData = self.get_current_article_data()
-        f = open(self.get_current_path('article'), 'w')
-        f.write(newArticleData)
-        f.close()
+        if(newArticleData is not None):
+            path = self.get_current_path('article')
+            start = time.perf_counter()
+            data = newArticleData.encode('utf-8')
+            if(self.writer.write_if_changed(path, data, self.currentArticleBytes, self.get_current_relpath())):
+                self.metrics.count('written', 'write')
+                self.metrics.count('bytes', 'write', len(data))
+            self.metrics.observe('write', time.perf_counter() - start)
         self.move_to_next_article()
 
     def pretty_print_current_article_data(self):
@@ -202,16 +208,45 @@ class ArchivesTextProcessor:
     def are_we_done(self):
         return self.is_done
 
-def process_year(year):
-    yearProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, year, year + 1)
-    print("starting to process year %d" % year)
-    while(not yearProcessor.are_we_done()):
-        yearProcessor.fix_current_article_data()
-    print("done with processing year %d" % year)
-
-def processYears(startYear, endYear):
+# fixes every article in a chunk of roughly equal size from work_scheduler.plan_chunks (in a pool worker)
+def process_chunk(chunk):
+    chunkManifest, startYear, endYear = get_chunk_manifest(chunk)
+    writer = AtomicBatchWriter(os.path.join(MODIFIED_LIST_DIR, chunk['label'] + '.txt'))
+    chunkProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, startYear, endYear, chunkManifest, writer)
+    print("starting to process chunk %s (%d bytes)" % (chunk['label'], chunk['size']))
+    while(not chunkProcessor.are_we_done()):
+        chunkProcessor.fix_current_article_data()
+    writer.close()
+    print("done with processing chunk %s, %d files changed, %d unchanged, repeats removed: %s" % (chunk['label'], writer.stats['written'], writer.stats['unchanged'], chunkProcessor.repeats_removed))
+    return chunk['label'], chunkProcessor.metrics.get_snapshot()
+
+# a pack is read only, so there's nothing to write the fixed articles to. checked once up front, not in every worker
+def check_archive_writable():
+    archive = open_archives_text(ARCHIVES_TEXT_PATH)
+    if(isinstance(archive, ArticlePack)):
+        raise ValueError('%s is a pack, which is read only. run fix-repeats on the archives-text directory and pack it again' % archive.path)
+
+# splits the years into chunks of about equal size and keeps all POOL_SIZE workers busy with them, largest first.
+# the workers' metrics are added up and written to METRICS_PATH at the end.
+# profiling: a pool_profiler.Profiling to profile the workers with, or None
+def processYears(startYear, endYear, profiling=None):
+    check_archive_writable()
+    metrics = PipelineMetrics('fix_repeats')
+    start = time.perf_counter()
+    entries = filter_entries_by_year(get_manifest().entries, startYear, endYear)
+    metrics.observe('walk', time.perf_counter() - start)
+    chunks = plan_chunks(entries, POOL_SIZE)
+    print("fix-repeats plan: %s" % describe_plan(chunks))
+    # every worker keeps its own list of the files it changed, so they never write to the same file
+    reset_modified_list_dir(MODIFIED_LIST_DIR)
+    task = profiling.wrap(process_chunk) if profiling is not None else process_chunk
     with Pool(POOL_SIZE) as p:
-        p.map(process_year, list(range(startYear, endYear + 1)))
+        for label, snapshot in p.imap_unordered(task, chunks, chunksize=1):
+            metrics.merge(snapshot)
+    print("%d files changed, listed in %s" % (merge_modified_lists(MODIFIED_LIST_DIR, MODIFIED_LIST_PATH), MODIFIED_LIST_PATH))
+    metrics.write_prometheus(METRICS_PATH)
+    print(metrics.format_summary())
+    print("metrics written to %s" % METRICS_PATH)
 
 def print_num(num):
     print(num)
@@ -223,7 +258,8 @@ def pool_test(startYear, endYear):
 
 def tests():
     print('tests:')
-    testProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, 1901, 1902)
+    check_archive_writable()
+    testProcessor = ArchivesTextProcessor(ARCHIVES_TEXT_PATH, 1901, 1902, get_manifest())
 
     # uncomment if you want to see some article data be printed out
     for i in range(10):
@@ -233,22 +269,28 @@ def tests():
     print('if you compare with https://github.com/TheStanfordDaily/archives-text/tree/master/1899/12 you should see matching results')
     
 # multiprocessed full upload of archives text
-def process_archives_text():
-    processYears(1892, 2014)
+def process_archives_text(profiling=None):
+    processYears(1892, 2014, profiling)
 
 def main():
     parser = argparse.ArgumentParser(description='process args')
     parser.add_argument('argnum', metavar='argnum', type=int, nargs=1)
+    pool_profiler.add_profile_arguments(parser)
     args = parser.parse_args()
     argnum = args.argnum[0]
+    profiling = pool_profiler.get_profiling(args)
+    if(profiling is not None):
+        profiling.start()
     if(argnum == 0):
         print("test!")
     elif(argnum == 1):
         tests()
     elif(argnum == 2):
-        process_archives_text()
+        process_archives_text(profiling)
     else:
         print("invalid argnum")
+    if(profiling is not None):
+        print("profile written to %s" % ', '.join(profiling.finish()))
     
 
 